@@ -1,6 +1,6 @@
 """bluesky"""
 
-__version_info__ = (4,1,33)
+__version_info__ = (4,2,0)
 __version__ = '.'.join([str(n) for n in __version_info__])
 
 __author__ = "Joel Dubowy"
@@ -15,6 +15,15 @@ _VSMOKE_IMAGES_PATH = os.path.join(_REPO_ROOT_DIR,
 _DEFAULTS = {
     "skip_failed_fires": False,
     "skip_failed_sources": False,
+    # Active areas with at least this many specified points store them
+    # in a compact, array-backed CompactSpecifiedPoints object
+    "compact_specified_points_threshold": None,
+    # Executor used by modules for per-fire processing
+    "executor": {
+        "type": "serial",  # or 'process_pool'
+        "num_processes": None,  # defaults to number of CPUs
+        "chunksize": None  # defaults to fires / (4 * num_processes)
+    },
     "statuslogging": {
         "enabled": False,
         "api_endpoint": None,
@@ -85,13 +94,17 @@ _DEFAULTS = {
         "truncation_percentage_threshold": 90.0,
         "truncation_count_threshold": 5,
         # Allow summed fuel percentages to be between 99.5% and 100.5%
-        "total_pct_threshold": 0.5
+        "total_pct_threshold": 0.5,
+
+        "lookup_cache": False,
+        "lookup_cache_file": None
 
     },
     "consumption": {
         "fuel_loadings": {},
         "default_ecoregion": None,
         "ecoregion_lookup_implemenation": "ogr",
+        "batch_fuelbeds": False,
         "consume_settings": {
             # TODO: Confirm with Susan P, Susan O. to confirm that these
             #    burn-type specific settings (defaults and synonyms) are
@@ -150,7 +163,9 @@ _DEFAULTS = {
     "emissions": {
         # Note that 'efs' is deprecated, and so is not listed here
         "model": "prichard-oneill",
+        "engine": "python",
         "include_emissions_details": False,
+        "calculator_cache_size": 1024,
         "species": [],
         "fuel_loadings": {}
     },
@@ -185,6 +200,12 @@ _DEFAULTS = {
 
     "plumerise": {
         "model": "feps",
+        # Number of locations for which to compute FEPS plumerise at once,
+        # each in its own worker process and working directory
+        "num_workers": 1,
+        # Number of decimal places to round lat/lng to when caching
+        # sunrise and sunset hours computed for FEPS plumerise
+        "sun_cache_precision": 2,
         "feps": {
             "working_dir": None
             # The following defaults are defined in the plumerise
@@ -217,6 +238,11 @@ _DEFAULTS = {
             "fire_locations_filename": "fire_locations.csv",
             "fire_events_filename": "fire_events.csv"
 
+        },
+        "smokeready": {
+            "fips_cache_precision": None,
+            "fips_cache_file": None,
+            "fips_api_fallback": False
         }
     },
     "dispersion": {
@@ -426,6 +452,23 @@ _DEFAULTS = {
             "NPROCESSES": 1,
             "NFIRES_PER_PROCESS": -1,
             "NPROCESSES_MAX": -1,
+            # How to split fires among processes: "COUNT" - the same number
+            # of fires per process; "COST" - balancing estimated cost
+            # (emitting hours times vertical levels) per process
+            "TRANCHE_BALANCING": "COUNT",
+            # Whether to group nearby fires in the same process
+            "TRANCHE_CLUSTERING": False,
+            # Max number of HYSPLIT processes to run at once; additional
+            # tranches are queued.  Defaults to the number of cpus
+            # (divided by NCPUS, if running with MPI)
+            "MAX_CONCURRENT_PROCESSES": None,
+            # Whether to merge tranches' output with numpy, via the
+            # netCDF4 package, instead of with ncea and ncks
+            "MERGE_TRANCHES_IN_PROCESS": False,
+            # Local scratch directory (e.g. "/dev/shm") to which to copy
+            # met files before running HYSPLIT; by default, met files are
+            # sym linked into the working directory
+            "MET_SCRATCH_DIR": None,
 
             # Machines file (TODO: functionality for multiple nodes)
             #MACHINEFILE": machines,
@@ -15,6 +15,7 @@ from bluesky.config import Config
 from bluesky.exceptions import BlueSkyConfigurationError
 
 __all__ = [
+    "_get_settings",
     "_apply_settings",
     "FuelLoadingsManager",
     "FuelConsumptionForEmissions",
@@ -45,7 +46,11 @@ SETTINGS['all']['output_units'] = {
     'default': "tons_ac"
 }
 
-def _apply_settings(fc, location, burn_type):
+def _get_settings(location, burn_type):
+    """Returns the consume settings for the given location and burn type,
+    as a dict keyed by FuelConsumption attribute name
+    """
+    settings = {}
     valid_settings = dict(SETTINGS[burn_type], **SETTINGS['all'])
     for field, d in valid_settings.items():
         value = None
@@ -67,13 +72,19 @@ def _apply_settings(fc, location, burn_type):
                 value = location[defined_fields[0]]
 
         if value:
-            setattr(fc, field, value)
+            settings[field] = value
         elif 'default' in d:
-            setattr(fc, field, d['default'])
+            settings[field] = d['default']
         else:
             raise BlueSkyConfigurationError("Specify {} for {} burns".format(
                 field, burn_type))
 
+    return settings
+
+def _apply_settings(fc, location, burn_type):
+    for field, value in _get_settings(location, burn_type).items():
+        setattr(fc, field, value)
+
 class FuelLoadingsManager(object):
 
     FUEL_LOADINGS_KEY_MAPPINGS = {
@@ -154,6 +165,15 @@ fuelbed_number,filename,cover_type,ecoregion,overstory_loading,midstory_loading,
         self._default_fccsdb_obj = None # lazy instantiate
         self._custom = {}
 
+    def __getstate__(self):
+        # The custom fuel loadings csv files (which are open temp files) and
+        # the default FCCS db object are regenerated as needed after
+        # unpickling, e.g. in worker processes
+        state = dict(self.__dict__)
+        state['_custom'] = {}
+        state['_default_fccsdb_obj'] = None
+        return state
+
     ##
     ## Public Interface
     ##
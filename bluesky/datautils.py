@@ -6,7 +6,9 @@ TODO: Remove this module and update all imports of this module to import
 
 __author__ = "Joel Dubowy"
 
+import copy
 import itertools
+import math
 
 from pyairfire.data.utils import (
     deepmerge,
@@ -21,28 +23,124 @@ def summarize_fuelbeds(obj, key):
     locations = [loc for loc in locations if loc.get('fuelbeds')]
     obj[key] = summarize(locations, key, include_details=False)
 
-def summarize_all_levels(fires_manager, key):
+def summarize_all_levels(fires_manager, *keys):
     """Aggregates data over all fuelbeds - per active_area,
     per activity collection, per fire, and across all fires
 
     Includes only per-phase totals, not per category > sub-category > phase
+
+    All keys are summarized in a single, bottom-up traversal.  Only each
+    location's fuelbeds are summarized; every other level's summary,
+    including the one across all fires, is the sum of its children's.
     """
+    fires_summaries = []
     for fire in fires_manager.fires:
         with fires_manager.fire_failure_handler(fire):
+            ac_summaries = []
             for ac in fire.get('activity', []):
+                aa_summaries = []
                 for aa in ac.active_areas:
+                    loc_summaries = []
                     for loc in aa.locations:
-                        summarize_fuelbeds(loc, key)
-                    summarize_fuelbeds(aa, key)
-                summarize_fuelbeds(ac, key)
-            summarize_fuelbeds(fire, key)
-
-    summarize_over_all_fires(fires_manager, key)
-
-def summarize_over_all_fires(fires_manager, key):
-    # summarise over all activity objects
-    all_locations = list(itertools.chain.from_iterable(
-        [f.locations for f in fires_manager.fires]))
-    all_locations = [loc for loc in all_locations if loc.get('fuelbeds')]
-    summary = dict({key: summarize(all_locations, key)})
+                        loc_summaries.append(_Summary.from_locations([loc], keys))
+                        loc_summaries[-1].set(loc)
+                    aa_summaries.append(_Summary.combine(loc_summaries, keys))
+                    aa_summaries[-1].set(aa)
+                ac_summaries.append(_Summary.combine(aa_summaries, keys))
+                ac_summaries[-1].set(ac)
+            fires_summaries.append(_Summary.combine(ac_summaries, keys))
+            fires_summaries[-1].set(fire)
+
+    for key in keys:
+        summarize_over_all_fires(fires_manager, key,
+            fires_summaries=fires_summaries)
+
+class _Summary(object):
+    """Summaries of a set of locations, for one or more keys
+
+    Summaries include per category > sub-category details, which are
+    needed for the summary across all fires, but only the per-phase
+    totals are set on fires, activity collections, active areas, and
+    locations.
+    """
+
+    def __init__(self, summaries, has_fuelbeds):
+        self.summaries = summaries
+        self.has_fuelbeds = has_fuelbeds
+
+    @classmethod
+    def from_locations(cls, locations, keys):
+        locations = [loc for loc in locations if loc.get('fuelbeds')]
+        return cls({key: summarize(locations, key) for key in keys},
+            bool(locations))
+
+    @classmethod
+    def combine(cls, children, keys):
+        children = [c for c in children if c.has_fuelbeds]
+        if not children:
+            return cls.from_locations([], keys)
+        if len(children) == 1:
+            return children[0]
+        return cls({key: _add_summaries([c.summaries[key] for c in children])
+            for key in keys}, True)
+
+    def set(self, obj):
+        for key, summary in self.summaries.items():
+            obj[key] = {'summary': copy.deepcopy(summary['summary'])}
+
+def _add_summaries(summaries):
+    """Adds up summaries, key by key, in the order given, summing values
+    with math.fsum
+    """
+    r = _add_nested_data([{k: v for k, v in s.items() if k != 'summary'}
+        for s in summaries])
+
+    # keep 'total' last, as in summaries returned by summarize
+    keys = []
+    for s in summaries:
+        keys.extend([k for k in s['summary'] if k != 'total' and k not in keys])
+    keys.append('total')
+    r['summary'] = {k: math.fsum([s['summary'].get(k, 0.0) for s in summaries])
+        for k in keys}
+
+    return r
+
+def _add_nested_data(data):
+    """Adds up nested dicts of arrays, element by element"""
+    values = {}
+    for d in data:
+        for k, v in d.items():
+            values.setdefault(k, []).append(v)
+
+    return {k: (_add_nested_data(v) if isinstance(v[0], dict) else
+        [math.fsum(e) for e in itertools.zip_longest(*v, fillvalue=0.0)])
+        for k, v in values.items()}
+
+def summarize_over_all_fires(fires_manager, key, fires_summaries=None):
+    """Summarizes over all fires, adding up fires_summaries, the per-fire
+    summaries from summarize_all_levels, if specified
+    """
+    if fires_summaries is None:
+        # summarise over all activity objects
+        all_locations = list(itertools.chain.from_iterable(
+            [f.locations for f in fires_manager.fires]))
+        fires_summaries = [_Summary.from_locations(all_locations, [key])]
+
+    # If fires are being streamed through one at a time, fold in the
+    # totals from fires that have already been processed and written out
+    streamed_totals = None
+    if getattr(fires_manager, 'streaming', False):
+        streamed_totals = fires_manager.streamed_totals(key)
+        if streamed_totals:
+            fires_summaries = fires_summaries + [_Summary.from_locations(
+                [{'fuelbeds': [{key: streamed_totals}]}], [key])]
+
+    summary = {key: copy.deepcopy(
+        _Summary.combine(fires_summaries, [key]).summaries[key])}
+
+    if streamed_totals is not None:
+        streamed_totals.clear()
+        streamed_totals.update({k: v for k, v in summary[key].items()
+            if k != 'summary'})
+
     fires_manager.summarize(**summary)
@@ -15,15 +15,18 @@ import itertools
 import logging
 import os
 import shutil
+from collections import OrderedDict
 from datetime import timedelta
 
 from pyairfire import osutils
-from afdatetime import parsing as datetime_parsing
 
 from bluesky import datautils, locationutils
 from bluesky.config import Config
-from bluesky.datetimeutils import parse_utc_offset
+from bluesky.datetimeutils import (
+    format_hourly_key, parse_hourly_key
+)
 from bluesky.models.fires import Fire
+from bluesky.models.hourly import HourlySeries
 from . import firemerge
 
 
@@ -218,7 +221,8 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
         emissions = self._get_emissions(loc)
         timeprofiled_emissions = self._get_timeprofiled_emissions(
             timeprofile, emissions)
-        timeprofiled_area = {dt: e.get('area_fraction') * loc['area'] for dt,e in timeprofile.items()}
+        timeprofiled_area = HourlySeries(timeprofile.start_hour,
+            timeprofile.array('area_fraction') * loc['area'])
 
         # consumption = datautils.sum_nested_data(
         #     [fb.get("consumption", {}) for fb in a['fuelbeds']], 'summary', 'total')
@@ -250,17 +254,21 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
     def _get_plumerise_and_timeprofile(self, loc, utc_offset):
         # TODO: only include plumerise and timeprofile keys within model run
         # time window; and somehow fill in gaps (is this possible?)
-        all_plumerise = loc.get('plumerise', {})
-        all_timeprofile = loc.get('timeprofile', {})
-        plumerise = {}
-        timeprofile = {}
-        for i in range(self._num_hours):
-            local_dt = self._model_start + timedelta(hours=(i + utc_offset))
-            # TODO: will all_plumerise and all_timeprofile always
-            #    have string value keys
-            local_dt = local_dt.strftime('%Y-%m-%dT%H:%M:%S')
-            plumerise[local_dt] = all_plumerise.get(local_dt) or self.MISSING_PLUMERISE_HOUR
-            timeprofile[local_dt] = all_timeprofile.get(local_dt) or self.MISSING_TIMEPROFILE_HOUR
+        local_start = self._model_start + timedelta(hours=utc_offset)
+        timeprofile = HourlySeries.from_dict(loc.get('timeprofile') or {},
+            local_start, self._num_hours, self.MISSING_TIMEPROFILE_HOUR)
+        try:
+            plumerise = HourlySeries.from_dict(loc.get('plumerise') or {},
+                local_start, self._num_hours, self.MISSING_PLUMERISE_HOUR)
+        except ValueError:
+            # e.g. the number of plume heights varies by hour; fall back
+            # on the dict representation
+            all_plumerise = loc.get('plumerise', {})
+            plumerise = {}
+            for i in range(self._num_hours):
+                local_dt = format_hourly_key(local_start + timedelta(hours=i))
+                plumerise[local_dt] = (all_plumerise.get(local_dt)
+                    or self.MISSING_PLUMERISE_HOUR)
 
         return plumerise, timeprofile
 
@@ -275,15 +283,13 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
         return emissions
 
     def _get_timeprofiled_emissions(self, timeprofile, emissions):
-        timeprofiled_emissions = {}
-        for dt in timeprofile:
-            timeprofiled_emissions[dt] = {}
-            for e in self.SPECIES:
-                timeprofiled_emissions[dt][e] = sum([
-                    timeprofile[dt][p] * emissions[p].get(e, 0.0)
-                        for p in PHASES
-                ])
-        return timeprofiled_emissions
+        timeprofiled_emissions = OrderedDict()
+        for e in self.SPECIES:
+            timeprofiled_emissions[e] = sum([
+                timeprofile.array(p) * emissions[p].get(e, 0.0)
+                    for p in PHASES
+            ])
+        return HourlySeries(timeprofile.start_hour, timeprofiled_emissions)
 
 
     def _get_heat(self, fire, loc):
@@ -308,11 +314,10 @@ class DispersionBase(object, metaclass=abc.ABCMeta):
         return heat
 
     def _get_utc_offset(self, aa):
-        utc_offset = aa.get('utc_offset')
-        return parse_utc_offset(utc_offset) if utc_offset else 0.0
+        return aa.parsed_utc_offset if aa.get('utc_offset') else 0.0
 
     def _convert_keys_to_datetime(self, d):
-        return { datetime_parsing.parse(k): v for k, v in d.items() }
+        return { parse_hourly_key(k): v for k, v in d.items() }
 
 
     def _archive_file(self, filename, src_dir=None, suffix=None):
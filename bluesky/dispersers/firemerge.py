@@ -5,15 +5,19 @@ import uuid
 from collections import defaultdict
 
 import afconfig
-from afdatetime import parsing as datetime_parsing
 
+from bluesky.datetimeutils import parse_hourly_key
 from bluesky.exceptions import BlueSkyConfigurationError
 from bluesky.models.fires import Fire
+from bluesky.models.hourly import HourlySeries
 from bluesky import locationutils
 
 class BaseFireMerger(object):
 
     def _sum_data(self, data1, data2):
+        if isinstance(data1, HourlySeries) and data1.is_aligned_with(data2):
+            return data1 + data2
+
         summed_data = {}
         for k in set(data1.keys()).union(data2.keys()):
             if k not in data1:
@@ -122,17 +126,24 @@ class FireMerger(BaseFireMerger):
         return new_f_merged
 
     def _merge_hourly_data(self, data1, data2, start2):
-        pruned_data2 = {k: v for k, v in data2.items()
-            if self._on_or_after(k, start2)}
+        if isinstance(data1, HourlySeries) and data1.is_aligned_with(data2):
+            return data1.splice(data2, parse_hourly_key(start2))
+
+        # parse start2 once, if necessary, rather than for each hour
+        start2_dt = None
+        pruned_data2 = {}
+        for k, v in data2.items():
+            # make sure same type, and convert to datetimes if not
+            if type(k) == type(start2):
+                on_or_after = k >= start2
+            else:
+                if start2_dt is None:
+                    start2_dt = parse_hourly_key(start2)
+                on_or_after = parse_hourly_key(k) >= start2_dt
+            if on_or_after:
+                pruned_data2[k] = v
         return dict(data1, **pruned_data2)
 
-    def _on_or_after(self, dt1, dt2):
-        # make sure same type, and convert to datetimes if not
-        if type(dt1) != type(dt2):
-            dt1 = datetime_parsing.parse(dt1)
-            dt2 = datetime_parsing.parse(dt2)
-        return dt1 >= dt2
-
 
 
 class PlumeMerger(BaseFireMerger):
@@ -50,15 +50,20 @@ import logging
 import math
 import os
 import shutil
+import sys
 # import tarfile
 import threading
+import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 
 from afdatetime.parsing import parse_datetime
 
 from bluesky import io
 from bluesky.config import Config
+from bluesky.exceptions import BlueSkyConfigurationError
 from bluesky.models.fires import Fire
+from bluesky.models.hourly import get_hour
 from .. import (
     DispersionBase, GRAMS_PER_TON, SQUARE_METERS_PER_ACRE, PHASES
 )
@@ -147,6 +152,13 @@ def _get_binaries(config_getter):
             or d['default'])
     return binaries
 
+def _get_peak_rss_kb(rusage):
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return rusage.ru_maxrss // 1024
+    return rusage.ru_maxrss
+
+
 class HYSPLITDispersion(DispersionBase):
     """ HYSPLIT Dispersion model
 
@@ -163,6 +175,8 @@ class HYSPLITDispersion(DispersionBase):
         self._set_met_info(copy.deepcopy(met_info))
         self._output_file_name = self.config('output_file_name')
         self._has_parinit = []
+        self._tranches_info = None
+        self._met_stager = None
 
     def _required_activity_fields(self):
         return ('timeprofile', 'plumerise', 'emissions')
@@ -176,27 +190,32 @@ class HYSPLITDispersion(DispersionBase):
         dispersion_offset = int(self.config("DISPERSION_OFFSET") or 0)
         self._model_start += datetime.timedelta(hours=dispersion_offset)
         self._num_hours -= dispersion_offset
-        self._adjust_dispersion_window_for_available_met()
 
-        self._set_grid_params()
-        self._set_reduction_factor()
-        self._compute_tranches()
-        hysplit_utils.fill_in_dummy_fires(self._fire_sets, self._fires,
-            self._num_processes, self._model_start, self._num_hours,
-            self._grid_params)
-
-        if 1 < self._num_processes:
-                # hysplit_utils.create_fire_tranches will log number of processes
-                # and number of fires each
-                self._run_parallel(wdir)
-        else:
-            self._run_process(self._fires, wdir)
+        try:
+            self._stage_met(wdir)
+            self._set_grid_params()
+            self._set_reduction_factor()
+            self._compute_tranches()
+            hysplit_utils.fill_in_dummy_fires(self._fire_sets, self._fires,
+                self._num_processes, self._model_start, self._num_hours,
+                self._grid_params)
+
+            if 1 < self._num_processes:
+                    # hysplit_utils.create_fire_tranches will log number of processes
+                    # and number of fires each
+                    self._run_parallel(wdir)
+            else:
+                self._run_process(self._fires, wdir)
+
+        finally:
+            if self._met_stager:
+                self._met_stager.cleanup()
 
         # Note: DispersionBase.run will add directory, start_time,
         #  and num_hours to the response dict
         self._met_info.pop('hours')
         self._met_info['files'] = list(self._met_info['files'])
-        return {
+        r = {
             "output": {
                 "grid_filetype": "NETCDF",
                 "grid_filename": self._output_file_name,
@@ -210,6 +229,9 @@ class HYSPLITDispersion(DispersionBase):
                 "all": bool(self._has_parinit) and all(self._has_parinit)
             }
         }
+        if self._tranches_info:
+            r["tranches"] = self._tranches_info
+        return r
 
     ##
     ## Seting met info
@@ -251,6 +273,15 @@ class HYSPLITDispersion(DispersionBase):
             self._met_info['files'].add(self._get_met_file(met_file_info))
             self._met_info['hours'].update(self._get_met_hours(met_file_info))
 
+    def _stage_met(self, wdir):
+        """Adjusts the dispersion window for the available met and stages
+        the met files, once for all HYSPLIT processes
+        """
+        self._adjust_dispersion_window_for_available_met()
+        self._met_stager = hysplit_utils.MetStager(self._met_info['files'],
+            scratch_dir=self.config("MET_SCRATCH_DIR"))
+        self._met_stager.stage(wdir)
+
     def _adjust_dispersion_window_for_available_met(self):
         n = 0
         while n < self._num_hours:
@@ -323,50 +354,97 @@ class HYSPLITDispersion(DispersionBase):
         self._num_processes = hysplit_utils.compute_num_processes(
             len(self._fire_sets), **tranching_config)
 
-    def _run_parallel(self, working_dir):
-        runner = self
-        class T(threading.Thread):
-            def  __init__(self, fires, config, working_dir, tranche_num):
-                super(T, self).__init__()
-                self.fires = fires
-                self.config = config
-                self.working_dir = working_dir
-                if not os.path.exists(working_dir):
-                    os.makedirs(working_dir)
-                self.tranche_num = tranche_num
-                self.exc = None
-
-            def run(self):
-                # We need to set config to what was loaded in the main thread.
-                # Otherwise, we'll just be using defaults
-                Config().set(self.config)
-                try:
-                    runner._run_process(self.fires, self.working_dir,
-                        self.tranche_num)
-                except Exception as e:
-                    self.exc = e
-
+    def _create_fire_tranches(self):
+        num_levels = self.num_output_quantiles + 1
+        balancing = (self.config("TRANCHE_BALANCING") or 'COUNT').upper()
+        if balancing not in ('COUNT', 'COST'):
+            raise BlueSkyConfigurationError(
+                "Invalid HYSPLIT tranche balancing: '{}'".format(balancing))
+        costs = None
+        if balancing == 'COST':
+            costs = hysplit_utils.estimate_fire_set_costs(self._fire_sets,
+                num_levels)
         fire_tranches = hysplit_utils.create_fire_tranches(
-            self._fire_sets, self._num_processes)
-        threads = []
+            self._fire_sets, self._num_processes, costs=costs,
+            cluster=self.config("TRANCHE_CLUSTERING"))
+
+        # Record each tranche's estimated cost, for tuning
+        self._tranches_info = [{
+            "num_fires": len(fires),
+            "estimated_cost": hysplit_utils.estimate_fire_set_costs(
+                [fires], num_levels)[0]
+        } for fires in fire_tranches]
+
+        return fire_tranches
+
+    def _get_max_concurrent_processes(self):
+        """Returns the configured max number of concurrent HYSPLIT processes,
+        defaulting to the number of cpus (divided among the cpus used per
+        process, if running HYSPLIT with MPI)
+        """
+        max_concurrent = self.config("MAX_CONCURRENT_PROCESSES")
+        if not max_concurrent or max_concurrent < 1:
+            ncpus = int(self.config("NCPUS") or 1) if self.config("MPI") else 1
+            max_concurrent = max(1, (os.cpu_count() or 1) // ncpus)
+        return int(max_concurrent)
+
+    def _run_parallel(self, working_dir):
+        fire_tranches = self._create_fire_tranches()
+        max_workers = min(len(fire_tranches),
+            self._get_max_concurrent_processes())
+        logging.info("Running %d HYSPLIT processes, at most %d at a time",
+            len(fire_tranches), max_workers)
+
+        # We need to set config in each worker thread to what was loaded
+        # in the main thread.  Otherwise, we'll just be using defaults
         main_thread_config = Config().get()
-        for nproc in range(len(fire_tranches)):
-            fires = fire_tranches[nproc]
+        failed = threading.Event()
+
+        def _run_tranche(nproc):
+            tranche_info = self._tranches_info[nproc]
+            if failed.is_set():
+                tranche_info["status"] = "cancelled"
+                return
+
+            Config().set(main_thread_config)
+            tranche_working_dir = os.path.join(working_dir, str(nproc))
+            if not os.path.exists(tranche_working_dir):
+                os.makedirs(tranche_working_dir)
+
             # Note: no need to set _context.basedir; it will be set to workdir
-            logging.info("Starting thread to run HYSPLIT on %d fires." % (len(fires)))
-            t = T(fires, main_thread_config,
-                os.path.join(working_dir, str(nproc)), nproc)
-            t.start()
-            threads.append(t)
-
-        # If there were any exceptions, raise one of them after joining all threads
-        exc = None
-        for t in threads:
-            t.join()
-            if t.exc:
-                exc = t.exc # TODO: just raise exception here, possibly before all threads have been joined?
-        if exc:
-            raise exc
+            logging.info("Running HYSPLIT on %d fires." % (
+                len(fire_tranches[nproc])))
+            start = time.time()
+            tranche_info["status"] = "failed"
+            try:
+                returncode, rusage = self._run_process(fire_tranches[nproc],
+                    tranche_working_dir, nproc)
+                tranche_info["status"] = "succeeded"
+                tranche_info["exit_status"] = returncode
+                if rusage:
+                    tranche_info["peak_rss_kb"] = _get_peak_rss_kb(rusage)
+            except Exception as e:
+                # Subprocess failures carry the failed process' exit status
+                tranche_info["exit_status"] = getattr(e, 'returncode', None)
+                failed.set()
+                raise
+            finally:
+                tranche_info["wall_time"] = time.time() - start
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_run_tranche, nproc)
+                for nproc in range(len(fire_tranches))]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            # On the first failure, cancel tranches that haven't started;
+            # those already running are allowed to finish
+            for f in not_done:
+                if f.cancel():
+                    self._tranches_info[futures.index(f)]["status"] = "cancelled"
+
+        # If there were any exceptions, raise the first one
+        for f in futures:
+            if not f.cancelled() and f.exception():
+                raise f.exception()
 
         #  'ttl' is sum of values; see http://nco.sourceforge.net/nco.html#Operation-Types
         # sum together all the PM2.5 fields then append the TFLAG field from
@@ -378,25 +456,28 @@ class HYSPLITDispersion(DispersionBase):
 
         output_file = os.path.join(working_dir, self._output_file_name)
 
-        #ncea_args = ["-y", "ttl", "-O"]
-        ncea_args = ["-O","-v","PM25","-y","ttl"]
-        ncea_args.extend(["%d/%s" % (i, self._output_file_name) for i in  range(self._num_processes)])
-        ncea_args.append(output_file)
-        io.SubprocessExecutor().execute(self.BINARIES['NCEA'], *ncea_args, cwd=working_dir)
+        if self.config("MERGE_TRANCHES_IN_PROCESS"):
+            # Does the same as ncea and ncks, below, streaming one time
+            # step at a time through all tranches' output
+            hysplit_utils.merge_tranche_netcdfs(
+                [os.path.join(working_dir, str(i), self._output_file_name)
+                    for i in range(self._num_processes)],
+                output_file, sum_variables=('PM25',),
+                copy_variables=('TFLAG',))
 
-        ncks_args = ["-A","-v","TFLAG"]
-        ncks_args.append("0/%s" % (self._output_file_name))
-        ncks_args.append(output_file)
-        io.SubprocessExecutor().execute(self.BINARIES['NCKS'], *ncks_args, cwd=working_dir)
+        else:
+            #ncea_args = ["-y", "ttl", "-O"]
+            ncea_args = ["-O","-v","PM25","-y","ttl"]
+            ncea_args.extend(["%d/%s" % (i, self._output_file_name) for i in  range(self._num_processes)])
+            ncea_args.append(output_file)
+            io.SubprocessExecutor().execute(self.BINARIES['NCEA'], *ncea_args, cwd=working_dir)
+
+            ncks_args = ["-A","-v","TFLAG"]
+            ncks_args.append("0/%s" % (self._output_file_name))
+            ncks_args.append(output_file)
+            io.SubprocessExecutor().execute(self.BINARIES['NCKS'], *ncks_args, cwd=working_dir)
         self._archive_file(output_file)
 
-    def _create_sym_link(self, dest, link):
-        try:
-            os.symlink(dest, link)
-        except FileExistsError as e:
-            # ignore existing sym link error
-            pass
-
     def _run_process(self, fires, working_dir, tranche_num=None):
         hysplit_utils.ensure_tranch_has_dummy_fire(fires, self._model_start,
             self._num_hours, self._grid_params)
@@ -513,9 +594,11 @@ class HYSPLITDispersion(DispersionBase):
                     # or even support it.)
                     args.append("--allow-run-as-root")
                 args.extend(["-n", str(NCPUS), self.BINARIES['HYSPLIT_MPI']])
-                io.SubprocessExecutor().execute(*args, cwd=working_dir)
+                hysplit_executor = io.SubprocessExecutor()
+                hysplit_executor.execute(*args, cwd=working_dir)
             else:  # standard serial run
-                io.SubprocessExecutor().execute(self.BINARIES['HYSPLIT'], cwd=working_dir)
+                hysplit_executor = io.SubprocessExecutor()
+                hysplit_executor.execute(self.BINARIES['HYSPLIT'], cwd=working_dir)
 
             if not os.path.exists(output_conc_file):
                 msg = "HYSPLIT failed, check MESSAGE file for details"
@@ -538,6 +621,9 @@ class HYSPLITDispersion(DispersionBase):
                     raise AssertionError(msg)
             self._archive_file(output_file, tranche_num=tranche_num)
 
+            # for recording tranches' exit status and peak memory usage
+            return hysplit_executor.returncode, hysplit_executor.rusage
+
         finally:
             # Archive input files
             self._archive_file(emissions_file, tranche_num=tranche_num)
@@ -560,70 +646,82 @@ class HYSPLITDispersion(DispersionBase):
             super()._archive_file(filename, suffix=tranche_num)
 
     def _create_sym_links_for_process(self, working_dir):
-        for f in self._met_info['files']:
-            # bluesky.modules.dispersion.run will have weeded out met
-            # files that aren't relevant to this dispersion run
-            self._create_sym_link(f,
-                os.path.join(working_dir, os.path.basename(f)))
+        # bluesky.modules.dispersion.run will have weeded out met
+        # files that aren't relevant to this dispersion run
+        self._met_stager.link(working_dir)
 
         # Create sym links to ancillary data files (note: HYSPLIT49 balks
         # if it can't find ASCDATA.CFG).
-        self._create_sym_link(self.config("ASCDATA_FILE"),
+        hysplit_utils.create_sym_link(self.config("ASCDATA_FILE"),
             os.path.join(working_dir, 'ASCDATA.CFG'))
-        self._create_sym_link(self.config("LANDUSE_FILE"),
+        hysplit_utils.create_sym_link(self.config("LANDUSE_FILE"),
             os.path.join(working_dir, 'LANDUSE.ASC'))
-        self._create_sym_link(self.config("ROUGLEN_FILE"),
+        hysplit_utils.create_sym_link(self.config("ROUGLEN_FILE"),
             os.path.join(working_dir, 'ROUGLEN.ASC'))
 
     def _get_hour_data(self, dt, fire):
         if fire.plumerise and fire.timeprofiled_emissions and fire.timeprofiled_area:
             local_dt = dt + datetime.timedelta(hours=fire.utc_offset)
-            # TODO: will fire.plumerise and fire.timeprofile always
-            #    have string value keys
-            local_dt = local_dt.strftime('%Y-%m-%dT%H:%M:%S')
-            plumerise_hour = fire.plumerise.get(local_dt)
-            timeprofiled_emissions_hour = fire.timeprofiled_emissions.get(local_dt)
-            hourly_area = fire.timeprofiled_area.get(local_dt)
+            # The hourly data are HourlySeries objects, unless they're
+            # the result of merging plumes or fires with different utc
+            # offsets, in which case they're dicts with string keys
+            plumerise_hour = get_hour(fire.plumerise, local_dt)
+            timeprofiled_emissions_hour = get_hour(
+                fire.timeprofiled_emissions, local_dt)
+            hourly_area = get_hour(fire.timeprofiled_area, local_dt)
             if plumerise_hour and timeprofiled_emissions_hour and hourly_area:
                 return False, plumerise_hour, timeprofiled_emissions_hour, hourly_area
 
         return (True, hysplit_utils.DUMMY_PLUMERISE_HOUR, dict(), 0.0)
 
+    # Each source record is "YY MM DD HH 00 0100 LAT LON HT RATE AREA HEAT".
+    # The date string is the same for all of an hour's records, lat/lng
+    # for all of a fire's records, and area and heat for all of a fire's
+    # records for an hour, so they're formatted separately.
+    EMISSIONS_RECORD_LAT_LNG_FMT = "%8.4f %9.4f"
+    EMISSIONS_RECORD_AREA_HEAT_FMT = "%7.2f %15.2f"
+
+    # Each hour's block of records is written in a single call
+    EMISSIONS_FILE_BUFFER_SIZE = 1024 * 1024
+
     def _write_emissions(self, fires, emissions_file):
         # A value slightly above ground level at which to inject smoldering
         # emissions into the model.
         smolder_height = self.config("SMOLDER_HEIGHT")
 
-        with open(emissions_file, "w") as emis:
+        num_fires = len(fires)
+        #num_heights = 21 # 20 quantile gaps, plus ground level
+        num_heights = self.num_output_quantiles + 1
+        num_sources = num_fires * num_heights
+
+        # TODO: What is this and what does it do?
+        # A reasonable guess would be that it means a time increment of 1 hour
+        qinc = 1
+
+        # Each fire's lat/lng, and its records for hours without emissions,
+        # are the same for every hour, so they're formatted once
+        lat_lngs = [self.EMISSIONS_RECORD_LAT_LNG_FMT % (
+            fire.latitude, fire.longitude) for fire in fires]
+        dummy_records = [self._format_emissions_records(lat_lng,
+            smolder_height, True, hysplit_utils.DUMMY_PLUMERISE_HOUR, {}, 0.0)
+            for lat_lng in lat_lngs]
+
+        with open(emissions_file, "w",
+                buffering=self.EMISSIONS_FILE_BUFFER_SIZE) as emis:
             # HYSPLIT skips past the first two records, so these are for comment purposes only
-            emis.write("emissions group header: YYYY MM DD HH QINC NUMBER\n")
-            emis.write("each emission's source: YYYY MM DD HH MM DUR_HHMM LAT LON HT RATE AREA HEAT\n")
+            emis.write("emissions group header: YYYY MM DD HH QINC NUMBER\n"
+                "each emission's source: YYYY MM DD HH MM DUR_HHMM LAT LON HT RATE AREA HEAT\n")
 
             # Loop through the timesteps
             for hour in range(self._num_hours):
                 dt = self._model_start + datetime.timedelta(hours=hour)
                 dt_str = dt.strftime("%y %m %d %H")
 
-                num_fires = len(fires)
-                #num_heights = 21 # 20 quantile gaps, plus ground level
-                num_heights = self.num_output_quantiles + 1
-                num_sources = num_fires * num_heights
-
-                # TODO: What is this and what does it do?
-                # A reasonable guess would be that it means a time increment of 1 hour
-                qinc = 1
-
-                # Write the header line for this timestep
-                emis.write("%s %02d %04d\n" % (dt_str, qinc, num_sources))
-
                 fires_wo_emissions = 0
+                records = []
 
                 # Loop through the fire locations
-                for fire in fires:
-                    # Get some properties from the fire location
-                    lat = fire.latitude
-                    lon = fire.longitude
-
+                for i, fire in enumerate(fires):
                     # If we don't have real data for the given timestep, we apparently need
                     # to stick in dummy records anyway (so we have the correct number of sources).
                     (dummy, plumerise_hour, timeprofiled_emissions_hour,
@@ -631,77 +729,92 @@ class HYSPLITDispersion(DispersionBase):
                     if dummy:
                         logging.debug("Fire %s has no emissions for hour %s", fire.id, hour)
                         fires_wo_emissions += 1
+                        records.extend(dummy_records[i])
+                    else:
+                        records.extend(self._format_emissions_records(
+                            lat_lngs[i], smolder_height, False, plumerise_hour,
+                            timeprofiled_emissions_hour, hourly_area))
 
-                    area_meters = 0.0
-                    smoldering_fraction = 0.0
-                    pm25_injected = 0.0
-                    if not dummy:
-                        # Extract the fraction of area burned in this timestep, and
-                        # convert it from acres to square meters.
-                        area_meters = hourly_area * SQUARE_METERS_PER_ACRE
-
-                        smoldering_fraction = plumerise_hour['smolder_fraction']
-
-                        # Compute the total PM2.5 emitted at this timestep (grams) by
-                        # multiplying the phase-specific total emissions by the
-                        # phase-specific hourly fractions for this hour to get the
-                        # hourly emissions by phase for this hour, and then summing
-                        # the three values to get the total emissions for this hour
-                        # TODO: use fire.timeprofiled_emissions[local_dt]['PM2.5']
-                        pm25_emitted = timeprofiled_emissions_hour.get('PM2.5', 0.0)
-                        pm25_emitted *= GRAMS_PER_TON
-                        # Total PM2.5 smoldering (not lofted in the plume)
-                        pm25_injected = pm25_emitted * smoldering_fraction
-
-                    entrainment_fraction = 1.0 - smoldering_fraction
-
-                    # We don't assign any heat, so the PM2.5 mass isn't lofted
-                    # any higher.  This is because we are assigning explicit
-                    # heights from the plume rise.
-                    heat = 0.0
-
-                    # Inject the smoldering fraction of the emissions at ground level
-                    # (SMOLDER_HEIGHT represents a value slightly above ground level)
-                    height_meters = smolder_height
-
-                    # Write the smoldering record to the file
-                    record_fmt = "%s 00 0100 %8.4f %9.4f %6.0f %7.2f %7.2f %15.2f\n"
-                    emis.write(record_fmt % (dt_str, lat, lon, height_meters, pm25_injected, area_meters, heat))
-
-                    for level in range(0, len(plumerise_hour['heights']) - 1, self._reduction_factor):
-                        height_meters = 0.0
-                        pm25_injected = 0.0
-                        if not dummy:
-                            # Loop through the heights (20 quantiles of smoke density)
-                            # For the unreduced case, we loop through 20 quantiles, but we have
-                            # 21 quantile-edge measurements.  So for each
-                            # quantile gap, we need to find a point halfway
-                            # between the two edges and inject that quantile's fraction of total emissions
-
-                            # KJC optimization...
-                            # Reduce the number of vertical emission levels by a reduction factor
-                            # and place the appropriate fraction of emissions at each level.
-                            # ReductionFactor MUST evenly divide into the number of quantiles
-
-                            lower_height = plumerise_hour['heights'][level]
-                            upper_height_index = min(level + self._reduction_factor, len(plumerise_hour['heights']) - 1)
-                            upper_height = plumerise_hour['heights'][upper_height_index]
-                            if self._reduction_factor == 1:
-                                height_meters = (lower_height + upper_height) / 2.0  # original approach
-                            else:
-                                height_meters = upper_height # top-edge approach
-                            # Total PM2.5 entrained (lofted in the plume)
-                            pm25_entrained = pm25_emitted * entrainment_fraction
-                            # Inject the proper fraction of the entrained PM2.5 in each quantile gap.
-                            fraction = sum(plumerise_hour['emission_fractions'][level:level+self._reduction_factor])
-                            pm25_injected = pm25_entrained * fraction
-
-                        # Write the record to the file
-                        emis.write(record_fmt % (dt_str, lat, lon, height_meters, pm25_injected, area_meters, heat))
+                # Write the header line for this timestep, followed by
+                # all of its records, each prefixed with the date string
+                emis.write("%s %02d %04d\n%s%s" % (dt_str, qinc, num_sources,
+                    dt_str if records else '', dt_str.join(records)))
 
                 if fires_wo_emissions > 0:
                     logging.debug("%d of %d fires had no emissions for hour %d", fires_wo_emissions, num_fires, hour)
 
+    def _format_emissions_records(self, lat_lng, smolder_height, dummy,
+            plumerise_hour, timeprofiled_emissions_hour, hourly_area):
+        """Returns a fire's records for one hour - the smoldering record
+        followed by one per vertical level - each minus its date string
+        """
+        area_meters = 0.0
+        smoldering_fraction = 0.0
+        pm25_injected = 0.0
+        if not dummy:
+            # Extract the fraction of area burned in this timestep, and
+            # convert it from acres to square meters.
+            area_meters = hourly_area * SQUARE_METERS_PER_ACRE
+
+            smoldering_fraction = plumerise_hour['smolder_fraction']
+
+            # Compute the total PM2.5 emitted at this timestep (grams) by
+            # multiplying the phase-specific total emissions by the
+            # phase-specific hourly fractions for this hour to get the
+            # hourly emissions by phase for this hour, and then summing
+            # the three values to get the total emissions for this hour
+            pm25_emitted = timeprofiled_emissions_hour.get('PM2.5', 0.0)
+            pm25_emitted *= GRAMS_PER_TON
+            # Total PM2.5 smoldering (not lofted in the plume)
+            pm25_injected = pm25_emitted * smoldering_fraction
+
+        entrainment_fraction = 1.0 - smoldering_fraction
+
+        # We don't assign any heat, so the PM2.5 mass isn't lofted
+        # any higher.  This is because we are assigning explicit
+        # heights from the plume rise.  Heat and area are the same for
+        # each of the fire's records for the hour.
+        heat = 0.0
+        record_fmt = " 00 0100 %s %%6.0f %%7.2f %s\n" % (lat_lng,
+            self.EMISSIONS_RECORD_AREA_HEAT_FMT % (area_meters, heat))
+
+        # Inject the smoldering fraction of the emissions at ground level
+        # (SMOLDER_HEIGHT represents a value slightly above ground level)
+        records = [record_fmt % (smolder_height, pm25_injected)]
+
+        heights = plumerise_hour['heights']
+        for level in range(0, len(heights) - 1, self._reduction_factor):
+            height_meters = 0.0
+            pm25_injected = 0.0
+            if not dummy:
+                # Loop through the heights (20 quantiles of smoke density)
+                # For the unreduced case, we loop through 20 quantiles, but we have
+                # 21 quantile-edge measurements.  So for each
+                # quantile gap, we need to find a point halfway
+                # between the two edges and inject that quantile's fraction of total emissions
+
+                # KJC optimization...
+                # Reduce the number of vertical emission levels by a reduction factor
+                # and place the appropriate fraction of emissions at each level.
+                # ReductionFactor MUST evenly divide into the number of quantiles
+
+                lower_height = heights[level]
+                upper_height_index = min(level + self._reduction_factor, len(heights) - 1)
+                upper_height = heights[upper_height_index]
+                if self._reduction_factor == 1:
+                    height_meters = (lower_height + upper_height) / 2.0  # original approach
+                else:
+                    height_meters = upper_height # top-edge approach
+                # Total PM2.5 entrained (lofted in the plume)
+                pm25_entrained = pm25_emitted * entrainment_fraction
+                # Inject the proper fraction of the entrained PM2.5 in each quantile gap.
+                fraction = sum(plumerise_hour['emission_fractions'][level:level+self._reduction_factor])
+                pm25_injected = pm25_entrained * fraction
+
+            records.append(record_fmt % (height_meters, pm25_injected))
+
+        return records
+
 
     VERTICAL_CHOICES = {
         "DATA": 0,
@@ -839,11 +952,11 @@ class HYSPLITDispersion(DispersionBase):
             f.write("%9.1f\n" % modelTop)
 
             # Number of input data grids (met files)
-            f.write("%d\n" % len(self._met_info['files']))
+            f.write("%d\n" % len(self._met_stager.filenames))
             # Directory for input data grid and met file name
-            for filename in sorted(self._met_info['files']):
-                f.write("./\n")
-                f.write("%s\n" % os.path.basename(filename))
+            for filename in self._met_stager.filenames:
+                f.write("%s\n" % self._met_stager.CONTROL_DIR)
+                f.write("%s\n" % filename)
 
             # Number of pollutants = 1 (only modeling PM2.5 for now)
             f.write("1\n")
@@ -7,18 +7,26 @@ TODO: refactor this as a class
 
 __author__ = "Joel Dubowy and Sonoma Technology, Inc."
 
-import datetime
+import heapq
 import logging
 import math
-from functools import reduce
+import os
+import shutil
+import tempfile
 
-from bluesky.exceptions import BlueSkyConfigurationError
+import numpy
+
+from bluesky.exceptions import (
+    BlueSkyConfigurationError, MissingDependencyError
+)
 from bluesky.models.fires import Fire
+from bluesky.models.hourly import HourlySeries
 from .. import PHASES
 from bluesky.config import Config
 
 __all__ = [
-    'create_fire_sets', 'create_fire_tranches'
+    'create_fire_sets', 'create_fire_tranches', 'estimate_fire_set_costs',
+    'merge_tranche_netcdfs', 'MetStager', 'create_sym_link'
 ]
 
 
@@ -43,21 +51,53 @@ def create_fire_sets(fires):
     """
     return  [[f] for f in fires]
 
-def create_fire_tranches(fire_sets, num_processes):
+def create_fire_tranches(fire_sets, num_processes, costs=None,
+        cluster=False):
     """Creates tranches of FireLocationData, each tranche to be processed by its
     own HYSPLIT process.
 
-    @todo: More sophisticated tranching (e.g. taking into account acreage,
-    location, etc.; to keep the number of fires in each tranche as close
-    as possible to to # fires / # tranches).
+    By default, fire sets are split, in order, into tranches with as close
+    to the same number of fire sets as possible.
+
+    Args:
+     - fire_sets -- list of lists of fires
+     - num_processes -- number of tranches to create
+
+    Kwargs:
+     - costs -- estimated cost of each fire set (see estimate_fire_set_costs);
+       if specified, tranches are balanced by total cost rather than by
+       number of fire sets
+     - cluster -- if True, fire sets are split by their mean lat/lng
+       into tranches each covering a compact area
     """
     n_sets = len(fire_sets)
     num_processes = min(n_sets, num_processes)  # just to be sure
-    min_n_fire_sets_per_process = n_sets // num_processes
-    extra_fire_cutoff = n_sets % num_processes
 
     logging.info("Running %d HYSPLIT49 Dispersion model processes "
         "on %d fires (i.e. events)" % (num_processes, n_sets))
+
+    if costs is None and not cluster:
+        tranche_idxs = _split_evenly(n_sets, num_processes)
+    else:
+        costs = costs if costs is not None else [1] * n_sets
+        if cluster:
+            tranche_idxs = _split_by_location(list(range(n_sets)), costs,
+                [_get_mean_lat_lng(fs) for fs in fire_sets], num_processes)
+        else:
+            tranche_idxs = _split_greedy(costs, num_processes)
+
+    fire_tranches = []
+    for nproc, idxs in enumerate(tranche_idxs):
+        logging.debug("Process %d:  %d fire sets%s" % (nproc, len(idxs),
+            ", estimated cost %s" % (sum(costs[i] for i in idxs))
+            if costs is not None else ''))
+        fire_tranches.append([f for i in idxs for f in fire_sets[i]])
+    return fire_tranches
+
+def _split_evenly(n_sets, num_processes):
+    min_n_fire_sets_per_process = n_sets // num_processes
+    extra_fire_cutoff = n_sets % num_processes
+
     logging.info(" - %d processes with %d fires" % (
         num_processes - extra_fire_cutoff, min_n_fire_sets_per_process))
     if extra_fire_cutoff > 0:
@@ -65,17 +105,74 @@ def create_fire_tranches(fire_sets, num_processes):
             extra_fire_cutoff, min_n_fire_sets_per_process+1))
 
     idx = 0
-    fire_tranches = []
+    tranche_idxs = []
     for nproc in range(num_processes):
         s = idx
         idx += min_n_fire_sets_per_process
         if nproc < extra_fire_cutoff:
             idx += 1
-        tranche_fire_sets = fire_sets[s:idx]
-        logging.debug("Process %d:  %d fire sets" % (nproc, len(tranche_fire_sets)))
-        fires = reduce(lambda x,y: x + y, tranche_fire_sets)
-        fire_tranches.append(fires)
-    return fire_tranches
+        tranche_idxs.append(list(range(s, idx)))
+    return tranche_idxs
+
+def _split_greedy(costs, num_processes):
+    """Assigns each fire set, from most to least costly, to the tranche
+    with the lowest total cost so far (i.e. longest processing time first
+    scheduling).  Each tranche's fire sets are kept in their original order.
+    """
+    heap = [(0, nproc) for nproc in range(num_processes)]
+    tranche_idxs = [[] for nproc in range(num_processes)]
+    for i in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        total, nproc = heapq.heappop(heap)
+        tranche_idxs[nproc].append(i)
+        heapq.heappush(heap, (total + costs[i], nproc))
+    return [sorted(idxs) for idxs in tranche_idxs]
+
+def _split_by_location(idxs, costs, lat_lngs, num_processes):
+    """Recursively bisects the fire sets along the wider of their lat and
+    lng extents, splitting total cost in proportion to the number of
+    tranches on each side (i.e. recursive coordinate bisection)
+    """
+    if num_processes == 1:
+        return [sorted(idxs)]
+
+    axis = max((0, 1), key=lambda a: max(lat_lngs[i][a] for i in idxs)
+        - min(lat_lngs[i][a] for i in idxs))
+    idxs = sorted(idxs, key=lambda i: lat_lngs[i][axis])
+
+    n_left = num_processes // 2
+    target = sum(costs[i] for i in idxs) * n_left / num_processes
+    # leave at least one fire set for each tranche on either side
+    e = n_left
+    cumulative = sum(costs[i] for i in idxs[:e])
+    while (e < len(idxs) - (num_processes - n_left) and
+            abs(cumulative + costs[idxs[e]] - target) < abs(cumulative - target)):
+        cumulative += costs[idxs[e]]
+        e += 1
+
+    return (_split_by_location(idxs[:e], costs, lat_lngs, n_left)
+        + _split_by_location(idxs[e:], costs, lat_lngs,
+            num_processes - n_left))
+
+def _get_mean_lat_lng(fire_set):
+    return (sum(f.latitude for f in fire_set) / len(fire_set),
+        sum(f.longitude for f in fire_set) / len(fire_set))
+
+def estimate_fire_set_costs(fire_sets, num_levels):
+    """Returns the estimated HYSPLIT cost of each fire set, in emission
+    sources (i.e. the number of emitting hours times the number of
+    vertical levels, including the smoldering level at ground level, at
+    which particles are released), plus one per fire.
+    """
+    return [sum(1 + _count_emitting_hours(f) * num_levels for f in fire_set)
+        for fire_set in fire_sets]
+
+def _count_emitting_hours(fire):
+    timeprofiled_emissions = fire.get('timeprofiled_emissions') or {}
+    if (isinstance(timeprofiled_emissions, HourlySeries)
+            and 'PM2.5' in (timeprofiled_emissions.fields or [])):
+        return int((timeprofiled_emissions.array('PM2.5') > 0).sum())
+    return len([e for e in timeprofiled_emissions.values()
+        if e and e.get('PM2.5')])
 
 def compute_num_processes(num_fire_sets, **tranching_config):
     """Determines number of HYSPLIT tranches given the number of fires sets
@@ -128,6 +225,187 @@ def compute_num_processes(num_fire_sets, **tranching_config):
     return int(computed_num_processes)
 
 
+##
+## Met Staging
+##
+
+class MetStager(object):
+    """Stages a dispersion run's met files once, in a single directory
+    shared by all of the run's HYSPLIT processes
+
+    Rather than each process's working directory getting its own sym link
+    to each met file, each gets one sym link to the shared directory,
+    which HYSPLIT's control file then references.  If 'scratch_dir' is
+    specified (e.g. '/dev/shm'), met files are copied into a temporary
+    directory within it, which is removed, along with the processes' sym
+    links to it, by 'cleanup' (or by 'stage', if staging fails); otherwise,
+    the shared directory is created in the run's working directory and
+    contains sym links to the met files.
+
+    Met files are deduplicated by real path.  Since the files share a
+    directory, distinct files with the same name aren't allowed.
+    """
+
+    DIR_NAME = 'met'
+    # The shared directory, as specified in the control file, relative to
+    # each process's working directory
+    CONTROL_DIR = './{}/'.format(DIR_NAME)
+
+    def __init__(self, met_files, scratch_dir=None):
+        files_by_name = {}
+        for f in met_files:
+            name = os.path.basename(f)
+            if name in files_by_name and (os.path.realpath(f)
+                    != os.path.realpath(files_by_name[name])):
+                raise ValueError("Multiple met files named {}".format(name))
+            files_by_name[name] = f
+        self._files_by_name = files_by_name
+        self._scratch_dir = scratch_dir
+        self.met_dir = None
+        self._is_tmp_dir = False
+        self._links = []
+
+    @property
+    def filenames(self):
+        return sorted(self._files_by_name)
+
+    def stage(self, working_dir):
+        """Stages the met files, returning the shared met directory"""
+        if self._scratch_dir:
+            self.met_dir = tempfile.mkdtemp(prefix='bluesky-met-',
+                dir=self._scratch_dir)
+            self._is_tmp_dir = True
+            logging.info("Copying %d met files to %s",
+                len(self._files_by_name), self.met_dir)
+            try:
+                for name, f in self._files_by_name.items():
+                    shutil.copy(f, os.path.join(self.met_dir, name))
+            except:
+                # e.g. if the scratch dir fills up
+                self.cleanup()
+                raise
+
+        else:
+            self.met_dir = os.path.abspath(
+                os.path.join(working_dir, self.DIR_NAME))
+            if not os.path.exists(self.met_dir):
+                os.makedirs(self.met_dir)
+            for name, f in self._files_by_name.items():
+                create_sym_link(os.path.abspath(f),
+                    os.path.join(self.met_dir, name))
+
+        return self.met_dir
+
+    def link(self, working_dir):
+        """Links the shared met directory into a HYSPLIT process's working
+        directory, unless it's already there
+        """
+        link = os.path.join(working_dir, self.DIR_NAME)
+        if os.path.realpath(link) != os.path.realpath(self.met_dir):
+            create_sym_link(self.met_dir, link)
+            self._links.append(link)
+
+    def cleanup(self):
+        if not self._is_tmp_dir:
+            return
+        # don't leave dangling sym links in the (possibly kept) output dir
+        for link in self._links:
+            if os.path.islink(link):
+                os.remove(link)
+        self._links = []
+        if self.met_dir and os.path.exists(self.met_dir):
+            shutil.rmtree(self.met_dir)
+
+def create_sym_link(dest, link):
+    try:
+        os.symlink(dest, link)
+    except FileExistsError as e:
+        # ignore existing sym link error
+        pass
+
+
+##
+## Merging Tranche Output
+##
+
+def merge_tranche_netcdfs(input_files, output_file,
+        sum_variables=('PM25',), copy_variables=('TFLAG',)):
+    """Merges the NetCDF output of HYSPLIT tranches, in process, as an
+    alternative to running ncea and ncks
+
+    The output file has the first input file's dimensions and global
+    attributes, the sum of each of 'sum_variables' over all input files,
+    and each of 'copy_variables' copied from the first input file.
+    Variables are read and written one record (i.e. time step) at a time,
+    to bound memory usage.  Values are summed in input file order, in the
+    variable's own type, and fill values are excluded from sums.
+
+    Requires the netCDF4 package.
+    """
+    try:
+        import netCDF4
+    except ImportError:
+        raise MissingDependencyError("netCDF4 package required to merge "
+            "HYSPLIT tranche output in process")
+
+    logging.info("Merging %d HYSPLIT tranche output files into %s",
+        len(input_files), output_file)
+    tmp_file = output_file + '.tmp'
+    inputs = [netCDF4.Dataset(f) for f in input_files]
+    try:
+        for ds in inputs:
+            ds.set_auto_maskandscale(False)
+        first = inputs[0]
+        with netCDF4.Dataset(tmp_file, 'w', format=first.data_model) as out:
+            out.setncatts({a: first.getncattr(a) for a in first.ncattrs()})
+            for name, dim in first.dimensions.items():
+                out.createDimension(name,
+                    None if dim.isunlimited() else len(dim))
+
+            for name in tuple(copy_variables) + tuple(sum_variables):
+                in_var = first.variables[name]
+                attrs = {a: in_var.getncattr(a) for a in in_var.ncattrs()}
+                out_var = out.createVariable(name, in_var.dtype,
+                    in_var.dimensions,
+                    fill_value=attrs.pop('_FillValue', None))
+                out_var.set_auto_maskandscale(False)
+                out_var.setncatts(attrs)
+
+                for i in range(in_var.shape[0] if in_var.shape else 0):
+                    if name in sum_variables:
+                        out_var[i] = _sum_record(inputs, name, i)
+                    else:
+                        out_var[i] = in_var[i]
+                if not in_var.shape:
+                    out_var.assignValue(in_var.getValue())
+
+    finally:
+        for ds in inputs:
+            ds.close()
+
+    os.replace(tmp_file, output_file)
+
+def _sum_record(inputs, name, i):
+    total = None
+    has_value = None
+    for ds in inputs:
+        var = ds.variables[name]
+        values = numpy.asarray(var[i])
+        fill_value = getattr(var, '_FillValue', None)
+        valid = (numpy.ones(values.shape, dtype=bool) if fill_value is None
+            else values != fill_value)
+        if total is None:
+            total = numpy.zeros(values.shape, dtype=values.dtype)
+            has_value = numpy.zeros(values.shape, dtype=bool)
+        total = numpy.where(valid, total + values, total).astype(values.dtype)
+        has_value |= valid
+
+    fill_value = getattr(inputs[0].variables[name], '_FillValue', None)
+    if fill_value is not None:
+        total[~has_value] = fill_value
+    return total
+
+
 ##
 ## Dummy Fires
 ##
@@ -153,6 +431,7 @@ def generate_dummy_fire(model_start, num_hours, grid_params):
     """Returns dummy fire formatted like
     """
     logging.info("Generating dummy fire for HYSPLIT")
+    hourly_area = 1.0 / float(num_hours)
     f = Fire(
         is_dummy=True,
         # let fire autogenerate id
@@ -161,18 +440,13 @@ def generate_dummy_fire(model_start, num_hours, grid_params):
         longitude=grid_params['center_longitude'],
         # TODO: look up offset from lat, lng, and model_start
         utc_offset=0, # since plumerise and timeprofile will have utc keys
-        plumerise={},
-        timeprofiled_emissions={},
-        timeprofiled_area={}
+        plumerise=HourlySeries.constant(model_start, num_hours,
+            DUMMY_PLUMERISE_HOUR),
+        timeprofiled_emissions=HourlySeries.constant(model_start, num_hours,
+            dummy_timeprofiled_emissions_hour()),
+        timeprofiled_area=HourlySeries.constant(model_start, num_hours,
+            hourly_area)
     )
-    hourly_area = 1.0 / float(num_hours)
-    hourly_timeprofiled_emissions = dummy_timeprofiled_emissions_hour()
-    for hour in range(num_hours):
-        dt = model_start + datetime.timedelta(hours=hour)
-        dt = dt.strftime('%Y-%m-%dT%H:%M:%S')
-        f['plumerise'][dt] = DUMMY_PLUMERISE_HOUR
-        f['timeprofiled_area'][dt] =  hourly_area
-        f['timeprofiled_emissions'][dt] = hourly_timeprofiled_emissions
 
     return f
 
@@ -20,7 +20,8 @@ from datetime import timedelta
 from afdatetime import parsing as datetime_parsing
 
 from bluesky import io
-from bluesky.datetimeutils import parse_utc_offset
+from bluesky.datetimeutils import parse_utc_offset, format_hourly_key
+from bluesky.models.hourly import get_hour
 
 from .. import (
     DispersionBase, TONS_PER_HR_TO_GRAMS_PER_SEC, BTU_TO_MW, PHASES
@@ -76,9 +77,13 @@ class VSMOKEDispersion(DispersionBase):
 
     def _compute_local_dt(self, fire, hr):
         dt = self._model_start + timedelta(hours=hr)
-        local_dt = dt + timedelta(hours=fire.utc_offset)
-        # TODO: will fire.timeprofiled_emissions always have string value keys
-        return local_dt.strftime('%Y-%m-%dT%H:%M:%S')
+        return dt + timedelta(hours=fire.utc_offset)
+
+    def _get_timeprofiled_emissions_hour(self, fire, local_dt):
+        emissions_hour = get_hour(fire.timeprofiled_emissions, local_dt)
+        if emissions_hour is None:
+            raise KeyError(format_hourly_key(local_dt))
+        return emissions_hour
 
     def _run(self, wdir):
         """Runs vsmoke
@@ -128,7 +133,8 @@ class VSMOKEDispersion(DispersionBase):
                 self._kmz_files.append(kml_path)
                 self._my_kmz.add_kml(kml_name, fire, hr)
 
-                pm25 = fire.timeprofiled_emissions[local_dt]['PM2.5']
+                pm25 = self._get_timeprofiled_emissions_hour(
+                    fire, local_dt)['PM2.5']
 
                 self._add_geo_json(in_var, iso_file, fire['id'], timezone, hr, pm25)
 
@@ -250,9 +256,11 @@ class VSMOKEDispersion(DispersionBase):
                 heat = fire.get('heat', 0.0)
                 emtqh = (heat) / 3414425.94972     # Btu to MW
 
-                emtqpm = (fire.timeprofiled_emissions[local_dt]['PM2.5']
+                emissions_hour = self._get_timeprofiled_emissions_hour(
+                    fire, local_dt)
+                emtqpm = (emissions_hour['PM2.5']
                     * TONS_PER_HR_TO_GRAMS_PER_SEC)  # tons/hr to g/s
-                emtqco = (fire.timeprofiled_emissions[local_dt]['CO']
+                emtqco = (emissions_hour['CO']
                     * TONS_PER_HR_TO_GRAMS_PER_SEC)    # tons/hr to g/s
                 f.write("%d %f %f %f %f\n" % (
                     hour + 1, emtqpm, emtqco, emtqh, emtqr))
@@ -307,7 +315,8 @@ class VSMOKEDispersion(DispersionBase):
             heat = fire.get('heat', 0.0)
             emtqh = (heat) / 3414425.94972     # Btu to MW
 
-            emtqpm = (fire.timeprofiled_emissions[local_dt]['PM2.5']
+            emtqpm = (self._get_timeprofiled_emissions_hour(
+                fire, local_dt)['PM2.5']
                 * TONS_PER_HR_TO_GRAMS_PER_SEC)  # tons/hr to g/s
 
             f.write("%s\n" % in_var.title)
@@ -16,6 +16,7 @@ from bluesky.exceptions import (
     BlueSkyGeographyValueError,
     BlueSkyConfigurationError
 )
+from bluesky.locationutils import PolygonIndex
 
 __author__ = "Joel Dubowy and Sonoma Technology, Inc."
 __all__ = ['lookup']
@@ -49,6 +50,30 @@ class EcoregionLookup(object):
         # TODO: Handle exceptions here or in calling code ?
         return self._lookup(lat, lng)
 
+    def lookup_many(self, lats, lngs):
+        """Looks up the ecoregions of multiple points, returning a list
+        of ecoregions (or None's, for points outside of all ecoregions)
+        in the same order as the points.
+
+        All points are validated before any are looked up, and
+        duplicate points are looked up only once.
+        """
+        lats = list(lats)
+        lngs = list(lngs)
+        if len(lats) != len(lngs):
+            raise ValueError("Number of lats and lngs must be equal")
+        logging.debug("Looking up ecoregions for %s points", len(lats))
+
+        for lat, lng in zip(lats, lngs):
+            self._validate_lat_lng(lat, lng)
+
+        ecoregions = {}
+        for lat_lng in zip(lats, lngs):
+            if lat_lng not in ecoregions:
+                ecoregions[lat_lng] = self._lookup(*lat_lng)
+
+        return [ecoregions[lat_lng] for lat_lng in zip(lats, lngs)]
+
     ## Fiona + shapely
 
     def _lookup_ecoregion_shapely(self, lat, lng):
@@ -57,23 +82,10 @@ class EcoregionLookup(object):
         Note: If a fire's location is defined as a polygon, it's the calling
           code's responsibility to pick a representative lat/lng.
         """
-        self._validate_lat_lng(lat, lng)
-
         if not self._input:
-            with fiona.open(ECOREGION_SHAPEFILE) as shapes:
-                # need to crate new list out of shapes collection, since
-                # `shapes` becomse invalid once out of this context
-                self._input = [s for s in shapes]
-
-        # sf = shapefile.Reader(ECOREGION_SHAPEFILE)
-        # shapes = sf.shapes()
-        point = geometry.Point(lng, lat) # longitude, latitude
+            self._input = _get_shapely_index()
 
-        ecoregion = None
-        for sr in self._input:
-            polygon = geometry.asShape(sr['geometry'])
-            if polygon.contains(point):
-                return sr['properties']['DOMAIN']
+        return self._input.lookup(lat, lng)
 
     ## Ogr
 
@@ -83,14 +95,16 @@ class EcoregionLookup(object):
         Note: If a fire's location is defined as a polygon, it's the calling
           code's responsibility to pick a representative lat/lng.
         """
-        self._validate_lat_lng(lat, lng)
-
         if not self._input:
-            self._input = ogr.GetDriverByName('ESRI Shapefile').Open(
+            data_source = ogr.GetDriverByName('ESRI Shapefile').Open(
                 ECOREGION_SHAPEFILE)
+            layer = data_source.GetLayer(0)
+            field_index = layer.GetLayerDefn().GetFieldIndex("DOMAIN")
+            # the data source needs to be kept around, since the layer
+            # becomes invalid once it's garbage collected
+            self._input = (data_source, layer, field_index)
 
-        layer = self._input.GetLayer(0)
-        field_index = layer.GetLayerDefn().GetFieldIndex("DOMAIN")
+        data_source, layer, field_index = self._input
         point = ogr.Geometry(ogr.wkbPoint)
         point.SetPoint_2D(0, lng, lat)
         layer.SetSpatialFilter(point)
@@ -98,3 +112,40 @@ class EcoregionLookup(object):
             polygon = shape.GetGeometryRef()
             if polygon.Contains(point):
                 return shape.GetFieldAsString(field_index)
+
+
+class _ShapelyEcoregionIndex(object):
+    """Spatial index of the ecoregion shapefile's polygons
+
+    The polygons are loaded and indexed once, so that each lookup only
+    tests containment against the few polygons whose bounding boxes
+    contain the point.
+    """
+
+    def __init__(self, shapefile=ECOREGION_SHAPEFILE):
+        with fiona.open(shapefile) as shapes:
+            # need to crate new list out of shapes collection, since
+            # `shapes` becomse invalid once out of this context
+            records = [s for s in shapes]
+
+        self._index = PolygonIndex(
+            [geometry.shape(r['geometry']) for r in records])
+        self._ecoregions = [r['properties']['DOMAIN'] for r in records]
+
+    def lookup(self, lat, lng):
+        point = geometry.Point(lng, lat) # longitude, latitude
+
+        # Matches are in shapefile order, so that the same ecoregion is
+        # returned as when testing all polygons in sequence
+        matches = self._index.containing(point)
+        if matches:
+            return self._ecoregions[matches[0]]
+
+_shapely_index = None
+
+def _get_shapely_index():
+    """Returns the process' shapely ecoregion index, building it on first use"""
+    global _shapely_index
+    if not _shapely_index:
+        _shapely_index = _ShapelyEcoregionIndex()
+    return _shapely_index
@@ -39,4 +39,8 @@ class BlueSkyUnavailableResourceError(ValueError):
     pass
 
 class BlueSkySubprocessError(RuntimeError):
-    pass
+
+    def __init__(self, msg, returncode=None):
+        super().__init__(msg)
+        # Exit status of the failed process, if it ran
+        self.returncode = returncode
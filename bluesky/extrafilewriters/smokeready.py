@@ -187,7 +187,10 @@ class SmokeReadyWriter(object):
       "pthour_filename": "pthour-%Y%m%d%H.ems95",
       "separate_smolder": true,
       "write_ptinv_totals": true,
-      "write_ptday_file": true
+      "write_ptday_file": true,
+      "fips_cache_precision": null,
+      "fips_cache_file": null,
+      "fips_api_fallback": false
 
   config can be seen in ./dev/config/extrafiles/smokeready.json
   """
@@ -219,6 +222,11 @@ class SmokeReadyWriter(object):
     # Pull the file year out of the dynamically set timestamp
     self.file_year = int(pthour.split('-')[1][:4])
 
+    self._fips_resolver = locationutils.FipsResolver(
+      cache_precision=Config().get('extrafiles', 'smokeready', 'fips_cache_precision'),
+      cache_file=Config().get('extrafiles', 'smokeready', 'fips_cache_file'),
+      api_fallback=Config().get('extrafiles', 'smokeready', 'fips_api_fallback'))
+
   # main write function to be called
   def write(self, fires_manager):
     fires_info = fires_manager.fires
@@ -241,6 +249,8 @@ class SmokeReadyWriter(object):
     pthour.write("#YEAR %d\n" % self.file_year)
     pthour.write("#DESC POINT SOURCE BlueSky Framework Fire Emissions\n")
 
+    self._look_up_fips(fires_info)
+
     num_of_fires = 0
     skip_no_emiss = 0
     skip_no_plume = 0
@@ -530,11 +540,39 @@ class SmokeReadyWriter(object):
         county_fips = '54103'
         CMAS FIPS = '54104'
     """
-    fips = locationutils.Fips(lat, lng)
-    cyid = fips.county_fips[2:].lstrip('0')
-    stid = fips.state_fips.lstrip('0')
+    try:
+      fips = self._fips[(float(lat), float(lng))]
+    except (KeyError, TypeError, ValueError):
+      raise ValueError(locationutils.INVALID_LAT_LNG_DATA)
+    if not fips:
+      raise ValueError(locationutils.INVALID_FIPS_RESPONSE)
+
+    cyid = fips['county_fips'][2:].lstrip('0')
+    stid = fips['state_fips'].lstrip('0')
     return cyid, stid
 
+  def _look_up_fips(self, fires_info):
+    """
+      Looks up FIPS metadata for all locations to be written in one
+      batch, so that each distinct lat/lng is resolved only once.
+      Locations with invalid lat/lng are left out, to be skipped when
+      writing.
+    """
+    lat_lngs = set()
+    for fire_info in fires_info:
+      for fire_loc in fire_info.locations:
+        if "emissions" in fire_loc.keys() and "plumerise" in fire_loc.keys():
+          try:
+            lat_lngs.add((float(fire_loc['lat']), float(fire_loc['lng'])))
+          except (TypeError, ValueError):
+            pass
+
+    lat_lngs = sorted(lat_lngs)
+    fips = self._fips_resolver.lookup_many([l[0] for l in lat_lngs],
+      [l[1] for l in lat_lngs])
+    self._fips = dict(zip(lat_lngs, fips))
+    self._fips_resolver.save()
+
   def _map_scc(self, fire_type):
     # Mappings provided by BSF (fill_data.py)
     SCC_CODE_MAPPING = {
@@ -6,7 +6,7 @@ import datetime
 import logging
 
 from bluesky.config import Config
-from bluesky.datetimeutils import to_datetime, parse_utc_offset
+from bluesky.datetimeutils import to_datetime
 from bluesky.locationutils import LatLng
 
 from . import FiresActionBase
@@ -303,15 +303,15 @@ class FireActivityFilter(FiresActionBase):
             elif not active_area.get('start') or not active_area.get('end'):
                 self._fail_fire(fire, self.MISSING_FIRE_LOCATION_INFO_MSG)
 
-            utc_offset = datetime.timedelta(hours=parse_utc_offset(
-                active_area.get('utc_offset') or 0))
+            utc_offset = datetime.timedelta(hours=(active_area.parsed_utc_offset
+                if active_area.get('utc_offset') else 0))
 
-            aa_s = to_datetime(active_area['start'])
+            aa_s = active_area.parsed_start
             # check if e_is_local, since we're comparing aa_s against e
             if not e_is_local:
                 aa_s = aa_s - utc_offset
 
-            aa_e = to_datetime(active_area['end'])
+            aa_e = active_area.parsed_end
             # same thing, but s_is_local
             if not s_is_local:
                 aa_e = aa_e - utc_offset
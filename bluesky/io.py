@@ -164,9 +164,16 @@ class SubprocessExecutor(object):
 
     def __init__(self, stdout_log_level=logging.DEBUG):
         self._stdout_log_level = stdout_log_level
+        # Resource usage of the last executed process (see os.wait4), if
+        # run with real time logging on a platform supporting wait4
+        self.rusage = None
+        # Exit status of the last executed process, if it ran
+        self.returncode = None
 
     def execute(self, *args, cwd=None, realtime_logging=True):
         self._set_cmd_args(args)
+        self.rusage = None
+        self.returncode = None
 
         try:
             f = (self._execute_with_real_time_logging if realtime_logging
@@ -174,6 +181,7 @@ class SubprocessExecutor(object):
             f(cwd)
 
         except subprocess.CalledProcessError as e:
+            self.returncode = e.returncode
             # note e.output and e.stdout are aliases
             self._log(e.output)
             self._log(e.stderr, is_stdout=False)
@@ -181,7 +189,7 @@ class SubprocessExecutor(object):
             #   be logged by top level exception handler
             msg = (e.stderr or e.output or str(e))
             msg = self._get_last_line(msg)
-            raise BlueSkySubprocessError(msg)
+            raise BlueSkySubprocessError(msg, returncode=e.returncode)
 
         except FileNotFoundError as e:
             self._log(e.strerror, is_stdout=False)
@@ -240,13 +248,34 @@ class SubprocessExecutor(object):
             if line != "":
                 self._log(line)
 
-            ret_val = process.poll()
+            ret_val = self._poll(process)
 
+        self.returncode = ret_val
         if ret_val > 0:
             serr = process.stderr.read()
             self._log(serr, is_stdout=False)
             msg = self._get_last_line(serr)
-            raise BlueSkySubprocessError(msg)
+            raise BlueSkySubprocessError(msg, returncode=ret_val)
+
+    def _poll(self, process):
+        """Like process.poll, but also records the process' resource usage
+        """
+        if not hasattr(os, 'wait4'):
+            return process.poll()
+
+        try:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        except ChildProcessError:
+            # already reaped
+            return process.poll()
+
+        if pid == 0:
+            return None
+
+        self.rusage = rusage
+        process.returncode = (-os.WTERMSIG(status) if os.WIFSIGNALED(status)
+            else os.WEXITSTATUS(status))
+        return process.returncode
 
     def _execute_with_logging_after(self, cwd):
         # Use check_output so that output isn't sent to stdout
@@ -254,6 +283,7 @@ class SubprocessExecutor(object):
         #   different log levels can be used.
         output = subprocess.check_output(self._cmd_args,
             stderr=subprocess.STDOUT, cwd=cwd, universal_newlines=True)
+        self.returncode = 0
         self._log(output)
 
     def _log(self, output, is_stdout=True):
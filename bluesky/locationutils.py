@@ -2,14 +2,21 @@
 
 __author__ = "Joel Dubowy"
 
+from collections import abc
+
 from geoutils.geojson import get_centroid
 
 # FIPS
+import json
+import logging
+import numbers
 import os
-from shapely.geometry import Point
+
 import geopandas as gpd
 import requests
-import json
+from shapely.geometry import Point
+from shapely.prepared import prep
+from shapely.strtree import STRtree
 
 INVALID_LOCATION_DATA = ("Invalid location data required for"
     " determining single, representative lat/lng")
@@ -25,16 +32,29 @@ INVALID_LAT_LNG_DATA = ("Invalid latitude or longitude were entered. Ensure they
     " values")
 INVALID_FIPS_RESPONSE = ("An Error Occurred Locating the FIPS code for this Lat/Lng")
 
+FIPS_API_URL = ("https://geo.fcc.gov/api/census/block/find"
+    "?latitude={}&longitude={}&format=json")
+COUNTIES_FIPS_SHAPEFILE = os.path.join(os.path.dirname(__file__), 'fips',
+    'counties_fips.shp')
+
 class LatLng(object):
     """Determines single lat,lng coordinate best representing given
     active area information
     """
 
     def __init__(self, location_data):
-        if not isinstance(location_data, dict):
+        if not isinstance(location_data, abc.Mapping):
             raise ValueError(INVALID_LOCATION_DATA)
         self._location_data = location_data
-        self._compute()
+
+        # Location and ActiveArea objects cache their representative
+        # lat,lng until their location data is modified
+        cached_lat_lng = getattr(location_data, 'cached_lat_lng', None)
+        if cached_lat_lng:
+            self._latitude, self._longitude = cached_lat_lng(
+                self._compute_lat_lng)
+        else:
+            self._compute()
 
     @property
     def latitude(self):
@@ -44,6 +64,10 @@ class LatLng(object):
     def longitude(self):
         return self._longitude
 
+    def _compute_lat_lng(self):
+        self._compute()
+        return self._latitude, self._longitude
+
     def _compute(self):
         if set(['lat', 'lng']).issubset(self._location_data):
             self._set_from_specified_point(self._location_data)
@@ -142,53 +166,219 @@ class Fips(object):
 
     def _get_fips(self):
         # try API and fallback to Shapefile
-        url = "https://geo.fcc.gov/api/census/block/find?latitude={}&longitude={}&format=json".format(self.lat, self.lng)
-
         try:
-            r = requests.get(url)
-            if r.status_code == 200:
-                data = json.loads(r.content.decode())
-                self._process_api_data(data)
-            else:
-                self._get_shp_data()
+            data = _query_fips_api(self.lat, self.lng)
         except:
-            self._get_shp_data()
+            data = None
 
-    def _process_api_data(self, data):
-        # process the response payload from the API
-        self._county_name = data['County']['name']
-        self._county_fips = data['County']['FIPS']
-        self._state_name = data['State']['name']
-        self._state_fips = data['State']['FIPS']
-        self._state_code = data['State']['code']
+        if data:
+            self._process_fips_data(data)
+        else:
+            self._get_shp_data()
 
     def _get_shp_data(self):
-        # get counties_fips shapefile
-        filename = os.path.join(os.path.dirname(__file__), 'fips', 'counties_fips.shp')
+        data = _get_county_index().lookup(self.lat, self.lng)
+        if not data:
+            raise RuntimeError(INVALID_FIPS_RESPONSE)
+        self._process_fips_data(data)
 
-        # load into geopandas and set CRS
-        gdf = gpd.read_file(filename)
-        gdf = gdf.to_crs(epsg=4326)
+    def _process_fips_data(self, data):
+        self._county_name = data['county_name']
+        self._county_fips = data['county_fips']
+        self._state_name = data['state_name']
+        self._state_fips = data['state_fips']
+        self._state_code = data['state_code']
 
-        # Shapely point
-        p = Point(self.lng, self.lat)
 
-        # apply lambda to determine if point is within the geometry of the object
-        gdf['match'] = gdf.geometry.apply(lambda x: p.within(x))
+class FipsResolver(object):
+    """Offline-first resolver of FIPS metadata for many lat/lngs
 
-        # return matches
-        resdf = gdf.loc[gdf.match == True]
+    Points are looked up in a spatial index of the counties_fips
+    shapefile, which is loaded once per process.  The FCC Census API is
+    only queried, if `api_fallback` is set, for points not in any county.
 
-        # only one row should be retuned
-        if len(resdf.index) == 1:
-            self._process_shp_data(resdf.iloc[0])
-        else:
-            raise RuntimeError(INVALID_FIPS_RESPONSE)
+    If `cache_precision` is specified, results are cached in memory,
+    keyed by lat and lng rounded to that many decimal places; points
+    that round to the same lat/lng are assumed to be in the same
+    county.  If `cache_file` is also specified, the cache is loaded
+    from it, if it exists, and written back to it by `save`.
+
+    Results are dicts with keys 'county_name', 'county_fips',
+    'state_name', 'state_fips', and 'state_code', or None for points
+    that couldn't be resolved.  ('state_name' and 'state_code' are None
+    when resolved from the shapefile.)
+    """
 
-    def _process_shp_data(self, data):
-        # process the response payload from the SHP file
-        self._county_name = data.NAME
-        self._county_fips = data.GEOID
-        self._state_name = None
-        self._state_fips = data.STATEFP
-        self._state_code = None
+    def __init__(self, cache_precision=None, cache_file=None,
+            api_fallback=False):
+        if cache_file and cache_precision is None:
+            raise ValueError("FIPS cache precision must be specified "
+                "when using a FIPS cache file")
+
+        self._cache_precision = cache_precision
+        self._cache_file = cache_file
+        self._api_fallback = api_fallback
+        self._cache = self._load_cache() if cache_file else {}
+
+    def lookup(self, lat, lng):
+        return self.lookup_many([lat], [lng])[0]
+
+    def lookup_many(self, lats, lngs):
+        """Returns FIPS metadata for each lat/lng, in the order given"""
+        lats = list(lats)
+        lngs = list(lngs)
+        if len(lats) != len(lngs):
+            raise ValueError("Number of lats and lngs must be equal")
+        try:
+            lat_lngs = [(float(lat), float(lng)) for lat, lng in zip(lats, lngs)]
+        except (TypeError, ValueError):
+            raise ValueError(INVALID_LAT_LNG_DATA)
+
+        results = {}
+        for lat_lng in lat_lngs:
+            if lat_lng not in results:
+                results[lat_lng] = self._lookup(*lat_lng)
+
+        return [results[lat_lng] for lat_lng in lat_lngs]
+
+    def save(self):
+        """Writes the cache to the cache file, if one was specified"""
+        if not self._cache_file:
+            return
+
+        logging.debug("Writing %s cached FIPS lookups to %s",
+            len(self._cache), self._cache_file)
+        tmp_file = self._cache_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps({
+                'precision': self._cache_precision,
+                'fips': self._cache
+            }))
+        os.replace(tmp_file, self._cache_file)
+
+    def _lookup(self, lat, lng):
+        if self._cache_precision is not None:
+            key = '{lat:.{p}f},{lng:.{p}f}'.format(lat=lat, lng=lng,
+                p=self._cache_precision)
+            if key in self._cache:
+                return self._cache[key]
+
+        data = _get_county_index().lookup(lat, lng)
+        if not data and self._api_fallback:
+            try:
+                data = _query_fips_api(lat, lng)
+            except Exception as e:
+                logging.warning("Failed to query FIPS API for %s, %s: %s",
+                    lat, lng, e)
+
+        # Only resolved points are cached, since points not in any county
+        # could be resolved later via the API
+        if data and self._cache_precision is not None:
+            self._cache[key] = data
+
+        return data
+
+    def _load_cache(self):
+        if not os.path.exists(self._cache_file):
+            return {}
+
+        with open(self._cache_file) as f:
+            cache = json.loads(f.read())
+
+        if cache.get('precision') != self._cache_precision:
+            logging.warning("Ignoring FIPS cache file %s, with precision %s",
+                self._cache_file, cache.get('precision'))
+            return {}
+
+        logging.debug("Loaded %s cached FIPS lookups from %s",
+            len(cache['fips']), self._cache_file)
+        return cache['fips']
+
+
+def _query_fips_api(lat, lng):
+    """Queries the FCC Census API, returning FIPS metadata, or None if
+    the request is unsuccessful
+    """
+    r = requests.get(FIPS_API_URL.format(lat, lng))
+    if r.status_code != 200:
+        return None
+
+    # process the response payload from the API
+    data = json.loads(r.content.decode())
+    return {
+        'county_name': data['County']['name'],
+        'county_fips': data['County']['FIPS'],
+        'state_name': data['State']['name'],
+        'state_fips': data['State']['FIPS'],
+        'state_code': data['State']['code']
+    }
+
+
+class PolygonIndex(object):
+    """Spatial index for finding the polygons that contain a point
+
+    The polygons are prepared and put in an STRtree once, so that each
+    point is only tested for containment against the few polygons whose
+    bounding boxes contain it.
+    """
+
+    def __init__(self, polygons):
+        self._polygons = list(polygons)
+        self._prepared = [prep(p) for p in self._polygons]
+        self._indices = {id(p): i for i, p in enumerate(self._polygons)}
+        self._tree = STRtree(self._polygons)
+
+    def containing(self, point):
+        """Returns the indices of the polygons containing the point, in
+        the order the polygons were given
+        """
+        return sorted(i for i in self._query(point)
+            if self._prepared[i].contains(point))
+
+    def _query(self, point):
+        # shapely < 2.0 returns the matching geometries, while shapely
+        # >= 2.0 returns their indices
+        for r in self._tree.query(point):
+            yield r if isinstance(r, numbers.Integral) else self._indices[id(r)]
+
+class _CountyIndex(object):
+    """Spatial index of counties' polygons and FIPS metadata"""
+
+    def __init__(self, polygons, fips_data):
+        self._index = PolygonIndex(polygons)
+        self._fips_data = list(fips_data)
+
+    @classmethod
+    def from_shapefile(cls, filename=COUNTIES_FIPS_SHAPEFILE):
+        logging.debug("Loading counties from %s", filename)
+        # load into geopandas and set CRS
+        gdf = gpd.read_file(filename)
+        gdf = gdf.to_crs(epsg=4326)
+
+        fips_data = [
+            {
+                'county_name': r.NAME,
+                'county_fips': r.GEOID,
+                'state_name': None,
+                'state_fips': r.STATEFP,
+                'state_code': None
+            } for r in gdf.itertuples()
+        ]
+        return cls(gdf.geometry, fips_data)
+
+    def lookup(self, lat, lng):
+        """Returns the FIPS metadata of the county containing the point,
+        or None if it's not within exactly one county
+        """
+        matches = self._index.containing(Point(lng, lat))
+        if len(matches) == 1:
+            return self._fips_data[matches[0]]
+
+_county_index = None
+
+def _get_county_index():
+    """Returns the process' county index, building it on first use"""
+    global _county_index
+    if not _county_index:
+        _county_index = _CountyIndex.from_shapefile()
+    return _county_index
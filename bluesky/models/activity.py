@@ -2,7 +2,13 @@
 
 __author__ = "Joel Dubowy"
 
+import array
 import itertools
+import math
+from collections import abc
+
+from bluesky import datetimeutils
+from bluesky.config import Config
 
 REQUIRED_LOCATION_FIELDS = {
     'specified_points': ['lat', 'lng', 'area'],
@@ -16,7 +22,199 @@ INVALID_LOCATION_MSGS = {
     for k in REQUIRED_LOCATION_FIELDS
 }
 
-class Location(dict):
+NAN = float('nan')
+
+# Fields that, if modified in a location or its active area, could change
+# whether or not the active area's locations are valid
+LOCATION_VALIDATION_FIELDS = frozenset(itertools.chain.from_iterable(
+    REQUIRED_LOCATION_FIELDS.values()))
+
+
+##
+## Mutation tracking
+##
+
+# Incremented whenever location data is modified anywhere, i.e. when a
+# tracked list or tracked dict key is modified.  Cached views record the
+# generation in which they were computed, and are stale once it changes.
+# (Tracking a single global generation, rather than notifying each cached
+# view's owner, keeps working when lists and objects are shared between
+# fires, e.g. after Fire(other_fire).  Location data is rarely modified
+# once loaded, so this costs very little in practice.)
+_generation = 0
+
+def location_data_modified():
+    global _generation
+    _generation += 1
+
+
+class TrackedList(list):
+    """List that records any modifications to it in the location data
+    generation.
+    """
+
+    def __setitem__(self, index, val):
+        super().__setitem__(index, val)
+        location_data_modified()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        location_data_modified()
+
+    def __iadd__(self, other):
+        super().__iadd__(other)
+        location_data_modified()
+        return self
+
+    def __imul__(self, n):
+        super().__imul__(n)
+        location_data_modified()
+        return self
+
+    def append(self, val):
+        super().append(val)
+        location_data_modified()
+
+    def extend(self, other):
+        super().extend(other)
+        location_data_modified()
+
+    def insert(self, index, val):
+        super().insert(index, val)
+        location_data_modified()
+
+    def pop(self, *args):
+        val = super().pop(*args)
+        location_data_modified()
+        return val
+
+    def remove(self, val):
+        super().remove(val)
+        location_data_modified()
+
+    def clear(self):
+        super().clear()
+        location_data_modified()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        location_data_modified()
+
+    def reverse(self):
+        super().reverse()
+        location_data_modified()
+
+
+class ViewCachingDict(dict):
+    """Base class for fire data objects that cache views derived from
+    their contents (e.g. flattened lists of locations).
+
+    Subclasses list the keys that those views depend on in _TRACKED_KEYS,
+    and the subset of them with list values in _TRACKED_LIST_KEYS.  List
+    values of the latter are converted to TrackedList objects.  Modifying
+    a tracked key or list invalidates all cached views.
+    """
+
+    _TRACKED_KEYS = frozenset()
+    _TRACKED_LIST_KEYS = frozenset()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for key in self._TRACKED_LIST_KEYS:
+            if key in self:
+                dict.__setitem__(self, key,
+                    self._track(key, dict.__getitem__(self, key)))
+
+    def _track(self, key, val):
+        if (key in self._TRACKED_LIST_KEYS and isinstance(val, list)
+                and not isinstance(val, TrackedList)):
+            val = TrackedList(val)
+        return val
+
+    def _cached_view(self, name, compute):
+        """Returns the view cached under the given name, if it was computed
+        in the current location data generation, else recomputes it.
+        """
+        cached = self.__dict__.get(name)
+        if cached is None or cached[0] != _generation:
+            val = compute()
+            # compute may itself modify location data (e.g. when casting
+            # areas to float), so the generation is read afterwards
+            cached = self.__dict__[name] = (_generation, val)
+        return cached[1]
+
+    def cached_lat_lng(self, compute):
+        """Returns the (lat, lng) best representing this object's location
+        data, calling compute() only if not cached in the current location
+        data generation.  Used by bluesky.locationutils.LatLng, since
+        computing centroids of multi-point and perimeter locations is
+        expensive and done repeatedly for the same location.
+        """
+        return self._cached_view('_cached_lat_lng', compute)
+
+    ## Mutators
+
+    def __setitem__(self, key, val):
+        super().__setitem__(key, self._track(key, val))
+        if key in self._TRACKED_KEYS:
+            location_data_modified()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        if key in self._TRACKED_KEYS:
+            location_data_modified()
+
+    def pop(self, key, *args):
+        val = super().pop(key, *args)
+        if key in self._TRACKED_KEYS:
+            location_data_modified()
+        return val
+
+    def popitem(self):
+        item = super().popitem()
+        if item[0] in self._TRACKED_KEYS:
+            location_data_modified()
+        return item
+
+    def setdefault(self, key, default=None):
+        if not dict.__contains__(self, key):
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        super().update({k: self._track(k, v) for k, v in other.items()})
+        if self._TRACKED_KEYS.intersection(other):
+            location_data_modified()
+
+    def clear(self):
+        super().clear()
+        location_data_modified()
+
+    ## Copying and pickling
+
+    def __getstate__(self):
+        # Generations aren't meaningful across processes, so cached views
+        # are left out of copies and pickles
+        return {k: v for k, v in self.__dict__.items()
+            if not k.startswith('_cached_')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+##
+## Fire data objects
+##
+
+class Location(ViewCachingDict):
+
+    _TRACKED_KEYS = LOCATION_VALIDATION_FIELDS
+    # Perimeter polygons are tracked so that cached representative
+    # lat/lngs are recomputed when vertices are added or removed
+    _TRACKED_LIST_KEYS = frozenset({'polygon'})
+
+    _active_area = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -58,14 +256,280 @@ class Location(dict):
             self._active_area and attr not in self.LOCATION_ONLY_FIELDS
             and attr in self._active_area)
 
-class ActiveArea(dict):
+class CompactLocation(abc.MutableMapping):
+    """View of a single point in a CompactSpecifiedPoints object, supporting
+    the same mapping interface as Location objects, including falling back
+    on the parent active area for fields not defined for the point.
+
+    If the point is removed or replaced, the view is detached and keeps
+    a copy of the point's data.
+    """
+
+    __slots__ = ('_points', '_index', '_data')
+
+    def __init__(self, points, index):
+        self._points = points
+        self._index = index
+        self._data = None
+
+    def _detach(self):
+        self._data = self._points._get_point(self._index)
+        self._points = None
+
+    def __getitem__(self, attr):
+        points = self._points
+        if points is None:
+            return self._data[attr]
+
+        # Fast path for float fields, which is most lookups
+        values = points._floats.get(attr)
+        if values is not None:
+            val = values[self._index]
+            if val == val:  # i.e. not NaN
+                return val
+
+        try:
+            return points._get_field(self._index, attr)
+        except KeyError:
+            if (points.active_area
+                    and attr not in Location.LOCATION_ONLY_FIELDS):
+                return points.active_area[attr]
+            raise
+
+    def __setitem__(self, attr, val):
+        if self._points is None:
+            self._data[attr] = val
+        else:
+            self._points._set_field(self._index, attr, val)
+            if attr in LOCATION_VALIDATION_FIELDS:
+                location_data_modified()
+
+    def __delitem__(self, attr):
+        if self._points is None:
+            del self._data[attr]
+        else:
+            self._points._del_field(self._index, attr)
+            if attr in LOCATION_VALIDATION_FIELDS:
+                location_data_modified()
+
+    def __iter__(self):
+        if self._points is None:
+            return iter(self._data)
+        return iter(self._points._get_keys(self._index))
+
+    def __len__(self):
+        if self._points is None:
+            return len(self._data)
+        return len(self._points._get_keys(self._index))
+
+    def setdefault(self, attr, default=None):
+        # Like Location.setdefault, only considers the point's own fields
+        if attr not in iter(self):
+            self[attr] = default
+            return default
+        return self[attr]
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class CompactSpecifiedPoints(abc.MutableSequence):
+    """Compact alternative to a list of Location objects, for active areas
+    with large numbers of specified points.
+
+    Float 'lat', 'lng', and 'area' values are stored in typed arrays, and
+    'utc_offset' values as indices into a table of distinct values.  Any
+    other fields (e.g. 'fuelbeds', added by modules), and any values that
+    can't be stored in the arrays (e.g. string or int areas), are stored in
+    per-point dicts, created as needed.  Points are accessed as
+    CompactLocation views.
+    """
+
+    FLOAT_FIELDS = ('lat', 'lng', 'area')
+
+    def __init__(self, points=(), active_area=None):
+        self.active_area = active_area
+        self._floats = {f: array.array('d') for f in self.FLOAT_FIELDS}
+        self._utc_offset_idxs = array.array('i')
+        self._utc_offsets = []
+        self._utc_offset_lookup = {}
+        self._extras = []
+        self._views = []
+        for p in points:
+            self._insert_point(len(self), p)
+
+    ## Sequence interface
+
+    def __len__(self):
+        return len(self._extras)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]  # normalizes, and raises IndexError
+        if self._views[index] is None:
+            self._views[index] = CompactLocation(self, index)
+        return self._views[index]
+
+    def __setitem__(self, index, point):
+        if isinstance(index, slice):
+            raise TypeError("CompactSpecifiedPoints don't support slice assignment")
+        index = range(len(self))[index]
+        self._remove_point(index)
+        self._insert_point(index, point)
+        location_data_modified()
+
+    def __delitem__(self, index):
+        indices = (range(len(self))[index] if isinstance(index, slice)
+            else [range(len(self))[index]])
+        for i in sorted(indices, reverse=True):
+            self._remove_point(i)
+        location_data_modified()
+
+    def insert(self, index, point):
+        # same semantics as list.insert for out-of-range indices
+        if index < 0:
+            index = max(len(self) + index, 0)
+        self._insert_point(min(index, len(self)), point)
+        location_data_modified()
+
+    def __eq__(self, other):
+        if isinstance(other, abc.Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def tolist(self):
+        """Returns points as list of plain dicts (e.g. for json encoding)"""
+        return [self._get_point(i) for i in range(len(self))]
+
+    ## Point storage
+
+    def _insert_point(self, index, point):
+        for f in self.FLOAT_FIELDS:
+            self._floats[f].insert(index, NAN)
+        self._utc_offset_idxs.insert(index, -1)
+        self._extras.insert(index, None)
+        self._views.insert(index, None)
+        for v in self._views[index + 1:]:
+            if v is not None:
+                v._index += 1
+        for k, v in point.items():
+            self._set_field(index, k, v)
+
+    def _remove_point(self, index):
+        view = self._views[index]
+        if view is not None:
+            view._detach()
+        for f in self.FLOAT_FIELDS:
+            del self._floats[f][index]
+        del self._utc_offset_idxs[index]
+        del self._extras[index]
+        del self._views[index]
+        for v in self._views[index:]:
+            if v is not None:
+                v._index -= 1
+
+    def _get_point(self, index):
+        return {k: self._get_field(index, k) for k in self._get_keys(index)}
+
+    def _get_keys(self, index):
+        keys = [f for f in self.FLOAT_FIELDS
+            if not math.isnan(self._floats[f][index])]
+        if self._utc_offset_idxs[index] >= 0:
+            keys.append('utc_offset')
+        if self._extras[index]:
+            keys.extend(self._extras[index])
+        return keys
+
+    def _get_field(self, index, attr):
+        if attr in self._floats:
+            val = self._floats[attr][index]
+            if not math.isnan(val):
+                return val
+        elif attr == 'utc_offset':
+            i = self._utc_offset_idxs[index]
+            if i >= 0:
+                return self._utc_offsets[i]
+        extra = self._extras[index]
+        if extra is not None and attr in extra:
+            return extra[attr]
+        raise KeyError(attr)
+
+    def _set_field(self, index, attr, val):
+        self._pop_extra(index, attr)
+        if attr in self._floats:
+            # NaN marks the value as not in the array
+            if type(val) is float and not math.isnan(val):
+                self._floats[attr][index] = val
+                return
+            self._floats[attr][index] = NAN
+
+        elif attr == 'utc_offset':
+            i = self._get_utc_offset_idx(val)
+            self._utc_offset_idxs[index] = i
+            if i >= 0:
+                return
+
+        if self._extras[index] is None:
+            self._extras[index] = {}
+        self._extras[index][attr] = val
+
+    def _del_field(self, index, attr):
+        if attr not in self._get_keys(index):
+            raise KeyError(attr)
+        if attr in self._floats:
+            self._floats[attr][index] = NAN
+        elif attr == 'utc_offset':
+            self._utc_offset_idxs[index] = -1
+        self._pop_extra(index, attr)
+
+    def _pop_extra(self, index, attr):
+        extra = self._extras[index]
+        if extra is not None:
+            extra.pop(attr, None)
+            if not extra:
+                self._extras[index] = None
+
+    def _get_utc_offset_idx(self, val):
+        # type is included in the key so that, e.g., 1 and 1.0 aren't
+        # conflated; unhashable values aren't stored in the table
+        try:
+            key = (type(val), val)
+            if key not in self._utc_offset_lookup:
+                self._utc_offset_lookup[key] = len(self._utc_offsets)
+                self._utc_offsets.append(val)
+            return self._utc_offset_lookup[key]
+        except TypeError:
+            return -1
+
+
+class ActiveArea(ViewCachingDict):
+
+    # Location fields fall back on the active area's, so the active
+    # area's own 'lat', 'lng', etc. are tracked as well
+    _TRACKED_KEYS = frozenset(
+        {'specified_points', 'perimeter'} | LOCATION_VALIDATION_FIELDS)
+    _TRACKED_LIST_KEYS = frozenset({'specified_points'})
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        if self.get('specified_points'):
-            self['specified_points'] = [Location(p, active_area=self)
-                for p in self['specified_points']]
+        specified_points = self.get('specified_points')
+        if isinstance(specified_points, CompactSpecifiedPoints):
+            specified_points.active_area = self
+
+        elif specified_points:
+            threshold = Config().get('compact_specified_points_threshold')
+            if threshold and len(specified_points) >= threshold:
+                self['specified_points'] = CompactSpecifiedPoints(
+                    specified_points, active_area=self)
+            else:
+                self['specified_points'] = [Location(p, active_area=self)
+                    for p in specified_points]
 
         if self.get('perimeter'):
             self['perimeter'] = Location(self['perimeter'], active_area=self)
@@ -86,8 +550,9 @@ class ActiveArea(dict):
     def locations(self):
         """Returns the specified_points or perimeter polygon as list.
 
-        This method validates data and casts areas to float every time it
-        is called, in case fire activity data is made invalid mid-run
+        This method validates data and casts areas to float, and caches
+        the result until location data is modified (see ViewCachingDict),
+        in case fire activity data is made invalid mid-run
         (which should only be possibly if a user imports the bluesky package
         instead of running 'bsp')
 
@@ -95,6 +560,9 @@ class ActiveArea(dict):
         this method will be called before fuelbeds, which fills in perimeter
         area if not already defined.
         """
+        return self._cached_view('_cached_locations', self._get_locations)
+
+    def _get_locations(self):
         if self.get('specified_points'):
             return self._validate_locations('specified_points')
 
@@ -119,6 +587,42 @@ class ActiveArea(dict):
         return locations
 
 
+    ## Parsed times
+
+    @property
+    def parsed_start(self):
+        """Returns 'start' parsed to a datetime object, parsing it only
+        once per value (see _parsed)
+        """
+        return self._parsed('start',
+            lambda v: datetimeutils.parse_datetime(v, 'start'))
+
+    @property
+    def parsed_end(self):
+        """Returns 'end' parsed to a datetime object"""
+        return self._parsed('end',
+            lambda v: datetimeutils.parse_datetime(v, 'end'))
+
+    @property
+    def parsed_utc_offset(self):
+        """Returns 'utc_offset' parsed to hours"""
+        return self._parsed('utc_offset', datetimeutils.parse_utc_offset)
+
+    def _parsed(self, key, parse):
+        """Returns parse(self.get(key)), caching the result along with the
+        raw value, so that the value is parsed again only if replaced.
+        (Datetime and utc offset values are immutable, so checking the
+        raw value's identity is sufficient.)  Failures aren't cached.
+        """
+        val = self.get(key)
+        cached = self.__dict__.get('_cached_parsed_' + key)
+        if cached is not None and cached[0] is val:
+            return cached[1]
+        parsed = parse(val)
+        self.__dict__['_cached_parsed_' + key] = (val, parsed)
+        return parsed
+
+
     MISSING_OR_INVALID_AREA_FOR_SPECIFIED_POINT = (
         "Missing or invalid area for specified point")
     MISSING_OR_INVALID_AREA_FOR_PERIMIETER = (
@@ -153,7 +657,10 @@ class ActiveArea(dict):
         else:
             raise ValueError(self.MISSING_LOCATION_INFO_FOR_ACTIVE_AREA)
 
-class ActivityCollection(dict):
+class ActivityCollection(ViewCachingDict):
+
+    _TRACKED_KEYS = frozenset({'active_areas'})
+    _TRACKED_LIST_KEYS = frozenset({'active_areas'})
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
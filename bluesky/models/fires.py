@@ -2,28 +2,31 @@
 
 __author__ = "Joel Dubowy"
 
+import contextlib
 import datetime
 import importlib
 import itertools
 import json
 import logging
+import multiprocessing
+import pickle
 import sys
 import traceback
 import uuid
-from collections import OrderedDict
+from collections import OrderedDict, abc
 
 from pyairfire import process
 
 from bluesky import datautils, datetimeutils, __version__
 from bluesky.config import Config
 from bluesky.exceptions import (
-    BlueSkyImportError, BlueSkyModuleError
+    BlueSkyConfigurationError, BlueSkyImportError, BlueSkyModuleError
 )
 from bluesky.filtermerge.filter import FireActivityFilter
 from bluesky.filtermerge.merge import FiresMerger
 from bluesky.statuslogging import StatusLogger
 
-from .activity import ActiveArea, ActivityCollection
+from .activity import ActiveArea, ActivityCollection, ViewCachingDict
 
 __all__ = [
     'Fire',
@@ -36,11 +39,14 @@ __all__ = [
 ##
 
 
-class Fire(dict):
+class Fire(ViewCachingDict):
 
     DEFAULT_TYPE = 'wildfire'
     DEFAULT_FUEL_TYPE = 'natural'
 
+    _TRACKED_KEYS = frozenset({'activity'})
+    _TRACKED_LIST_KEYS = frozenset({'activity'})
+
     def __init__(self, *args, **kwargs):
         super(Fire, self).__init__(*args, **kwargs)
 
@@ -79,22 +85,24 @@ class Fire(dict):
         """Returns flat list of fire active areas, from across all activity
         collections.
 
-        We could memoize this method, but would need to invalidate
-        when adding/removing collections or active areas, or when
-        modifying points or perimeters.
+        The list is memoized until location data is modified, e.g. when
+        adding/removing collections or active areas, or when modifying
+        points or perimeters (see ViewCachingDict).  A copy is returned,
+        so that callers may modify it.
         """
-        return list(itertools.chain.from_iterable(
-            [ac.active_areas for ac in self.get('activity', [])]
-        ))
+        return list(self._cached_view('_cached_active_areas',
+            lambda: list(itertools.chain.from_iterable(
+                [ac.active_areas for ac in self.get('activity', [])]))))
 
     @property
     def locations(self):
         """Returns flat list of locations from across all active areas
 
-        Use in summarizing code.
+        Use in summarizing code.  Memoized like active_areas.
         """
-        return list(itertools.chain.from_iterable(
-            [aa.locations for aa in self.active_areas]))
+        return list(self._cached_view('_cached_locations',
+            lambda: list(itertools.chain.from_iterable(
+                [aa.locations for aa in self.active_areas]))))
 
 
     @property
@@ -107,10 +115,10 @@ class Fire(dict):
         active_areas = [a for a in self.active_areas if a.get('start')]
         if active_areas:
             active_areas = sorted(active_areas, key=lambda a: a['start'])
-            # record utc offset of initial active area, in case
+            # record initial active area, for its utc offset, in case
             # start_utc is being called
-            self.__utc_offset = active_areas[0].get('utc_offset')
-            return datetimeutils.parse_datetime(active_areas[0]['start'], 'start')
+            self.__utc_offset_active_area = active_areas[0]
+            return active_areas[0].parsed_start
 
     @property
     def start_utc(self):
@@ -131,10 +139,10 @@ class Fire(dict):
         active_areas = [a for a in self.active_areas if a.get('end')]
         if active_areas:
             active_areas = sorted(active_areas, key=lambda a: a['end'])
-            # record utc offset of initial active area, in case
-            # start_utc is being called
-            self.__utc_offset = active_areas[-1].get('utc_offset')
-            return datetimeutils.parse_datetime(active_areas[-1]['end'], 'end')
+            # record final active area, for its utc offset, in case
+            # end_utc is being called
+            self.__utc_offset_active_area = active_areas[-1]
+            return active_areas[-1].parsed_end
 
     @property
     def end_utc(self):
@@ -142,9 +150,10 @@ class Fire(dict):
 
     def _to_utc(self, dt):
         if dt:
-            if self.__utc_offset:
+            active_area = self.__utc_offset_active_area
+            if active_area.get('utc_offset'):
                 dt = dt - datetime.timedelta(
-                    hours=datetimeutils.parse_utc_offset(self.__utc_offset))
+                    hours=active_area.parsed_utc_offset)
             # else, assume zero offset
             return dt
 
@@ -182,7 +191,7 @@ class Fire(dict):
         super(Fire, self).__setitem__(attr, val)
 
     def __getattr__(self, attr):
-        if attr in list(self.keys()):
+        if attr in self:
             return self[attr]
         raise AttributeError(attr)
 
@@ -193,12 +202,45 @@ class Fire(dict):
             super(Fire, self).__setattr__(attr, val)
 
 
+##
+## Per-fire process pool workers (see FiresManager.run_per_fire)
+##
+
+_FIRE_WORKER_TASK = None
+
+def _initialize_fire_worker(config, func, args):
+    global _FIRE_WORKER_TASK
+    # We need to set config to what was loaded in the main process.
+    # Otherwise, we'll just be using defaults
+    Config().set(config)
+    _FIRE_WORKER_TASK = (func, args)
+
+def _run_fire_in_worker(fire):
+    func, args = _FIRE_WORKER_TASK
+    try:
+        func(fire, *args)
+        return dict(fire), None
+
+    except Exception as e:
+        remote_traceback = traceback.format_tb(e.__traceback__)
+        try:
+            # make sure exception can be sent back to main process
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            e = RuntimeError(str(e))
+        e.remote_traceback = remote_traceback
+        return None, e
+
+
 class FireEncoder(json.JSONEncoder):
     def default(self, obj):
         if hasattr(obj, 'tolist'):
             return obj.tolist()
         elif isinstance(obj, datetime.date):
             return obj.isoformat()
+        elif isinstance(obj, abc.Mapping):
+            # e.g. CompactLocation
+            return dict(obj)
 
         return json.JSONEncoder.default(self, obj)
 
@@ -217,6 +259,11 @@ class FiresManager(object):
         self.fires = [] # this intitializes self._fires and self._num_fires
         self._num_fires = 0
         self._initialize_run_id()
+        self._streaming = False
+        self._streamed_totals = {}
+        self._ndjson_records = None
+        self._run_state = None
+        self._fire_failure_handler_class = None
 
     ##
     ## Importing
@@ -233,16 +280,24 @@ class FiresManager(object):
         if fire.id not in self._fires:
             self._fires[fire.id] = []
         self._fires[fire.id].append(fire)
+        self._fires_by_private_id[fire._private_id] = fire
+        self._fires_list = None
         self._num_fires += 1
 
 
     def remove_fire(self, fire):
         # TODO: raise exception if fire doesn't exist ?
         if fire.id in self._fires:
+            # A new list is created, rather than removing from the existing
+            # one, since callers (e.g. FiresMerger) may be iterating through it
             _n = len(self._fires[fire.id])
             self._fires[fire.id] = [f for f in self._fires[fire.id]
                 if f._private_id != fire._private_id]
-            self._num_fires -= (_n - len(self._fires[fire.id]))
+            num_removed = _n - len(self._fires[fire.id])
+            self._num_fires -= num_removed
+            if num_removed:
+                self._fires_by_private_id.pop(fire._private_id, None)
+                self._fires_list = None
             if len(self._fires[fire.id]) == 0:
                 # that was last fire with that id
                 self._fires.pop(fire.id)
@@ -278,18 +333,24 @@ class FiresManager(object):
     ##
 
     def _get_fire(self, fire):
-        fires_with_id = self._fires.get(fire.id)
-        if fires_with_id:
-            fires_with_p_id = [f for f in fires_with_id
-                if f._private_id == fire._private_id]
-            if fires_with_p_id:
-                # will be len == 1
-                return fires_with_p_id[0]
+        f = self._fires_by_private_id.get(fire._private_id)
+        if f is not None and f.id == fire.id:
+            return f
 
     @property
     def fires(self):
-        return [fire_obj for fire_list in self._fires.values()
-            for fire_obj in fire_list]
+        """Returns flat list of fires, ordered by id (in the order each id
+        was first added) and then by the order fires were added.
+
+        The list is cached, and is rebuilt only after fires are added or
+        removed (including when fires are merged). Callers may iterate
+        through the list while fires are being added or removed, since a
+        new list is built in that case, but they must not modify it.
+        """
+        if self._fires_list is None:
+            self._fires_list = [fire_obj for fire_list in self._fires.values()
+                for fire_obj in fire_list]
+        return self._fires_list
 
     @property
     def num_fires(self):
@@ -303,6 +364,8 @@ class FiresManager(object):
     def fires(self, fires_list):
         self._num_fires = 0
         self._fires = OrderedDict()
+        self._fires_by_private_id = {}
+        self._fires_list = None
         for fire in fires_list:
             self.add_fire(Fire(fire))
 
@@ -425,14 +488,14 @@ class FiresManager(object):
     def earliest_start(self):
         start_times = [s for s in [f.start_utc for f in self.fires] if s]
         if start_times:
-            return sorted(start_times)[0]
+            return min(start_times)
         # TODO: else try to determine from "met", if defined (?)
 
     @property
     def latest_end(self):
         end_times = [e for e in [f.end_utc for f in self.fires] if e]
         if end_times:
-            return sorted(end_times)[-1]
+            return max(end_times)
         # TODO: else try to determine from "met", if defined (?)
 
     @property
@@ -497,6 +560,42 @@ class FiresManager(object):
         else:
             self.processing[-1].update(v)
 
+    @contextlib.contextmanager
+    def run_state(self, key, factory, finish=None):
+        """Provides state that a module keeps for the rest of the run (e.g.
+        caches), creating it with factory() the first time it's requested.
+        In run_ndjson, where modules are run once per fire, this keeps
+        per-run setup from being repeated for each fire.
+
+        If specified, finish(state) is called at the end of the run.  If a
+        module is run outside of run or run_ndjson, state isn't kept, and
+        finish is called when the 'with' block exits.
+
+            with fires_manager.run_state(__name__, Cache, Cache.save) as cache:
+                ...
+        """
+        if self._run_state is None:
+            state = factory()
+            try:
+                yield state
+            finally:
+                if finish:
+                    finish(state)
+            return
+
+        if key not in self._run_state:
+            self._run_state[key] = (factory(), finish)
+        yield self._run_state[key][0]
+
+    def _finish_run_state(self):
+        run_state, self._run_state = self._run_state or {}, None
+        for key, (state, finish) in run_state.items():
+            if finish:
+                try:
+                    finish(state)
+                except Exception as e:
+                    logging.error("Failed to finish %s run state: %s", key, e)
+
     def summarize(self, **data):
         self.summary = self.summary or {}
         self.summary = datautils.deepmerge(self.summary, data)
@@ -514,6 +613,7 @@ class FiresManager(object):
     def run(self): #, module_names):
         self.log_status('Good', 'Main', 'Start')
         self.runtime = self.runtime or {"modules": []}
+        self._run_state = {}
         failed = False
 
         logging.summary("Modules to be run: %s", ', '.join(self._module_names))
@@ -558,6 +658,9 @@ class FiresManager(object):
                     }
                     self.log_status('Failure', self._module_names[i], 'Die')
 
+        # (module failures are caught above)
+        self._finish_run_state()
+
         if failed:
             self.log_status('Failure', 'Main', 'Die')
             # If there was a failure
@@ -565,6 +668,61 @@ class FiresManager(object):
 
         self.log_status('Good', 'Main', 'Finish')
 
+    ## Per-fire processing
+
+    VALID_EXECUTOR_TYPES = ('serial', 'process_pool')
+
+    def run_per_fire(self, func, *args):
+        """Calls func(fire, *args) on each fire, within the fire failure
+        handler.  func must modify the fire in place.
+
+        If config 'executor' > 'type' is 'process_pool', fires are farmed out
+        to a pool of worker processes.  Config, func, and args are passed
+        to each worker once, when it's started; fires are sent to the
+        workers, and each modified fire's data is copied back into the
+        original fire object.  Failures are handled as they would be if run
+        serially - fires are considered in order, and the first failure
+        aborts the run, unless skip_failed_fires is set, in which case failed
+        fires are moved to failed_fires.  func and args must be picklable,
+        and func must not rely on fires_manager.
+        """
+        fires = self.fires
+        executor_type = Config().get('executor', 'type')
+        if executor_type not in self.VALID_EXECUTOR_TYPES:
+            raise BlueSkyConfigurationError(
+                "Invalid executor type: '{}'".format(executor_type))
+
+        if executor_type == 'serial' or len(fires) < 2:
+            for fire in fires:
+                with self.fire_failure_handler(fire):
+                    func(fire, *args)
+            return
+
+        num_processes = min(len(fires), Config().get('executor',
+            'num_processes') or multiprocessing.cpu_count())
+        # By default, send each worker a few chunks of fires, to balance
+        # load without too much interprocess communication
+        chunksize = (Config().get('executor', 'chunksize')
+            or max(1, len(fires) // (num_processes * 4)))
+        logging.debug("Running %s on %s fires with %s processes, chunksize %s",
+            func.__name__, len(fires), num_processes, chunksize)
+
+        pool = multiprocessing.Pool(num_processes, _initialize_fire_worker,
+            (Config().get(), func, args))
+        try:
+            results = pool.imap(_run_fire_in_worker, fires, chunksize)
+            for fire, (fire_data, exc) in zip(fires, results):
+                with self.fire_failure_handler(fire):
+                    if exc:
+                        raise exc
+                    fire.clear()
+                    fire.update(fire_data)
+            pool.close()
+        finally:
+            # If a failure was raised, this abandons any remaining fires
+            pool.terminate()
+            pool.join()
+
     ## Filtering Fires
 
     def filter_fires(self):
@@ -591,6 +749,11 @@ class FiresManager(object):
                 with fires_manager.fire_failure_handler(fires_manager, fire):
                     ....
         """
+        # The class is defined once per FiresManager object, since
+        # this property is accessed for every fire in every module
+        if self._fire_failure_handler_class:
+            return self._fire_failure_handler_class
+
         fires_manager = self
         class klass(object):
             def __init__(self, fire):
@@ -605,17 +768,21 @@ class FiresManager(object):
                     # managed by fires_manager
                     f = fires_manager._get_fire(self._fire)
                     if f:
+                        # Use the traceback from the worker process, if
+                        # the fire was processed in one (see run_per_fire)
+                        tb_lines = (getattr(value, 'remote_traceback', None)
+                            or traceback.format_tb(tb))
                         # Add error infromation to fire object.
                         # Note that error information will also be added to
                         # top level if skip_failed_fires == False
                         f.error = {
                             "type": value.__class__.__name__,
                             "message": str(value),
-                            "traceback": str(traceback.format_tb(tb))
+                            "traceback": str(tb_lines)
                         }
                         if fires_manager.skip_failed_fires:
                             logging.warning(str(value))
-                            logging.warning(str(traceback.format_tb(tb)))
+                            logging.warning(str(tb_lines))
                             # move fire to failed list, excluding it from
                             # future processing
                             if fires_manager.failed_fires is None:
@@ -634,6 +801,7 @@ class FiresManager(object):
                             "fires_manager".format(self._fire.id,
                             self._fire._private_id))
 
+        self._fire_failure_handler_class = klass
         return klass
 
     @property
@@ -691,6 +859,9 @@ class FiresManager(object):
     ## Dumping data
 
     def dump(self):
+        return self._dump(self.fires, self.counts)
+
+    def _dump(self, fires, counts):
         # Don't include 'modules' in the output. The modules to be run may have
         # been specified on the command line or in the input json. Either way,
         # 'processing' contains a record of what modules were run (though it may
@@ -702,8 +873,8 @@ class FiresManager(object):
         # json or on the command line, and add them to the output if they
         # were in the input
 
-        return dict(self._meta, fires=self.fires, today=self.today,
-            run_id=self.run_id, counts=self.counts, bluesky_version=__version__,
+        return dict(self._meta, fires=fires, today=self.today,
+            run_id=self.run_id, counts=counts, bluesky_version=__version__,
             run_config=Config().get())
 
     def dumps(self, output_stream=None, output_file=None, indent=None):
@@ -714,3 +885,176 @@ class FiresManager(object):
         fire_json = json.dumps(self.dump(), sort_keys=True, cls=FireEncoder,
             indent=indent)
         output_stream.write(fire_json)
+
+    ##
+    ## Streaming (newline-delimited json)
+    ##
+
+    # Only modules that process each fire independently of all others
+    # can be run on fires streamed through one at a time
+    NDJSON_MODULES = [
+        'fuelbeds', 'consumption', 'emissions', 'timeprofile', 'plumerise'
+    ]
+
+    @property
+    def streaming(self):
+        return self._streaming
+
+    def streamed_totals(self, key):
+        """Returns dict in which a module can accumulate run-level totals
+        across the fires streamed through run_ndjson.
+        """
+        return self._streamed_totals.setdefault(key, {})
+
+    def loads_ndjson(self, input_stream=None, input_file=None):
+        """Prepares to stream newline-delimited json fire data.
+
+        The first line may be a run-level record (like regular bsp input,
+        identified by its 'fires' array, which is usually empty).  Every
+        other line is a single fire.  Only the run-level record is loaded
+        here; fires aren't parsed until run_ndjson gets to them.
+        """
+        if input_stream and input_file:
+            raise RuntimeError("Don't specify both input_stream and input_file")
+        if not input_stream:
+            input_stream = self._stream(input_file, 'r')
+
+        records = (json.loads(line) for line in input_stream if line.strip())
+        first = next(records, None)
+        if first is not None and not hasattr(first, 'keys'):
+            raise ValueError("Invalid fire data")
+
+        if first and ('fires' in first or 'fire_information' in first):
+            self.load(first)
+        else:
+            self.load({})
+            if first is not None:
+                records = itertools.chain([first], records)
+
+        self._ndjson_records = records
+
+    def run_ndjson(self, output_stream=None, output_file=None):
+        """Runs modules on one fire at a time, writing each fire out as a
+        line of json before reading in the next one.
+
+        Fires that fail and are skipped are written out as well, with their
+        'error' information.  Only run-level data (summary, processing,
+        runtime, counts, etc.) are kept in memory, and they're written as a
+        final line, with an empty 'fires' array, after the last fire.
+        """
+        invalid_modules = [m for m in self._module_names
+            if m not in self.NDJSON_MODULES]
+        if invalid_modules:
+            raise BlueSkyConfigurationError("Module(s) {} can't be run on "
+                "streamed fire data".format(', '.join(invalid_modules)))
+
+        if output_stream and output_file:
+            raise RuntimeError("Don't specify both output_stream and output_file")
+        if not output_stream:
+            output_stream = self._stream(output_file, 'w')
+
+        # Fires in the run-level record, if any, are streamed through first
+        fires = itertools.chain(self.fires, self._ndjson_records or [])
+        self._ndjson_records = None
+        self._streaming = True
+        self._streamed_totals = {}
+
+        self.log_status('Good', 'Main', 'Start')
+        self.runtime = self.runtime or {"modules": []}
+        self._run_state = {}
+        self.processing = self.processing or []
+        counts = {'fires': 0, 'locations': 0}
+        num_failed_fires = 0
+        failed = False
+
+        # Each module has one processing record and one runtime record,
+        # covering all fires.  Module state is kept across fires (see
+        # run_state), so the stats that a module records when run on a fire
+        # are cumulative, and they're merged into the first fire's record.
+        processing_records = []
+        runtime_records = []
+        runtime_totals = [datetime.timedelta(0)] * len(self._modules)
+
+        logging.summary("Modules to be run: %s", ', '.join(self._module_names))
+
+        with process.RunTimeRecorder(self.runtime):
+            for i, fire in enumerate(fires):
+                self.fires = [fire]
+                for j in range(len(self._modules)):
+                    num_processing = len(self.processing)
+                    if i == 0:
+                        self.processing.append({
+                            "module_name": self._module_names[j]
+                        })
+                        processing_records.append(self.processing[-1])
+                        self.runtime['modules'].append({
+                            "module_name": self._module_names[j]
+                        })
+                        runtime_records.append(self.runtime['modules'][-1])
+                        self.log_status('Good', self._module_names[j], 'Start')
+                        logging.summary("Running module %s",
+                            self._module_names[j])
+
+                    runtime = {}
+                    start = datetime.datetime.utcnow()
+                    try:
+                        with process.RunTimeRecorder(runtime):
+                            self._modules[j].run(self)
+                    except Exception as e:
+                        # stop reading input, but still write out the fire
+                        # that failed and the run-level data, below
+                        failed = True
+                        logging.error(str(e))
+                        tb = traceback.format_exc()
+                        logging.debug(tb)
+                        self.error = {
+                            "module": self._module_names[j],
+                            "message": str(e),
+                            "traceback": str(tb)
+                        }
+                        self.log_status('Failure', self._module_names[j], 'Die')
+                    finally:
+                        runtime_totals[j] += datetime.datetime.utcnow() - start
+                        runtime_records[j].setdefault('start',
+                            runtime.get('start'))
+                        runtime_records[j]['end'] = runtime.get('end')
+                        runtime_records[j]['total'] = str(runtime_totals[j])
+                        if i > 0:
+                            for record in self.processing[num_processing:]:
+                                processing_records[j].update(record)
+                            del self.processing[num_processing:]
+
+                    if failed:
+                        break
+
+                counts['fires'] += self.num_fires
+                counts['locations'] += self.num_locations
+                failed_fires = self.failed_fires or []
+                self.failed_fires = None
+                num_failed_fires += len(failed_fires)
+                for f in self.fires + failed_fires:
+                    output_stream.write(json.dumps(f, sort_keys=True,
+                        cls=FireEncoder) + '\n')
+
+                if failed:
+                    break
+
+        self._finish_run_state()
+        if not failed:
+            for module_name in self._module_names[:len(runtime_records)]:
+                self.log_status('Good', module_name, 'Finish')
+
+        self.fires = []
+        self._meta.pop('failed_fires', None)
+        self._streaming = False
+        if self.skip_failed_fires:
+            counts['failed_fires'] = num_failed_fires
+        logging.summary("Fire counts: %s", counts)
+        output_stream.write(json.dumps(self._dump([], counts),
+            sort_keys=True, cls=FireEncoder) + '\n')
+
+        if failed:
+            self.log_status('Failure', 'Main', 'Die')
+            raise BlueSkyModuleError
+
+        self.log_status('Good', 'Main', 'Finish')
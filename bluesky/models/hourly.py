@@ -0,0 +1,244 @@
+"""bluesky.models.hourly
+
+Internal, array-backed representation of hourly data, such as timeprofile,
+plumerise, and timeprofiled emissions, which are otherwise represented as
+dicts keyed by hourly datetime strings.
+"""
+
+__author__ = "Joel Dubowy"
+
+import datetime
+from collections import OrderedDict, abc
+
+import numpy
+
+from bluesky.datetimeutils import format_hourly_key, parse_hourly_key
+
+__all__ = [
+    'HourlySeries',
+    'get_hour'
+]
+
+ONE_HOUR = datetime.timedelta(hours=1)
+
+
+class HourlySeries(abc.Mapping):
+    """Consecutive hourly data, stored as a start hour plus a dense numpy
+    array per field, with one row per hour.
+
+    Each hour's value is either a dict of the fields' values (if 'data'
+    is a dict of arrays) or a single number (if 'data' is one array).
+    Fields may be two-dimensional, e.g. plumerise 'heights', in which case
+    their hourly values are lists.
+
+    Series are immutable.  Hours are accessed by integer offset, via
+    hour_index, hour, and get_hour.  For compatibility with code (and json encoding) expecting
+    the dict representation, the series also acts as a read-only mapping
+    of hourly datetime strings to hourly values.
+    """
+
+    def __init__(self, start_hour, data):
+        self._start_hour = parse_hourly_key(start_hour)
+        if isinstance(data, abc.Mapping):
+            self._data = OrderedDict((f, self._to_array(v))
+                for f, v in data.items())
+            self._fields = list(self._data.keys())
+        else:
+            self._data = OrderedDict([(None, self._to_array(data))])
+            self._fields = None
+
+        lengths = set(len(a) for a in self._data.values())
+        if len(lengths) > 1:
+            raise ValueError("Hourly series fields must have the same "
+                "number of hours")
+        self._num_hours = lengths.pop() if lengths else 0
+
+    @staticmethod
+    def _to_array(values):
+        # Arrays are copied and made read-only, so that series can be
+        # safely shared (e.g. by active areas with the same time profile)
+        a = numpy.array(values, dtype=float)
+        a.flags.writeable = False
+        return a
+
+    @property
+    def start_hour(self):
+        return self._start_hour
+
+    @property
+    def num_hours(self):
+        return self._num_hours
+
+    @property
+    def fields(self):
+        """Returns the list of field names, or None if each hour's value
+        is a single number
+        """
+        return self._fields
+
+    def array(self, field=None):
+        """Returns the underlying array of the given field's values, or
+        of the values of a series without fields
+        """
+        return self._data[field]
+
+    def hours(self):
+        """Generates the datetime of each hour"""
+        for i in range(self._num_hours):
+            yield self._start_hour + i * ONE_HOUR
+
+    def hour_index(self, dt):
+        """Returns the offset of hour 'dt' from the start of the series,
+        or None if it isn't one of the series' hours
+        """
+        delta = dt - self._start_hour
+        if delta % ONE_HOUR:
+            return None
+        i = delta // ONE_HOUR
+        return i if 0 <= i < self._num_hours else None
+
+    def hour(self, i):
+        """Returns the value of the i'th hour, in the dict representation"""
+        if self._fields is None:
+            return self._data[None][i].tolist()
+        return {f: a[i].tolist() for f, a in self._data.items()}
+
+    def get_hour(self, dt, default=None):
+        i = self.hour_index(dt)
+        return default if i is None else self.hour(i)
+
+    def window(self, start_hour, num_hours, missing_hour):
+        """Returns a new series of num_hours hours, starting at start_hour,
+        using this series' values where defined and 'missing_hour'
+        otherwise.  The new series has missing_hour's fields.
+        """
+        return self._window(self, start_hour, num_hours, missing_hour)
+
+    @classmethod
+    def from_dict(cls, data, start_hour, num_hours, missing_hour):
+        """Returns a series of num_hours hours, starting at start_hour,
+        filled in from hourly data in either the dict representation or
+        an HourlySeries.  Hours that aren't defined, or whose values are
+        empty, are filled in with 'missing_hour'; hours outside of the
+        window are ignored.
+
+        Raises ValueError if the data can't be stored in dense arrays,
+        e.g. if hours have varying numbers of plume heights.
+        """
+        return cls._window(data, parse_hourly_key(start_hour), num_hours,
+            missing_hour)
+
+    @classmethod
+    def constant(cls, start_hour, num_hours, hour_value):
+        """Returns a series of num_hours hours, each with value 'hour_value'
+        """
+        return cls._window({}, parse_hourly_key(start_hour), num_hours,
+            hour_value)
+
+    @classmethod
+    def _window(cls, data, start_hour, num_hours, missing_hour):
+        fields = (list(missing_hour.keys())
+            if isinstance(missing_hour, abc.Mapping) else None)
+        keys = fields or [None]
+        missing = {None: missing_hour} if fields is None else missing_hour
+        arrays = OrderedDict(
+            (f, numpy.tile(numpy.asarray(missing[f], dtype=float),
+                (num_hours,) + (1,) * numpy.ndim(missing[f])))
+            for f in keys)
+
+        if isinstance(data, HourlySeries):
+            if ((data._fields is None) != (fields is None) or
+                    (fields and not set(fields).issubset(data._fields))):
+                raise ValueError("Hourly series doesn't have the required "
+                    "fields")
+            start = (data._start_hour - start_hour) / ONE_HOUR
+            if start == int(start):
+                # copy the overlapping hours
+                start = int(start)
+                b, e = max(start, 0), min(start + data._num_hours, num_hours)
+                if b < e:
+                    for f in keys:
+                        cls._set_rows(arrays[f], slice(b, e),
+                            data._data[f][b - start:e - start])
+
+        else:
+            for k, v in data.items():
+                if not v:
+                    continue
+                i = (parse_hourly_key(k) - start_hour) / ONE_HOUR
+                if i == int(i) and 0 <= i < num_hours:
+                    for f in keys:
+                        cls._set_rows(arrays[f], int(i),
+                            v if f is None else v[f])
+
+        return cls(start_hour, arrays[None] if fields is None else arrays)
+
+    @staticmethod
+    def _set_rows(array, rows, values):
+        values = numpy.asarray(values, dtype=float)
+        if values.shape != array[rows].shape:
+            raise ValueError("Hourly values can't be stored in dense arrays")
+        array[rows] = values
+
+    def is_aligned_with(self, other):
+        """Returns True if 'other' is an HourlySeries with the same hours
+        and fields
+        """
+        return (isinstance(other, HourlySeries)
+            and other._start_hour == self._start_hour
+            and other._num_hours == self._num_hours
+            and other._fields == self._fields)
+
+    def __add__(self, other):
+        if not self.is_aligned_with(other):
+            return NotImplemented
+        return HourlySeries(self._start_hour, self._unwrap(OrderedDict(
+            (f, a + other._data[f]) for f, a in self._data.items())))
+
+    def splice(self, other, dt):
+        """Returns a new series with this series' values for hours before
+        'dt' and aligned series 'other's values for hours on or after
+        """
+        if not self.is_aligned_with(other):
+            raise ValueError("Hourly series aren't aligned")
+        i = -((self._start_hour - dt) // ONE_HOUR)  # ceiling
+        i = min(max(i, 0), self._num_hours)
+        return HourlySeries(self._start_hour, self._unwrap(OrderedDict(
+            (f, numpy.concatenate((a[:i], other._data[f][i:])))
+                for f, a in self._data.items())))
+
+    def _unwrap(self, data):
+        return data[None] if self._fields is None else data
+
+    def to_dict(self):
+        return OrderedDict(self.items())
+
+    ## Mapping interface
+
+    def __getitem__(self, key):
+        try:
+            i = self.hour_index(parse_hourly_key(key))
+        except Exception:
+            raise KeyError(key)
+        if i is None:
+            raise KeyError(key)
+        return self.hour(i)
+
+    def __iter__(self):
+        for dt in self.hours():
+            yield format_hourly_key(dt)
+
+    def __len__(self):
+        return self._num_hours
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def get_hour(hourly_data, dt):
+    """Returns the value of hour 'dt', or None if not defined, from either
+    an HourlySeries or hourly data in the dict representation
+    """
+    if isinstance(hourly_data, HourlySeries):
+        return hourly_data.get_hour(dt)
+    return hourly_data.get(format_hourly_key(dt))
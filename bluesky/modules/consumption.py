@@ -4,13 +4,14 @@ __author__ = "Joel Dubowy"
 
 import itertools
 import logging
+from collections import OrderedDict
 
 import consume
 
 from bluesky.config import Config
 from bluesky import datautils, datetimeutils
 from bluesky.consumeutils import (
-    _apply_settings, FuelLoadingsManager, CONSUME_VERSION_STR
+    _get_settings, _apply_settings, FuelLoadingsManager, CONSUME_VERSION_STR
 )
 from bluesky import exceptions
 from bluesky.locationutils import LatLng
@@ -39,33 +40,30 @@ def run(fires_manager):
     # TODO: get msg_level and burn_type from fires_manager's config
     msg_level = 2  # 1 => fewest messages; 3 => most messages
 
-    all_fuel_loadings = Config().get('consumption', 'fuel_loadings')
-    fuel_loadings_manager = FuelLoadingsManager(all_fuel_loadings=all_fuel_loadings)
-
     _validate_input(fires_manager)
 
-    # TODO: can I safely instantiate one FuelConsumption object and
-    # use it across all fires, or at lesat accross all fuelbeds within
-    # a single fire?
-    for fire in fires_manager.fires:
-        with fires_manager.fire_failure_handler(fire):
-            _run_fire(fire, fuel_loadings_manager, msg_level)
+    with fires_manager.run_state(__name__,
+            _create_fuel_loadings_manager) as fuel_loadings_manager:
+        if Config().get('consumption', 'batch_fuelbeds'):
+            _run_batched(fires_manager, fuel_loadings_manager, msg_level)
+        else:
+            fires_manager.run_per_fire(_run_fire, fuel_loadings_manager,
+                msg_level)
 
-    datautils.summarize_all_levels(fires_manager, 'consumption')
-    datautils.summarize_all_levels(fires_manager, 'heat')
+    datautils.summarize_all_levels(fires_manager, 'consumption', 'heat')
 
-def _run_fire(fire, fuel_loadings_manager, msg_level):
-    logging.debug("Consume consumption - fire {}".format(fire.id))
+def _create_fuel_loadings_manager():
+    all_fuel_loadings = Config().get('consumption', 'fuel_loadings')
+    return FuelLoadingsManager(all_fuel_loadings=all_fuel_loadings)
 
+def _get_burn_type(fire):
     # TODO: set burn type to 'activity' if fire.fuel_type == 'piles' ?
     if fire.fuel_type == 'piles':
         raise ValueError("Consume can't be used for fuel type 'piles'")
-    burn_type = fire.fuel_type
+    return fire.fuel_type
 
-    # TODO: can I run consume on all fuelbeds at once and get per-fuelbed
-    # results?  If it is simply a matter of parsing separated values from
-    # the results, make sure that running all at once produces any performance
-    # gain; if it doesn't,then it might not be worth the trouble
+def _iterate_fuelbeds(fire):
+    """Yields (fuelbed, location, season) for each of the fire's fuelbeds"""
     for ac in fire['activity']:
         for aa in ac.active_areas:
             if not aa.get('start'):
@@ -75,8 +73,15 @@ def _run_fire(fire, fuel_loadings_manager, msg_level):
             season = datetimeutils.season_from_date(aa.get('start'))
             for loc in aa.locations:
                 for fb in loc['fuelbeds']:
-                    _run_fuelbed(fb, loc, fuel_loadings_manager, season,
-                        burn_type, msg_level)
+                    yield fb, loc, season
+
+def _run_fire(fire, fuel_loadings_manager, msg_level):
+    logging.debug("Consume consumption - fire {}".format(fire.id))
+
+    burn_type = _get_burn_type(fire)
+    for fb, loc, season in _iterate_fuelbeds(fire):
+        _run_fuelbed(fb, loc, fuel_loadings_manager, season,
+            burn_type, msg_level)
 
 def _run_fuelbed(fb, location, fuel_loadings_manager, season,
         burn_type, msg_level):
@@ -132,6 +137,120 @@ def _run_fuelbed(fb, location, fuel_loadings_manager, season,
         raise RuntimeError("Failed to calculate consumption for "
             "fuelbed {}".format(fb['fccs_id']))
 
+##
+## Batched consumption
+##
+
+def _run_batched(fires_manager, fuel_loadings_manager, msg_level):
+    """Runs consume once for each group of fuelbeds, across all fires, that
+    share burn type, fuel loadings, and consume settings, and then scatters
+    the per-fuelbed results back onto the fuelbeds.
+
+    If a batched run fails, or if consume's results can't be split into
+    per-fuelbed values, each of the batch's fuelbeds is run individually,
+    so that errors are attributed to the right fires.
+    """
+    batches = OrderedDict()
+    for fire in fires_manager.fires:
+        with fires_manager.fire_failure_handler(fire):
+            logging.debug("Consume consumption - fire {}".format(fire.id))
+            burn_type = _get_burn_type(fire)
+            fire_entries = []
+            for fb, loc, season in _iterate_fuelbeds(fire):
+                settings = _get_settings(loc, burn_type)
+                key = (burn_type,
+                    fuel_loadings_manager.generate_custom_csv(fb['fccs_id']),
+                    repr(sorted(settings.items())))
+                fire_entries.append((key, (fire, fb, loc, season, settings)))
+
+            # only add the fire's fuelbeds once they've all been validated
+            for key, entry in fire_entries:
+                batches.setdefault(key, []).append(entry)
+
+    failed_fire_ids = set()
+    for (burn_type, fccs_file, settings_key), entries in batches.items():
+        entries = [e for e in entries if id(e[0]) not in failed_fire_ids]
+        if not entries:
+            continue
+
+        logging.debug("Consume consumption - batch of %s %s fuelbeds",
+            len(entries), burn_type)
+        try:
+            _run_fuelbed_batch(entries, fuel_loadings_manager, fccs_file,
+                burn_type)
+            continue
+        except Exception as e:
+            logging.debug("Batched consumption failed (%s); running "
+                "%s fuelbeds individually", e, len(entries))
+
+        for fire, fb, loc, season, settings in entries:
+            if id(fire) in failed_fire_ids:
+                continue
+            with fires_manager.fire_failure_handler(fire):
+                try:
+                    _run_fuelbed(fb, loc, fuel_loadings_manager, season,
+                        burn_type, msg_level)
+                except:
+                    failed_fire_ids.add(id(fire))
+                    raise
+
+def _run_fuelbed_batch(entries, fuel_loadings_manager, fccs_file, burn_type):
+    fc = consume.FuelConsumption(fccs_file=fccs_file)
+
+    # See notes in _run_fuelbed about setting area to 1
+    fc.burn_type = burn_type
+    fc.fuelbed_fccs_ids = [e[1]['fccs_id'] for e in entries]
+    fc.season = [e[3] for e in entries]
+    fc.fuelbed_area_acres = [1] * len(entries)
+    fc.fuelbed_ecoregion = [e[2]['ecoregion'] for e in entries]
+
+    # All entries in the batch have the same settings
+    for field, value in entries[0][4].items():
+        setattr(fc, field, value)
+
+    _results = fc.results()
+    if not _results:
+        raise RuntimeError("Failed to calculate consumption for batch "
+            "of {} fuelbeds".format(len(entries)))
+
+    consumption = _results['consumption']
+    consumption.pop('debug', None)
+    heat = _results['heat release']
+
+    # Split everything before modifying any fuelbeds, so that a
+    # failure leaves the batch untouched for individual runs
+    num_fuelbeds = len(entries)
+    per_fuelbed = [
+        (_get_fuelbed_results(consumption, i, num_fuelbeds),
+            _get_fuelbed_results(heat, i, num_fuelbeds))
+        for i in range(num_fuelbeds)
+    ]
+
+    for (fire, fb, loc, season, settings), (fb_consumption, fb_heat) in zip(
+            entries, per_fuelbed):
+        fb['fuel_loadings'] = fuel_loadings_manager.get_fuel_loadings(
+            fb['fccs_id'], fc.FCCS)
+        fb['consumption'] = fb_consumption
+        fb['heat'] = fb_heat
+        if fc.output_units == 'tons_ac':
+            area = (fb['pct'] / 100.0) * loc['area']
+            datautils.multiply_nested_data(fb["consumption"], area)
+            datautils.multiply_nested_data(fb["heat"], area)
+
+def _get_fuelbed_results(results, i, num_fuelbeds):
+    """Returns the i'th fuelbed's values from consume's nested results,
+    keeping each leaf as a length-1 array, as in a single fuelbed run.
+    """
+    if isinstance(results, dict):
+        return {k: _get_fuelbed_results(v, i, num_fuelbeds)
+            for k, v in results.items()}
+
+    if len(results) != num_fuelbeds:
+        raise ValueError("Expected {} consumption values; got {}".format(
+            num_fuelbeds, len(results)))
+    # copy, since slices of numpy arrays are views into the batch's arrays
+    return results[i:i+1].copy()
+
 VALIDATION_ERROR_MSGS = {
     'NO_ACTIVITY': "Fire missing activity data required for computing consumption",
     'NO_LOCATIONS': "Active area missing location data required for computing consumption",
@@ -140,13 +259,15 @@ VALIDATION_ERROR_MSGS = {
 }
 
 def _validate_input(fires_manager):
-    ecoregion_lookup = None # instantiate only if necessary
+    # locations lacking ecoregion, by fire, to be looked up all at once
+    ecoregion_lookups = []
     for fire in fires_manager.fires:
         with fires_manager.fire_failure_handler(fire):
             active_areas = fire.active_areas
             if not active_areas:
                 raise ValueError(VALIDATION_ERROR_MSGS['NO_ACTIVITY'])
 
+            fire_lookups = []
             for aa in active_areas:
                 locations = aa.locations
                 if not locations:
@@ -160,37 +281,75 @@ def _validate_input(fires_manager):
                     if not loc.get('area'):
                         raise ValueError(VALIDATION_ERROR_MSGS["AREA_UNDEFINED"])
 
-
                     if not loc.get('ecoregion'):
-                        # import EcoregionLookup here so that, if fires do have
-                        # ecoregion defined, consumption can be run without mapscript
-                        # and other dependencies installed
-                        try:
-                            latlng = LatLng(loc)
-                            if not ecoregion_lookup:
-                                from bluesky.ecoregion.lookup import EcoregionLookup
-                                implemenation = Config().get('consumption',
-                                    'ecoregion_lookup_implemenation')
-                                ecoregion_lookup = EcoregionLookup(implemenation)
-                            loc['ecoregion'] = ecoregion_lookup.lookup(
-                                latlng.latitude, latlng.longitude)
-                            if not loc['ecoregion']:
-                                logging.warning("Failed to look up ecoregion for "
-                                    "{}, {}".format(latlng.latitude, latlng.longitude))
-                                _use_default_ecoregion(fires_manager, loc)
-
-                        except exceptions.MissingDependencyError as e:
-                            _use_default_ecoregion(fires_manager, loc, e)
+                        latlng = LatLng(loc)
+                        fire_lookups.append(
+                            (loc, latlng.latitude, latlng.longitude))
 
                     for fb in loc['fuelbeds'] :
                         if not fb.get('fccs_id') or not fb.get('pct'):
                             raise ValueError("Each fuelbed must define 'fccs_id' and 'pct'")
 
+            if fire_lookups:
+                ecoregion_lookups.append((fire, fire_lookups))
+
+    if ecoregion_lookups:
+        _look_up_ecoregions(fires_manager, ecoregion_lookups)
+
+def _look_up_ecoregions(fires_manager, ecoregion_lookups):
+    """Looks up ecoregions of all locations lacking them in one batch
+
+    Args:
+     - fires_manager -- bluesky.models.fires.FiresManager object
+     - ecoregion_lookups -- list of (fire, [(location, lat, lng), ...]) tuples
+    """
+    try:
+        # import EcoregionLookup here so that, if fires do have
+        # ecoregion defined, consumption can be run without mapscript
+        # and other dependencies installed
+        from bluesky.ecoregion.lookup import EcoregionLookup
+        implemenation = Config().get('consumption',
+            'ecoregion_lookup_implemenation')
+        ecoregion_lookup = EcoregionLookup(implemenation)
+
+        all_lookups = [l for fire, fire_lookups in ecoregion_lookups
+            for l in fire_lookups]
+        try:
+            ecoregions = ecoregion_lookup.lookup_many(
+                [l[1] for l in all_lookups], [l[2] for l in all_lookups])
+        except exceptions.BlueSkyGeographyValueError:
+            # Some location is invalid; look up ecoregions fire by
+            # fire so that only the fires with invalid locations fail
+            ecoregions = None
+
+    except exceptions.MissingDependencyError as e:
+        for fire, fire_lookups in ecoregion_lookups:
+            with fires_manager.fire_failure_handler(fire):
+                for loc, lat, lng in fire_lookups:
+                    _use_default_ecoregion(fires_manager, loc, e)
+        return
+
+    i = 0
+    for fire, fire_lookups in ecoregion_lookups:
+        with fires_manager.fire_failure_handler(fire):
+            if ecoregions is None:
+                fire_ecoregions = ecoregion_lookup.lookup_many(
+                    [l[1] for l in fire_lookups], [l[2] for l in fire_lookups])
+            else:
+                fire_ecoregions = ecoregions[i:i+len(fire_lookups)]
+            for (loc, lat, lng), ecoregion in zip(fire_lookups, fire_ecoregions):
+                loc['ecoregion'] = ecoregion
+                if not loc['ecoregion']:
+                    logging.warning("Failed to look up ecoregion for "
+                        "{}, {}".format(lat, lng))
+                    _use_default_ecoregion(fires_manager, loc)
+        i += len(fire_lookups)
+
 def _use_default_ecoregion(fires_manager, loc, exc=None):
     default_ecoregion = Config().get('consumption', 'default_ecoregion')
     if default_ecoregion:
         logging.debug('Using default ecoregion %s', default_ecoregion)
-        loc['location']['ecoregion'] = default_ecoregion
+        loc['ecoregion'] = default_ecoregion
     else:
         logging.debug('No default ecoregion')
         if exc:
@@ -3,7 +3,9 @@
 __author__ = "Joel Dubowy"
 
 import abc
+import collections
 import copy
+import functools
 import itertools
 import logging
 import sys
@@ -15,6 +17,7 @@ from eflookup.fccs2ef.lookup import Fccs2Ef
 from eflookup.fepsef import FepsEFLookup
 
 import consume
+import numpy
 
 from bluesky import datautils, datetimeutils
 from bluesky.config import Config
@@ -40,6 +43,10 @@ def run(fires_manager):
 
     Config options:
      - emissions > model -- emissions model to use
+     - emissions > engine -- 'python' (default) to run each fuelbed through
+        its emissions calculator, or 'numpy' to compute all fuelbeds' emissions
+        at once with emission factors extracted from the calculators;
+        'numpy' is supported only for 'feps' and 'prichard-oneill'
      - emissions > species -- whitelist of species to compute emissions for
      - emissions > include_emissions_details -- whether or not to include
         emissions per fuel category per phase, as opposed to just per phase
@@ -51,21 +58,36 @@ def run(fires_manager):
 
     include_emissions_details = Config().get(
         'emissions', 'include_emissions_details')
-    fires_manager.processed(__name__, __version__, model=model,
-        emitcalc_version=emitcalc_version, eflookup_version=eflookup_version,
-        consume_version=CONSUME_VERSION_STR)
+    engine = Config().get('emissions', 'engine')
+    processed_kwargs = dict(model=model, engine=engine,
+        emitcalc_version=emitcalc_version,
+        eflookup_version=eflookup_version, consume_version=CONSUME_VERSION_STR)
 
+    e = None
     try:
-        klass_name = ''.join([e.capitalize() for e in model.split('-')])
-        klass = getattr(sys.modules[__name__], klass_name)
-        e = klass(fires_manager.fire_failure_handler)
-    except AttributeError:
-        msg = "Invalid emissions model: '{}'.".format(model)
-        if model == 'urbanski':
-            msg += " The urbanski model has be replaced by prichard-oneill"
-        raise BlueSkyConfigurationError(msg)
-
-    e.run(fires_manager.fires)
+        # The model object, and its calculator cache, are kept for the
+        # whole run, even if fires are streamed through one at a time
+        with fires_manager.run_state(__name__,
+                lambda: _create_model(fires_manager, model)) as e:
+            logging.info(e.RUN_MSG)
+            if engine == 'numpy':
+                if not isinstance(e, EmissionsCalculatorBase):
+                    raise BlueSkyConfigurationError("The numpy emissions "
+                        "engine isn't supported for model '{}'".format(model))
+                e.run_vectorized(fires_manager)
+            elif engine == 'python':
+                # Equivalent to e.run(fires_manager.fires), but possibly
+                # in parallel
+                fires_manager.run_per_fire(e._run_on_fire)
+            else:
+                raise BlueSkyConfigurationError(
+                    "Invalid emissions engine: '{}'.".format(engine))
+
+    finally:
+        cache_info = e and e.calculator_cache_info()
+        if cache_info:
+            processed_kwargs.update(calculator_cache=cache_info)
+        fires_manager.processed(__name__, __version__, **processed_kwargs)
 
     # fix keys
     for fire in fires_manager.fires:
@@ -82,6 +104,17 @@ def run(fires_manager):
         datautils.summarize_over_all_fires(fires_manager, 'emissions_details')
 
 
+def _create_model(fires_manager, model):
+    try:
+        klass_name = ''.join([e.capitalize() for e in model.split('-')])
+        klass = getattr(sys.modules[__name__], klass_name)
+    except AttributeError:
+        msg = "Invalid emissions model: '{}'.".format(model)
+        if model == 'urbanski':
+            msg += " The urbanski model has be replaced by prichard-oneill"
+        raise BlueSkyConfigurationError(msg)
+    return klass(fires_manager.fire_failure_handler)
+
 def _fix_keys(emissions):
     for k in emissions:
         # in case someone spcifies custom EF's with 'PM25'
@@ -106,107 +139,259 @@ class EmissionsBase(object, metaclass=abc.ABCMeta):
             'emissions', 'include_emissions_details')
         self.species = Config().get('emissions', 'species')
 
-    @abc.abstractmethod
     def run(self, fires):
+        logging.info(self.RUN_MSG)
+        for fire in fires:
+            with self.fire_failure_handler(fire):
+                self._run_on_fire(fire)
+
+    @abc.abstractmethod
+    def _run_on_fire(self, fire):
         pass
 
+    def calculator_cache_info(self):
+        """Returns calculator cache hit and miss counts, for models that
+        cache calculators
+        """
+        return None
+
+    def __getstate__(self):
+        # The fire failure handler is bound to the fires manager, and isn't
+        # needed when running in worker processes
+        state = dict(self.__dict__)
+        state.pop('fire_failure_handler', None)
+        return state
+
 
 ##
-## FEPS
+## emitcalc based models
 ##
 
-class Feps(EmissionsBase):
-
-    def __init__(self, fire_failure_handler):
-        super(Feps, self).__init__(fire_failure_handler)
+class EmissionsCalculatorBase(EmissionsBase):
+    """Base class for models that compute emissions with emitcalc's
+    EmissionsCalculator
+    """
 
-        # The same lookup object is used for both Rx and WF
-        self.calculator = EmissionsCalculator(FepsEFLookup(),
-            species=self.species)
+    # Factor by which to multiply the calculators' output, if any
+    EMISSIONS_CONVERSION_FACTOR = None
 
-    def run(self, fires):
-        logging.info("Running emissions module FEPS EFs")
+    def __init__(self, fire_failure_handler):
+        super(EmissionsCalculatorBase, self).__init__(fire_failure_handler)
+        # emission factors, extracted from calculators, for the
+        # vectorized engine
+        self._emission_factors = {}
 
-        for fire in fires:
-            with self.fire_failure_handler(fire):
-                self._run_on_fire(fire)
+    @abc.abstractmethod
+    def _get_calculator_key(self, fire, fb):
+        pass
 
-    CONVERSION_FACTOR = 0.0005 # 1.0 ton / 2000.0 lbs
+    @abc.abstractmethod
+    def _get_calculator(self, key):
+        pass
 
-    def _run_on_fire(self, fire):
+    def _get_fuelbeds(self, fire):
         if 'activity' not in fire:
             raise ValueError(
                 "Missing activity data required for computing emissions")
         for aa in fire.active_areas:
             for loc in aa.locations:
                 if 'fuelbeds' not in loc:
-                   raise ValueError(
+                    raise ValueError(
                         "Missing fuelbed data required for computing emissions")
                 for fb in loc['fuelbeds']:
                     if 'consumption' not in fb:
                         raise ValueError(
                             "Missing consumption data required for computing emissions")
-                    _calculate(self.calculator, fb, self.include_emissions_details)
-                    # TODO: Figure out if we should indeed convert from lbs to tons;
-                    #   if so, uncomment the following
-                    # Note: According to BSF, FEPS emissions are in lbs/ton consumed.  Since
-                    # consumption is in tons, and since we want emissions in tons, we need
-                    # to divide each value by 2000.0
-                    # datautils.multiply_nested_data(fb['emissions'], self.CONVERSION_FACTOR)
-                    # if self.include_emissions_details:
-                    #     datautils.multiply_nested_data(fb['emissions_details'], self.CONVERSION_FACTOR)
+                    yield fb
+
+    def _run_on_fire(self, fire):
+        for fb in self._get_fuelbeds(fire):
+            self._calculate_fuelbed(fire, fb)
+
+    def _calculate_fuelbed(self, fire, fb):
+        calculator = self._get_calculator(self._get_calculator_key(fire, fb))
+        _calculate(calculator, fb, self.include_emissions_details)
+        if self.EMISSIONS_CONVERSION_FACTOR is not None:
+            datautils.multiply_nested_data(fb['emissions'],
+                self.EMISSIONS_CONVERSION_FACTOR)
+            if self.include_emissions_details:
+                datautils.multiply_nested_data(fb['emissions_details'],
+                    self.EMISSIONS_CONVERSION_FACTOR)
+
+    ## Vectorized engine
+
+    def run_vectorized(self, fires_manager):
+        """Computes emissions for all fuelbeds of all fires with numpy,
+        using emission factors extracted from the calculators.
+
+        Fuelbeds are grouped by consumption data structure and emitted
+        species, and each group's consumption is packed into a
+        (fuelbeds x fuel categories x phases) array, which is multiplied
+        against the (calculators x fuel categories x phases x species)
+        emission factors array.  Fuelbeds whose emission factors can't be
+        extracted are computed with their calculators, as in _run_on_fire.
+        """
+        entries = []
+        for fire in fires_manager.fires:
+            with fires_manager.fire_failure_handler(fire):
+                fire_entries = []
+                for fb in self._get_fuelbeds(fire):
+                    key = self._get_calculator_key(fire, fb)
+                    efs = self._get_emission_factors(key, fb['consumption'])
+                    fire_entries.append((fire, fb, efs))
+                entries.extend(fire_entries)
+
+        groups = collections.OrderedDict()
+        failed_fire_ids = set()
+        for fire, fb, efs in entries:
+            if efs:
+                groups.setdefault(efs.group_key, []).append((fire, fb, efs))
+            elif id(fire) not in failed_fire_ids:
+                with fires_manager.fire_failure_handler(fire):
+                    try:
+                        self._calculate_fuelbed(fire, fb)
+                    except:
+                        failed_fire_ids.add(id(fire))
+                        raise
+
+        for group in groups.values():
+            group = [e for e in group if id(e[0]) not in failed_fire_ids]
+            if group:
+                self._calculate_group(group)
+
+    def _get_emission_factors(self, key, consumption):
+        signature = _get_consumption_signature(consumption)
+        if signature is None:
+            return None
+
+        if (key, signature) not in self._emission_factors:
+            self._emission_factors[(key, signature)] = _EmissionFactors.extract(
+                self._get_calculator(key), signature,
+                self.EMISSIONS_CONVERSION_FACTOR)
+        return self._emission_factors[(key, signature)]
+
+    def _calculate_group(self, group):
+        efs = group[0][2]
+        # Stack each distinct calculator's emission factors, and index
+        # into them by fuelbed
+        ef_indices = {}
+        for fire, fb, fb_efs in group:
+            ef_indices.setdefault(id(fb_efs), (len(ef_indices), fb_efs))
+        ef_tensor = numpy.array([e.factors for i, e in sorted(
+            ef_indices.values(), key=lambda e: e[0])])
+        fb_ef_indices = numpy.array([ef_indices[id(e[2])][0] for e in group])
+
+        # (fuelbeds x fuel categories x phases)
+        consumption = numpy.array([
+            [[fb['consumption'][c][sc][p][0] for p in efs.phases]
+                for c, sc in efs.categories]
+            for fire, fb, fb_efs in group
+        ], dtype=float)
+
+        # (fuelbeds x fuel categories x phases x species)
+        emissions = consumption[..., numpy.newaxis] * ef_tensor[fb_ef_indices]
+        for (fire, fb, fb_efs), fb_emissions in zip(group,
+                efs.build_emissions(emissions, self.include_emissions_details)):
+            fb.update(fb_emissions)
+
 
 ##
-## Prichard / O'Neill
+## FEPS
 ##
 
+class Feps(EmissionsCalculatorBase):
 
-class PrichardOneill(EmissionsBase):
+    RUN_MSG = "Running emissions module FEPS EFs"
 
     def __init__(self, fire_failure_handler):
-        super(PrichardOneill, self).__init__(fire_failure_handler)
+        super(Feps, self).__init__(fire_failure_handler)
 
-    def run(self, fires):
-        logging.info("Running emissions module with Prichard / O'Neill EFs")
+        # The same lookup object is used for both Rx and WF
+        self.calculator = EmissionsCalculator(FepsEFLookup(),
+            species=self.species)
+
+    CONVERSION_FACTOR = 0.0005 # 1.0 ton / 2000.0 lbs
+
+    # TODO: Figure out if we should indeed convert from lbs to tons;
+    #   if so, set EMISSIONS_CONVERSION_FACTOR = CONVERSION_FACTOR
+    # Note: According to BSF, FEPS emissions are in lbs/ton consumed.  Since
+    # consumption is in tons, and since we want emissions in tons, we need
+    # to divide each value by 2000.0
+
+    def _get_calculator_key(self, fire, fb):
+        return None
+
+    def _get_calculator(self, key):
+        return self.calculator
+
+##
+## Prichard / O'Neill
+##
 
-        # Instantiate two lookup object, one Rx and one WF, to be reused
-        for fire in fires:
-            with self.fire_failure_handler(fire):
-                self._run_on_fire(fire)
+
+class PrichardOneill(EmissionsCalculatorBase):
+
+    RUN_MSG = "Running emissions module with Prichard / O'Neill EFs"
+
+    def __init__(self, fire_failure_handler):
+        super(PrichardOneill, self).__init__(fire_failure_handler)
+        self._set_calculator_cache()
+
+    def _set_calculator_cache(self):
+        # There are usually far fewer distinct fccs ids than fuelbeds, so
+        # calculators are cached and shared across fuelbeds and fires
+        self._cached_calculator = functools.lru_cache(
+            maxsize=Config().get('emissions', 'calculator_cache_size'))(
+            _create_prichard_oneill_calculator)
+
+    def calculator_cache_info(self):
+        info = self._cached_calculator.cache_info()
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize
+        }
+
+    def __getstate__(self):
+        # The cache's function wrapper can't be pickled; worker processes
+        # start with their own empty caches
+        state = super(PrichardOneill, self).__getstate__()
+        state.pop('_cached_calculator', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._set_calculator_cache()
 
     # Consumption values are in tons, Prichard/ONeill EFS are in g/kg, and
     # we want emissions values in tons.  Since 1 g/kg == 2 lbs/ton, we need
     # to multiple the emissions output by:
     #   (2 lbs/ton) * (1 ton / 2000lbs) = 1/1000 = 0.001
+    # TODO: Update EFs to be tons/ton in a) eflookup package,
+    #   b) just after instantiating look-up objects, above,
+    #   or c) just before calling EmissionsCalculator, above
     CONVERSION_FACTOR = 0.001
+    EMISSIONS_CONVERSION_FACTOR = CONVERSION_FACTOR
 
-    def _run_on_fire(self, fire):
-        if 'activity' not in fire:
-            raise ValueError(
-                "Missing activity data required for computing emissions")
+    def _get_fuelbeds(self, fire):
+        for fb in super(PrichardOneill, self)._get_fuelbeds(fire):
+            if 'fccs_id' not in fb:
+                raise ValueError(
+                    "Missing FCCS Id required for computing emissions")
+            yield fb
 
-        for aa in fire.active_areas:
-            for loc in aa.locations:
-                if 'fuelbeds' not in loc:
-                    raise ValueError(
-                        "Missing fuelbed data required for computing emissions")
-                for fb in loc['fuelbeds']:
-                    if 'consumption' not in fb:
-                        raise ValueError(
-                            "Missing consumption data required for computing emissions")
-                    if 'fccs_id' not in fb:
-                        raise ValueError(
-                            "Missing FCCS Id required for computing emissions")
-                    fccs2ef = Fccs2Ef(fb["fccs_id"], is_rx=(fire["type"]=="rx"))
-                    calculator = EmissionsCalculator(fccs2ef, species=self.species)
-                    _calculate(calculator, fb, self.include_emissions_details)
-                    # Convert from lbs to tons
-                    # TODO: Update EFs to be tons/ton in a) eflookup package,
-                    #   b) just after instantiating look-up objects, above,
-                    #   or c) just before calling EmissionsCalculator, above
-                    datautils.multiply_nested_data(fb['emissions'], self.CONVERSION_FACTOR)
-                    if self.include_emissions_details:
-                        datautils.multiply_nested_data(fb['emissions_details'], self.CONVERSION_FACTOR)
+    def _get_calculator_key(self, fire, fb):
+        # species must be hashable to be part of the calculator cache key
+        species = tuple(self.species) if self.species is not None else None
+        return (fb["fccs_id"], fire["type"] == "rx", species)
+
+    def _get_calculator(self, key):
+        return self._cached_calculator(*key)
+
+def _create_prichard_oneill_calculator(fccs_id, is_rx, species):
+    return EmissionsCalculator(Fccs2Ef(fccs_id, is_rx=is_rx),
+        species=list(species) if species is not None else None)
 
 ##
 ## CONSUME
@@ -214,6 +399,8 @@ class PrichardOneill(EmissionsBase):
 
 class Consume(EmissionsBase):
 
+    RUN_MSG = "Running emissions module with CONSUME"
+
     def __init__(self, fire_failure_handler):
         super(Consume, self).__init__(fire_failure_handler)
 
@@ -224,17 +411,6 @@ class Consume(EmissionsBase):
         self.fuel_loadings_manager = FuelLoadingsManager(
             all_fuel_loadings=all_fuel_loadings)
 
-
-    def run(self, fires):
-        logging.info("Running emissions module with CONSUME")
-
-        # look for custom fuel loadings first in the emissions config and then
-        # in the consumption config
-
-        for fire in fires:
-            with self.fire_failure_handler(fire):
-                self._run_on_fire(fire)
-
     def _run_on_fire(self, fire):
         logging.debug("Consume emissions - fire {}".format(fire.get("id")))
 
@@ -338,3 +514,204 @@ def _calculate(calculator, fb, include_emissions_details):
     fb['emissions'] = copy.deepcopy(emissions_details['summary']['total'])
     if include_emissions_details:
         fb['emissions_details'] = emissions_details
+
+
+##
+## Vectorized engine helpers
+##
+
+def _get_consumption_signature(consumption):
+    """Returns a hashable description of the structure of a fuelbed's
+    consumption data - i.e. the fuel categories, sub-categories, and
+    phases - or None if it can't be handled by the vectorized engine.
+    """
+    categories = []
+    phases = None
+    summary_keys = ()
+    for c in sorted(consumption):
+        if not isinstance(consumption[c], dict):
+            return None
+        if c == 'summary':
+            summary_keys = tuple(sorted(consumption[c]))
+            continue
+
+        for sc in sorted(consumption[c]):
+            values = consumption[c][sc]
+            if not isinstance(values, dict):
+                return None
+            sc_phases = tuple(sorted(values))
+            if phases is not None and sc_phases != phases:
+                return None
+            if any(not hasattr(v, '__len__') or len(v) != 1
+                    for v in values.values()):
+                return None
+            phases = sc_phases
+            categories.append((c, sc))
+
+    if not categories:
+        return None
+    return (tuple(categories), phases, summary_keys)
+
+def _build_consumption(signature, values):
+    """Builds consumption data with the given structure and values, a
+    (fuel categories x phases) array, filling in consistent 'total' and
+    'summary' values
+    """
+    categories, input_phases, summary_keys = signature
+    phases = [p for p in input_phases if p != 'total']
+
+    def _values(v):
+        d = {p: [float(pv)] for p, pv in zip(phases, v)}
+        if 'total' in input_phases:
+            d['total'] = [float(sum(v))]
+        return d
+
+    consumption = {}
+    for (c, sc), v in zip(categories, values):
+        consumption.setdefault(c, {})[sc] = _values(v)
+
+    if summary_keys:
+        consumption['summary'] = {}
+        for k in summary_keys:
+            idx = [i for i, (c, sc) in enumerate(categories)
+                if k == 'total' or c == k]
+            consumption['summary'][k] = _values(values[idx].sum(axis=0)
+                if idx else numpy.zeros(len(phases)))
+
+    return consumption
+
+def _nested_allclose(a, b):
+    if isinstance(a, dict) or isinstance(b, dict):
+        return (isinstance(a, dict) and isinstance(b, dict)
+            and set(a) == set(b)
+            and all(_nested_allclose(a[k], b[k]) for k in a))
+    try:
+        return (numpy.shape(a) == numpy.shape(b)
+            and numpy.allclose(a, b, rtol=1e-9, atol=0))
+    except (TypeError, ValueError):
+        return False
+
+class _EmissionFactors(object):
+    """Emission factors, extracted from an emitcalc EmissionsCalculator, for
+    consumption data of a particular structure, along with the logic to
+    reproduce the calculator's nested output from an array of emissions.
+    """
+
+    def __init__(self, signature, factors, species, output_total):
+        self.categories = signature[0]
+        self.phases = tuple(p for p in signature[1] if p != 'total')
+        # (fuel categories x phases x species)
+        self.factors = factors
+        self.species = species
+        self.output_total = output_total
+        # Fuelbeds whose emission factors have the same group key can be
+        # processed together
+        self.group_key = (signature, species, output_total)
+
+        category_names = []
+        for c, sc in self.categories:
+            if c not in category_names:
+                category_names.append(c)
+        self._category_indices = [
+            (c, [i for i, (cc, sc) in enumerate(self.categories) if cc == c])
+            for c in category_names
+        ]
+
+    @classmethod
+    def extract(cls, calculator, signature, conversion_factor):
+        """Returns the calculator's emission factors, or None if the
+        calculator's output can't be reproduced from them
+        """
+        categories = signature[0]
+        phases = [p for p in signature[1] if p != 'total']
+        if not phases:
+            return None
+
+        # Emissions are linear in consumption, so emissions computed
+        # for unit consumption are the emission factors
+        try:
+            unit_emissions = calculator.calculate(_build_consumption(
+                signature, numpy.ones((len(categories), len(phases)))))
+            c, sc = categories[0]
+            species = tuple(sorted(unit_emissions[c][sc][phases[0]]))
+            factors = numpy.array([
+                [[unit_emissions[c][sc][p][s][0] for s in species]
+                    for p in phases]
+                for c, sc in categories
+            ], dtype=float)
+            efs = cls(signature, factors, species,
+                'total' in unit_emissions[c][sc])
+
+            # Make sure emissions computed from the factors match the
+            # calculator's for arbitrary consumption values
+            values = 1.0 + (numpy.arange(len(categories) * len(phases)).reshape(
+                len(categories), len(phases)) * 7919 % 1000) / 1000.0
+            expected = calculator.calculate(
+                _build_consumption(signature, values))
+            actual = efs.build_emissions(
+                (values[..., numpy.newaxis] * factors)[numpy.newaxis],
+                True)[0]['emissions_details']
+        except Exception as e:
+            logging.debug("Failed to extract emission factors: %s", e)
+            return None
+
+        if not _nested_allclose(expected, actual):
+            logging.debug("Emissions computed with extracted emission "
+                "factors don't match the calculator's")
+            return None
+
+        if conversion_factor is not None:
+            efs.factors = factors * conversion_factor
+        return efs
+
+    def build_emissions(self, emissions, include_emissions_details):
+        """Returns each fuelbed's 'emissions' and, optionally,
+        'emissions_details', given a (fuelbeds x fuel categories x
+        phases x species) emissions array
+        """
+        # (fuelbeds x phases x species)
+        totals = emissions.sum(axis=1)
+        totals_list = totals.tolist()
+        phase_totals_list = (totals.sum(axis=1).tolist()
+            if self.output_total else [None] * len(emissions))
+        if include_emissions_details:
+            emissions_list = emissions.tolist()
+            # (fuelbeds x fuel categories x species)
+            category_phase_totals = (emissions.sum(axis=2).tolist()
+                if self.output_total else None)
+            # (fuelbeds x categories x phases x species)
+            category_totals = numpy.stack([emissions[:, idx].sum(axis=1)
+                for c, idx in self._category_indices], axis=1)
+            category_totals_list = category_totals.tolist()
+            category_totals_phase_totals = (category_totals.sum(axis=2).tolist()
+                if self.output_total else None)
+
+        results = []
+        for i in range(len(emissions)):
+            fb_emissions = {'emissions': self._phases_dict(
+                totals_list[i], phase_totals_list[i])}
+
+            if include_emissions_details:
+                details = {'summary': {'total': self._phases_dict(
+                    totals_list[i], phase_totals_list[i])}}
+                for j, (c, idx) in enumerate(self._category_indices):
+                    details['summary'][c] = self._phases_dict(
+                        category_totals_list[i][j],
+                        category_totals_phase_totals[i][j]
+                            if self.output_total else None)
+                for j, (c, sc) in enumerate(self.categories):
+                    details.setdefault(c, {})[sc] = self._phases_dict(
+                        emissions_list[i][j], category_phase_totals[i][j]
+                            if self.output_total else None)
+                fb_emissions['emissions_details'] = details
+
+            results.append(fb_emissions)
+
+        return results
+
+    def _phases_dict(self, values, total):
+        d = {p: {s: [v] for s, v in zip(self.species, pv)}
+            for p, pv in zip(self.phases, values)}
+        if total is not None:
+            d['total'] = {s: [v] for s, v in zip(self.species, total)}
+        return d
@@ -14,7 +14,7 @@ from met.arl import arlfinder
 from bluesky import io
 from bluesky.config import Config
 from bluesky.datetimeutils import (
-    parse_datetimes, is_round_hour, parse_utc_offset, to_datetime
+    parse_datetimes, is_round_hour, to_datetime
 )
 from bluesky.exceptions import (
     BlueSkyConfigurationError, BlueSkyUnavailableResourceError
@@ -135,9 +135,8 @@ def _infer_time_windows_from_fires(fires_manager):
         for fire in fires_manager.fires:
             with fires_manager.fire_failure_handler(fire):
                 for aa in fire.active_areas:
-                    utc_offset = parse_utc_offset(aa.get('utc_offset'))
-                    offset = datetime.timedelta(hours=utc_offset)
-                    tw = parse_datetimes(aa, 'start', 'end')
+                    offset = datetime.timedelta(hours=aa.parsed_utc_offset)
+                    tw = {'start': aa.parsed_start, 'end': aa.parsed_end}
                     if tw['start'] > tw['end']:
                         raise ValueError("Invalid activity time window - start: {}, end: {}".format(
                             tw['start'], tw['end']))
@@ -2,7 +2,10 @@
 
 __author__ = "Joel Dubowy"
 
+import json
 import logging
+import math
+import os
 import random
 from collections import defaultdict
 
@@ -11,6 +14,7 @@ from fccsmap.lookup import FccsLookUp
 from functools import reduce
 
 from bluesky.config import Config
+from bluesky.exceptions import MissingDependencyError
 
 __all__ = [
     'run'
@@ -30,21 +34,21 @@ def run(fires_manager):
     Args:
      - fires_manager -- bluesky.models.fires.FiresManager object
     """
-    fires_manager.processed(__name__, __version__,
-        fccsmap_version=fccsmap.__version__)
+    processed_kwargs = {'fccsmap_version': fccsmap.__version__}
 
     logging.debug('Using FCCS version %s',
         Config().get('fuelbeds', 'fccs_version'))
 
-    for fire in fires_manager.fires:
-        with fires_manager.fire_failure_handler(fire):
-            for aa in fire.active_areas:
-                lookup = FCCS_LOOKUPS[aa.get('state')]
-
-                # Note that aa.locations validates that each location object
-                # has either lat+lng+area or polygon
-                for loc in aa.locations:
-                    Estimator(lookup).estimate(loc)
+    # The cache is kept, and saved once, for the whole run, even if fires
+    # are streamed through one at a time
+    with fires_manager.run_state(__name__, _create_lookup_cache,
+            _save_lookup_cache) as cache:
+        try:
+            fires_manager.run_per_fire(_run_fire, cache)
+        finally:
+            if cache:
+                processed_kwargs.update(lookup_cache=cache.info())
+            fires_manager.processed(__name__, __version__, **processed_kwargs)
 
     # TODO: Add fuel loadings data to each fuelbed object (????)
     #  If we do so here, use bluesky.modules.consumption.FuelLoadingsManager
@@ -56,27 +60,241 @@ def run(fires_manager):
     #  Note: probably no need to do this here since we do it in the
     #  consumption module
 
-    fires_manager.summarize(fuelbeds=summarize(fires_manager.fires))
-
-def summarize(fires):
-    if not fires:
+    # If fires are being streamed through one at a time, the summary
+    # needs to reflect the areas of fires already written out
+    totals = (fires_manager.streamed_totals('fuelbeds')
+        if fires_manager.streaming else None)
+    fires_manager.summarize(fuelbeds=summarize(fires_manager.fires,
+        totals=totals))
+
+def _create_lookup_cache():
+    if not Config().get('fuelbeds', 'lookup_cache'):
+        return None
+
+    # Lookups made in worker processes would be made with, and would update,
+    # copies of the cache that are discarded
+    if Config().get('executor', 'type') == 'process_pool':
+        logging.warning("Not caching fuelbed lookups, since they're run in "
+            "worker processes")
+        return None
+
+    return PointLookupCache(
+        cache_file=Config().get('fuelbeds', 'lookup_cache_file'))
+
+def _save_lookup_cache(cache):
+    if cache:
+        cache.save()
+
+def _run_fire(fire, cache=None):
+    for aa in fire.active_areas:
+        lookup = FCCS_LOOKUPS[aa.get('state')]
+        if cache:
+            lookup = CachedFccsLookUp(lookup, cache, aa.get('state') == 'AK')
+
+        # Note that aa.locations validates that each location object
+        # has either lat+lng+area or polygon
+        for loc in aa.locations:
+            Estimator(lookup).estimate(loc)
+
+def summarize(fires, totals=None):
+    """Summarizes fuelbed percentages over all fires
+
+    If 'totals' is specified, areas are accumulated in it, and the
+    summary reflects all fires passed in across multiple calls.
+    """
+    if not fires and not totals:
         return []
 
     # TODO: summarize per active_area?  per activity collection
-    area_by_fccs_id = defaultdict(lambda: 0)
-    total_area = 0
+    totals = {} if totals is None else totals
+    area_by_fccs_id = totals.setdefault('area_by_fccs_id', defaultdict(lambda: 0))
+    totals['total_area'] = totals.get('total_area', 0)
     for fire in fires:
         for ac in fire['activity']:
             for aa in ac.active_areas:
-                total_area += aa.total_area
+                totals['total_area'] += aa.total_area
                 for loc in aa.locations:
                     for fb in loc['fuelbeds']:
                         area_by_fccs_id[fb['fccs_id']] += (fb['pct'] / 100.0) * loc['area']
 
+    total_area = totals['total_area']
     summary = [{"fccs_id": fccs_id, "pct": (area / total_area) * 100.0}
         for fccs_id, area in area_by_fccs_id.items()]
     return sorted(summary, key=lambda a: a["fccs_id"])
 
+##
+## Point lookup caching
+##
+
+class PointLookupCache(object):
+    """Cache of FCCS lookup results for points
+
+    Daily fire feeds repeat the same pixel coordinates across active areas
+    and days, and adjacent detections often fall in the same FCCS raster
+    cell, so results are cached keyed by the raster cell containing the
+    point.  Cells are computed with the raster's own CRS and transform,
+    which requires the rasterio package.  If the raster can't be read,
+    points are looked up without caching.
+
+    If `cache_file` is specified, cached results are loaded from it, if
+    it exists and was written with the same lookup configuration, and
+    written back to it by `save`, so that they're shared between runs.
+    """
+
+    def __init__(self, cache_file=None):
+        self._cache_file = cache_file
+        self._signature = self._get_signature()
+        self._results = self._load() if cache_file else {}
+        self._modified = False
+        # is_alaska => FccsGrid, or None if the raster can't be read
+        self._grids = {}
+        self.hits = 0
+        self.misses = 0
+
+    def look_up(self, lookup, geo_data, is_alaska=False):
+        grid = self._get_grid(lookup, is_alaska)
+        if not grid:
+            return lookup.look_up(geo_data)
+
+        lng, lat = geo_data['coordinates']
+        key = self._get_key(grid.get_cell(lat, lng), is_alaska)
+        if key in self._results:
+            self.hits += 1
+        else:
+            self.misses += 1
+            fuelbed_info = lookup.look_up(geo_data)
+            # Only successful lookups are cached, so that failures
+            # are raised for each location
+            if not fuelbed_info or not fuelbed_info.get('fuelbeds'):
+                return fuelbed_info
+            self._results[key] = fuelbed_info
+            self._modified = True
+
+        return self._results[key]
+
+    def info(self):
+        num_lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / num_lookups if num_lookups else None,
+            "size": len(self._results)
+        }
+
+    def save(self):
+        """Writes cached results to the cache file, if one was specified"""
+        if not self._cache_file or not self._modified:
+            return
+
+        logging.debug("Writing %s cached fuelbed lookups to %s",
+            len(self._results), self._cache_file)
+        tmp_file = self._cache_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps({
+                'signature': self._signature,
+                'results': self._results
+            }))
+        os.replace(tmp_file, self._cache_file)
+        self._modified = False
+
+    def _get_grid(self, lookup, is_alaska):
+        if is_alaska not in self._grids:
+            self._grids[is_alaska] = None
+            raster_file = _get_raster_file(lookup)
+            if not raster_file:
+                logging.warning("Not caching %sfuelbed lookups; FCCS raster "
+                    "file unknown", 'AK ' if is_alaska else '')
+            else:
+                try:
+                    self._grids[is_alaska] = FccsGrid(raster_file)
+                except Exception as e:
+                    logging.warning("Not caching %sfuelbed lookups; failed "
+                        "to read FCCS raster %s: %s", 'AK ' if is_alaska else '',
+                        raster_file, e)
+        return self._grids[is_alaska]
+
+    def _get_key(self, cell, is_alaska):
+        return '{}:{},{}'.format('AK' if is_alaska else '', *cell)
+
+    def _get_signature(self):
+        # Results depend on the fccsmap version and the lookup config, but
+        # not on truncation or on cache settings
+        config = {k: v for k, v in Config().get('fuelbeds').items()
+            if not k.startswith('truncation_') and not k.startswith('lookup_cache')
+                and k != 'total_pct_threshold'}
+        return json.dumps({
+            'fccsmap_version': fccsmap.__version__,
+            'config': config,
+            'key': 'raster_cell'
+        }, sort_keys=True)
+
+    def _load(self):
+        if not os.path.exists(self._cache_file):
+            return {}
+
+        with open(self._cache_file) as f:
+            data = json.loads(f.read())
+
+        if data.get('signature') != self._signature:
+            logging.warning("Ignoring fuelbed lookup cache file %s, written"
+                " with a different lookup configuration", self._cache_file)
+            return {}
+
+        logging.debug("Loaded %s cached fuelbed lookups from %s",
+            len(data['results']), self._cache_file)
+        return data['results']
+
+def _get_raster_file(lookup):
+    # FccsLookUp doesn't expose the raster file it reads from, which, if
+    # not configured, is one of fccsmap's package data files
+    return (Config().get('fuelbeds', 'fccs_fuelload_file', allow_missing=True)
+        or getattr(lookup, '_filename', None))
+
+class FccsGrid(object):
+    """Maps points to the cells of an FCCS raster"""
+
+    def __init__(self, raster_file):
+        try:
+            import rasterio
+            import rasterio.warp
+        except ImportError:
+            raise MissingDependencyError("rasterio package required to "
+                "cache fuelbed lookups by FCCS raster cell")
+
+        param = Config().get('fuelbeds', 'fccs_fuelload_param',
+            allow_missing=True)
+        if param and raster_file.endswith('.nc'):
+            raster_file = 'NETCDF:"{}":{}'.format(raster_file, param)
+        with rasterio.open(raster_file) as src:
+            if not src.crs:
+                raise ValueError("FCCS raster isn't georeferenced")
+            self._crs = src.crs
+            self._inverse_transform = ~src.transform
+        self._transform = rasterio.warp.transform
+
+    def get_cell(self, lat, lng):
+        """Returns the (row, col) of the cell containing the point"""
+        xs, ys = self._transform('EPSG:4326', self._crs, [lng], [lat])
+        col, row = self._inverse_transform * (xs[0], ys[0])
+        return int(math.floor(row)), int(math.floor(col))
+
+class CachedFccsLookUp(object):
+    """Wraps an FccsLookUp object, looking up points through a
+    PointLookupCache.  Other geometries are looked up directly.
+    """
+
+    def __init__(self, lookup, cache, is_alaska):
+        self._lookup = lookup
+        self._cache = cache
+        self._is_alaska = is_alaska
+
+    def look_up(self, geo_data):
+        if geo_data.get('type') == 'Point':
+            return self._cache.look_up(self._lookup, geo_data,
+                is_alaska=self._is_alaska)
+        return self._lookup.look_up(geo_data)
+
+
 # TODO: change 'get_*' functions to 'set_*' and chnge fire in place
 # rather than return values ???
 
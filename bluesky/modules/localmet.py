@@ -14,7 +14,6 @@ import os
 from met.arl import arlprofiler
 
 from bluesky.config import Config
-from bluesky.datetimeutils import parse_datetimes, parse_utc_offset
 from bluesky.locationutils import LatLng
 
 __all__ = [
@@ -49,13 +48,12 @@ def run(fires_manager):
                 raise ValueError(NO_ACTIVITY_ERROR_MSG)
 
             for aa in fire.active_areas:
-                utc_offset = parse_utc_offset(aa.get('utc_offset'))
-                tw = parse_datetimes(aa, 'start', 'end')
+                utc_offset = aa.parsed_utc_offset
+                start, end = aa.parsed_start, aa.parsed_end
                 for loc in aa.locations:
                     latlng = LatLng(loc)
                     # parse_utc_offset makes sure utc offset is defined and valid
                     loc['localmet'] = arl_profiler.profile(latlng.latitude,
-                        latlng.longitude, tw['start'],
-                        tw['end'], utc_offset)
+                        latlng.longitude, start, end, utc_offset)
 
     # fires_manager.summarize(...)
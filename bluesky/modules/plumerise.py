@@ -8,7 +8,12 @@ __author__ = "Joel Dubowy"
 import copy
 import datetime
 import logging
+import multiprocessing
 import os
+import pickle
+import shutil
+import tempfile
+import time
 
 from plumerise import sev, feps, __version__ as plumerise_version
 from pyairfire import sun
@@ -30,11 +35,28 @@ def run(fires_manager):
     Args:
      - fires_manager -- bluesky.models.fires.FiresManager object
     """
-    compute_func = ComputeFunction(fires_manager)
-
-    for fire in fires_manager.fires:
-        with fires_manager.fire_failure_handler(fire):
-            compute_func(fire)
+    model = Config().get('plumerise', 'model').lower()
+    processed_kwargs = dict(plumerise_version=plumerise_version, model=model)
+    compute_func = None
+    try:
+        # The compute function, with its caches and worker pool, is kept
+        # for the whole run, even if fires are streamed through one at a time
+        with fires_manager.run_state(__name__,
+                lambda: ComputeFunction(fires_manager)) as compute_func:
+            if compute_func.worker_pool:
+                _run_in_worker_pool(fires_manager, compute_func)
+                processed_kwargs['worker_pool'] = (
+                    compute_func.worker_pool.info())
+
+            else:
+                for fire in fires_manager.fires:
+                    with fires_manager.fire_failure_handler(fire):
+                        compute_func(fire)
+
+    finally:
+        if compute_func and compute_func.sun_cache:
+            processed_kwargs['sun_cache'] = compute_func.sun_cache.info()
+        fires_manager.processed(__name__, __version__, **processed_kwargs)
 
     # TODO: spread out emissions over plume and set in activity or fuelbed
     #   objects ??? (be consistent with profiled emissions, setting in
@@ -43,6 +65,38 @@ def run(fires_manager):
     # TODO: set summary?
     # fires_manager.summarize(plumerise=...)
 
+def _run_in_worker_pool(fires_manager, compute_func):
+    """Computes plumerise for all fires' locations together in the compute
+    function's worker pool
+
+    Locations are validated and gathered per fire, in each fire's failure
+    handler, and results are then set per location, in the location's
+    fire's failure handler.
+    """
+    jobs = []
+    for fire in fires_manager.fires:
+        with fires_manager.fire_failure_handler(fire):
+            # only gather locations of fires that haven't failed
+            jobs.extend([(fire, loc, args)
+                for loc, args in compute_func.get_jobs(fire)])
+
+    logging.debug("Computing plumerise for %s locations with %s workers",
+        len(jobs), compute_func.worker_pool.num_workers)
+    results = compute_func.worker_pool.compute([j[2] for j in jobs])
+
+    failed_fire_ids = set()
+    for (fire, loc, args), (plumerise_data, exc) in zip(jobs, results):
+        if id(fire) in failed_fire_ids:
+            continue
+        with fires_manager.fire_failure_handler(fire):
+            try:
+                if exc:
+                    raise exc
+                loc['plumerise'] = plumerise_data['hours']
+            except:
+                failed_fire_ids.add(id(fire))
+                raise
+
 INVALID_PLUMERISE_MODEL_MSG = "Invalid plumerise model: '{}'"
 NO_ACTIVITY_ERROR_MSG = "Missing activity data required for plumerise"
 MISSING_AREA_ERROR_MSG = "Missing fire activity area required for plumerise"
@@ -54,8 +108,10 @@ MISSING_LOCALMET_ERROR_MSG = "Missing localmet data required for computing SEV p
 class ComputeFunction(object):
     def __init__(self, fires_manager):
         model = Config().get('plumerise', 'model').lower()
-        fires_manager.processed(__name__, __version__,
-            plumerise_version=plumerise_version, model=model)
+        self.num_workers = Config().get('plumerise', 'num_workers') or 1
+        self.worker_pool = None
+        self.sun_cache = None
+        self._get_jobs = None
 
         logging.debug('Generating %s plumerise compution function', model)
         generator = getattr(self, '_{}'.format(model), None)
@@ -74,6 +130,17 @@ class ComputeFunction(object):
             }
 
     def __call__(self, fire):
+        self._validate(fire)
+        self._compute_func(fire)
+
+    def get_jobs(self, fire):
+        """Validates fire and returns (loc, compute args) for each of its
+        locations, for computing in the worker pool
+        """
+        self._validate(fire)
+        return list(self._get_jobs(fire))
+
+    def _validate(self, fire):
         if 'activity' not in fire:
             raise ValueError(NO_ACTIVITY_ERROR_MSG)
 
@@ -81,12 +148,12 @@ class ComputeFunction(object):
         # exception if any are missing area
         fire.locations
 
-        self._compute_func(fire)
-
     ## compute function generators
 
     def _feps(self, config):
         pr = feps.FEPSPlumeRise(**config)
+        self.sun_cache = SunriseSunsetCache(
+            precision=Config().get('plumerise', 'sun_cache_precision'))
 
         def _get_working_dir(fire):
             if config.get('working_dir'):
@@ -96,7 +163,7 @@ class ComputeFunction(object):
                     os.makedirs(working_dir)
                 return working_dir
 
-        def _f(fire):
+        def _get_jobs(fire):
             # TODO: create and change to working directory here (per fire),
             #   above (one working dir per all fires), or below (per activity
             #   window)...or just let plumerise create temp workingdir (as
@@ -105,10 +172,13 @@ class ComputeFunction(object):
                 start = aa.get('start')
                 if not start:
                     raise ValueError(MISSING_START_TIME_ERROR_MSG)
-                start = datetimeutils.parse_datetime(aa.get('start'), 'start')
+                start = aa.parsed_start
 
                 if not aa.get('timeprofile'):
                     raise ValueError(MISSING_TIMEPROFILE_ERROR_MSG)
+                # the plumerise package expects timeprofile as a dict
+                # with datetime string keys
+                timeprofile = dict(aa['timeprofile'])
 
                 for loc in aa.locations:
                     if not loc.get('consumption', {}).get('summary'):
@@ -122,19 +192,26 @@ class ComputeFunction(object):
                         utc_offset = datetimeutils.parse_utc_offset(
                             loc.get('utc_offset', 0.0))
 
-                        # Use NOAA-standard sunrise/sunset calculations
                         latlng = locationutils.LatLng(loc)
-                        s = sun.Sun(lat=latlng.latitude, lng=latlng.longitude)
-                        d = start.date()
                         # just set them both, even if one is already set
-                        loc["sunrise_hour"] = s.sunrise_hr(d, utc_offset)
-                        loc["sunset_hour"] = s.sunset_hr(d, utc_offset)
+                        (loc["sunrise_hour"],
+                            loc["sunset_hour"]) = self.sun_cache.get(
+                            latlng.latitude, latlng.longitude,
+                            start.date(), utc_offset)
 
-                    plumerise_data = pr.compute(aa['timeprofile'],
-                        loc['consumption']['summary'], loc,
-                        working_dir=_get_working_dir(fire))
-                    loc['plumerise'] = plumerise_data['hours']
-                    # TODO: do anything with plumerise_data['heat'] ?
+                    yield loc, (timeprofile, loc['consumption']['summary'], loc)
+
+        def _f(fire):
+            for loc, args in _get_jobs(fire):
+                plumerise_data = pr.compute(*args,
+                    working_dir=_get_working_dir(fire))
+                loc['plumerise'] = plumerise_data['hours']
+                # TODO: do anything with plumerise_data['heat'] ?
+
+        if self.num_workers > 1:
+            self.worker_pool = FepsWorkerPool(pr, self.num_workers,
+                working_dir=config.get('working_dir'))
+            self._get_jobs = _get_jobs
 
         return _f
 
@@ -156,3 +233,159 @@ class ComputeFunction(object):
                     loc['plumerise'] = plumerise_data['hours']
 
         return _f
+
+
+class SunriseSunsetCache(object):
+    """Cache of NOAA-standard sunrise and sunset hours
+
+    Nearby locations on the same day have the same sunrise and sunset
+    hours, so results are cached keyed by date, utc offset, and lat and
+    lng rounded to `precision` decimal places.  (A hundredth of a degree
+    of longitude shifts sunrise and sunset by under three seconds.)  If
+    `precision` isn't specified, locations are keyed by their exact
+    coordinates.
+    """
+
+    def __init__(self, precision=None):
+        self._precision = precision
+        self._results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, lat, lng, date, utc_offset):
+        """Returns (sunrise hour, sunset hour)"""
+        key = self._get_key(lat, lng, date, utc_offset)
+        if key in self._results:
+            self.hits += 1
+        else:
+            self.misses += 1
+            s = sun.Sun(lat=lat, lng=lng)
+            self._results[key] = (s.sunrise_hr(date, utc_offset),
+                s.sunset_hr(date, utc_offset))
+
+        return self._results[key]
+
+    def info(self):
+        num_lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / num_lookups if num_lookups else None,
+            "size": len(self._results)
+        }
+
+    def _get_key(self, lat, lng, date, utc_offset):
+        lat, lng = float(lat), float(lng)
+        if self._precision is not None:
+            lat = round(lat, self._precision)
+            lng = round(lng, self._precision)
+        return (lat, lng, date, utc_offset)
+
+
+class FepsWorkerPool(object):
+    """Computes FEPS plumerise for multiple locations at once, in a pool of
+    worker processes.
+
+    Processes, not threads, are used because FEPSPlumeRise.compute changes
+    into its working directory with os.chdir, which would affect every
+    thread in the process.  Each worker process is given its own working
+    directory, which it reuses for each of its locations.  If 'working_dir'
+    is specified, the workers' directories are created in it and left in
+    place; otherwise, they're temp directories, deleted after computing.
+    The duration of each call is recorded, for sizing the pool.
+    plume_rise and the jobs' args must be picklable.
+    """
+
+    def __init__(self, plume_rise, num_workers, working_dir=None):
+        self._plume_rise = plume_rise
+        self.num_workers = num_workers
+        self._working_dir = working_dir
+        self._call_times = []
+        self._wall_time = 0.0
+
+    def compute(self, jobs):
+        """Calls plume_rise.compute(*args) for each args in jobs, returning
+        a (plumerise data, exception) tuple for each, in order
+        """
+        working_dirs = self._create_working_dirs()
+        available_dirs = multiprocessing.Queue()
+        for d in working_dirs:
+            available_dirs.put(d)
+
+        t = time.time()
+        pool = multiprocessing.Pool(self.num_workers, _initialize_feps_worker,
+            (self._plume_rise, available_dirs))
+        try:
+            results = []
+            # each call runs two subprocesses, so send jobs one at a time
+            for data, exc, call_time in pool.imap(_compute_feps_in_worker,
+                    jobs, 1):
+                self._call_times.append(call_time)
+                results.append((data, exc))
+            pool.close()
+            return results
+
+        finally:
+            pool.terminate()
+            pool.join()
+            self._wall_time += time.time() - t
+            if not self._working_dir:
+                for d in working_dirs:
+                    shutil.rmtree(d, ignore_errors=True)
+
+    def _create_working_dirs(self):
+        if not self._working_dir:
+            return [tempfile.mkdtemp(prefix='feps-plumerise-')
+                for i in range(self.num_workers)]
+
+        working_dirs = []
+        for i in range(self.num_workers):
+            working_dir = os.path.join(self._working_dir,
+                "feps-plumerise-worker-{}".format(i))
+            if not os.path.exists(working_dir):
+                os.makedirs(working_dir)
+            working_dirs.append(working_dir)
+        return working_dirs
+
+    def info(self):
+        """Returns call timing stats, in seconds.  A total call time much
+        less than num_workers times the wall time indicates that the pool
+        is larger than necessary.
+        """
+        num_calls = len(self._call_times)
+        total = sum(self._call_times)
+        return {
+            'num_workers': self.num_workers,
+            'num_calls': num_calls,
+            'wall_time': self._wall_time,
+            'total_call_time': total,
+            'mean_call_time': total / num_calls if num_calls else None,
+            'max_call_time': max(self._call_times) if num_calls else None
+        }
+
+
+##
+## FEPS worker processes (see FepsWorkerPool)
+##
+
+_FEPS_WORKER_STATE = None
+
+def _initialize_feps_worker(plume_rise, available_dirs):
+    global _FEPS_WORKER_STATE
+    # Each worker claims one of the working directories for its lifetime
+    _FEPS_WORKER_STATE = (plume_rise, available_dirs.get())
+
+def _compute_feps_in_worker(args):
+    plume_rise, working_dir = _FEPS_WORKER_STATE
+    t = time.time()
+    try:
+        data = plume_rise.compute(*args, working_dir=working_dir)
+        return data, None, time.time() - t
+
+    except Exception as e:
+        try:
+            # make sure exception can be sent back to main process
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            e = RuntimeError(str(e))
+        return None, e, time.time() - t
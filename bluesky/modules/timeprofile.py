@@ -11,8 +11,9 @@ from timeprofile.static import (
 )
 from timeprofile.feps import FepsTimeProfiler, FireType
 from bluesky.config import Config
-from bluesky.datetimeutils import parse_datetimes, parse_datetime
+from bluesky.datetimeutils import parse_datetime
 from bluesky.exceptions import BlueSkyConfigurationError
+from bluesky.models.hourly import HourlySeries
 from functools import reduce
 
 __all__ = [
@@ -30,21 +31,40 @@ def run(fires_manager):
 
     fires_manager.processed(__name__, __version__,
         timeprofile_version=timeprofile_version)
-    for fire in fires_manager.fires:
-        with fires_manager.fire_failure_handler(fire):
-            try:
-                _run_fire(hourly_fractions, fire)
-            except InvalidHourlyFractionsError as e:
-                raise BlueSkyConfigurationError(
-                    "Invalid timeprofile hourly fractions: '{}'".format(str(e)))
-            except InvalidStartEndTimesError as e:
-                raise BlueSkyConfigurationError(
-                    "Invalid timeprofile start end times: '{}'".format(str(e)))
+    # Active areas with the same time window (and, for rx fires, ignition
+    # window) share the same time profile, which is computed once per run
+    # (per worker process, if fires are processed in parallel)
+    with fires_manager.run_state(__name__, dict) as timeprofiles:
+        fires_manager.run_per_fire(_run_fire_and_handle_errors,
+            hourly_fractions, timeprofiles)
+
+def _run_fire_and_handle_errors(fire, hourly_fractions, timeprofiles):
+    try:
+        _run_fire(hourly_fractions, fire, timeprofiles)
+    except InvalidHourlyFractionsError as e:
+        raise BlueSkyConfigurationError(
+            "Invalid timeprofile hourly fractions: '{}'".format(str(e)))
+    except InvalidStartEndTimesError as e:
+        raise BlueSkyConfigurationError(
+            "Invalid timeprofile start end times: '{}'".format(str(e)))
 
 NOT_24_HOURLY_FRACTIONS_W_MULTIPLE_ACTIVE_AREAS_MSG = ("Only 24-hour repeatable"
     " time profiles supported for fires with multiple activity windows")
 
-def _run_fire(hourly_fractions, fire):
+def _run_fire(hourly_fractions, fire, timeprofiles=None):
+    """Sets the timeprofile of each of the fire's active areas
+
+    Args:
+     - hourly_fractions -- custom hourly fractions, if any
+     - fire -- bluesky.models.fires.Fire object
+
+    Kwargs:
+     - timeprofiles -- dict of timeprofiles already computed with the same
+        hourly_fractions, keyed by the profiler's inputs (see
+        _get_profiler_key); shared with active areas having the same
+        inputs, and updated with newly computed timeprofiles
+    """
+    timeprofiles = {} if timeprofiles is None else timeprofiles
     active_areas =  fire.active_areas
     if (hourly_fractions and len(active_areas) > 1 and
             set([len(e) for p,e in hourly_fractions.items()]) != set([24])):
@@ -57,18 +77,30 @@ def _run_fire(hourly_fractions, fire):
 
     _validate_fire(fire)
     for a in active_areas:
-        profiler = _get_profiler(hourly_fractions, fire, a)
+        key = _get_profiler_key(hourly_fractions, fire, a)
+        if key not in timeprofiles:
+            profiler = _get_profiler(hourly_fractions, fire, a)
+            # Store as hourly series, which is read-only, and so can
+            # be shared, and which is converted to a dict with datetime
+            # string keys only when dumped to json
+            timeprofiles[key] = HourlySeries(profiler.start_hour,
+                profiler.hourly_fractions)
+        a['timeprofile'] = timeprofiles[key]
+
+def _use_feps(hourly_fractions, fire):
+    return fire.type == 'rx' and not hourly_fractions
+
+def _get_profiler_key(hourly_fractions, fire, active_area):
+    if _use_feps(hourly_fractions, fire):
+        return ('feps', active_area.parsed_start, active_area.parsed_end,
+            _get_ignition_time(active_area, 'ignition_start'),
+            _get_ignition_time(active_area, 'ignition_end'))
+    return ('static', active_area.parsed_start, active_area.parsed_end)
 
-        # convert timeprofile to dict with dt keys
-        a['timeprofile'] = {}
-        fields = list(profiler.hourly_fractions.keys())
-        for i in range(len(list(profiler.hourly_fractions.values())[0])): # each phase should have same len
-            hr = profiler.start_hour + (i * profiler.ONE_HOUR)
-            a['timeprofile'][hr.isoformat()] = {
-                p: profiler.hourly_fractions[p][i] for p in fields }
+def _get_ignition_time(active_area, key):
+    return active_area.get(key) and parse_datetime(active_area[key], k=key)
 
 def _get_profiler(hourly_fractions, fire, active_area):
-    tw = parse_datetimes(active_area, 'start', 'end')
 
     # Use FepsTimeProfiler for Rx fires and StaticTimeProfiler for WF,
     # Unless custom hourly_fractions are specified, in which case
@@ -79,22 +111,22 @@ def _get_profiler(hourly_fractions, fire, active_area):
     #   hourly_fractions are specified (or the converse - i.e. alwys use
     #   FEPS for rx and add setting to turn on use of hourly_fractions,
     #   if specified, for Rx)
-    if fire.type == 'rx' and not hourly_fractions:
-        ig_start = active_area.get('ignition_start') and parse_datetime(
-            active_area['ignition_start'], k='ignition_start')
-        ig_end = active_area.get('ignition_end') and parse_datetime(
-            active_area['ignition_end'], k='ignition_end')
+    if _use_feps(hourly_fractions, fire):
+        ig_start = _get_ignition_time(active_area, 'ignition_start')
+        ig_end = _get_ignition_time(active_area, 'ignition_end')
         # TODO: pass in duff_fuel_load, total_above_ground_consumption,
         #    total_below_ground_consumption, moisture_category,
         #    relative_humidity, wind_speed, and duff_moisture_content,
         #    if defined?
-        return FepsTimeProfiler(tw['start'], tw['end'],
+        return FepsTimeProfiler(active_area.parsed_start,
+            active_area.parsed_end,
             local_ignition_start_time=ig_start,
             local_ignition_end_time=ig_end,
             fire_type=FireType.RX)
 
     else:
-        return StaticTimeProfiler(tw['start'], tw['end'],
+        return StaticTimeProfiler(active_area.parsed_start,
+            active_area.parsed_end,
             hourly_fractions=hourly_fractions)
 
 MISSING_ACTIVITY_AREA_MSG = "Missing activity data required for time profiling"
@@ -0,0 +1,50 @@
+"""Helpers shared by the benchmark scripts in this directory
+
+Importing this module puts the repo root dir at the front of sys.path,
+so that the local bluesky package is found.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
+sys.path.insert(0, ROOT_DIR)
+
+def create_parser(doc):
+    """Returns an argument parser with the script's docstring as its
+    description and with a '--log-level' option
+    """
+    parser = argparse.ArgumentParser(description=doc,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--log-level', default='WARNING')
+    return parser
+
+def parse_args(parser):
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+    return args
+
+def timed(func, *args, **kwargs):
+    """Returns func's return value and its run time, in seconds"""
+    t = time.time()
+    r = func(*args, **kwargs)
+    return r, time.time() - t
+
+def speedup(baseline_time, t):
+    return baseline_time / max(t, 1e-9)
+
+def print_table(columns, rows):
+    """Prints a header line and then each row, as it's generated, in
+    right-aligned columns
+
+    columns is a list of (header, width, format spec) tuples.  Values of
+    None are left blank.
+    """
+    print('  '.join(['{:>{}}'.format(header, width)
+        for header, width, spec in columns]))
+    for row in rows:
+        print('  '.join(['{:>{}}'.format('' if v is None else format(v, spec),
+            width) for (header, width, spec), v in zip(columns, row)]))
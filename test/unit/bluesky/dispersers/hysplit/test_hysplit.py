@@ -7,8 +7,11 @@ import os
 import afconfig
 from py.test import raises
 
-from bluesky.config import to_lowercase_keys
+from bluesky.config import Config, to_lowercase_keys
+from bluesky.exceptions import BlueSkySubprocessError
 from bluesky.dispersers.hysplit import hysplit
+from bluesky.models.fires import Fire
+from bluesky.models.hourly import HourlySeries
 
 class TestGetBinaries(object):
     # Notes:
@@ -234,3 +237,106 @@ class TestAdjustDispersionWindowForAvailableMet(object):
             {"message": "Incomplete met. Running dispersion for"
                 " 3 hours instead of 48"}
         ]
+
+
+class TestWriteEmissions(object):
+
+    class MockFire(object):
+        def __init__(self, **kwargs):
+            self.__dict__.update(kwargs)
+
+    def test(self, reset_config, monkeypatch, tmpdir):
+        Config().set(10, 'dispersion', 'hysplit',
+            'vertical_emislevels_reduction_factor')
+        Config().set(10.0, 'dispersion', 'hysplit', 'smolder_height')
+        monkeypatch.setattr(hysplit.HYSPLITDispersion, '_set_met_info',
+            lambda self, met_info: None)
+        hysplitDisperser = hysplit.HYSPLITDispersion({})
+        hysplitDisperser._set_reduction_factor()
+        hysplitDisperser._model_start = datetime.datetime(2015, 8, 5, 0)
+        hysplitDisperser._num_hours = 2
+
+        # local hour 2015-08-04T17:00:00 is model hour 2015-08-05T00:00:00
+        start = datetime.datetime(2015, 8, 4, 17)
+        fire = self.MockFire(id='a', latitude=45.12345, longitude=-120.5,
+            utc_offset=-7.0,
+            plumerise=HourlySeries(start, {
+                'heights': [[100.0 + 50 * i for i in range(21)]],
+                'emission_fractions': [[0.05] * 20],
+                'smolder_fraction': [0.25]
+            }),
+            timeprofiled_emissions=HourlySeries(start, {'PM2.5': [0.5]}),
+            timeprofiled_area=HourlySeries(start, [10.0]))
+
+        emissions_file = str(tmpdir.join('EMISS.CFG'))
+        hysplitDisperser._write_emissions([fire], emissions_file)
+        with open(emissions_file) as f:
+            assert f.read() == (
+                "emissions group header: YYYY MM DD HH QINC NUMBER\n"
+                "each emission's source: YYYY MM DD HH MM DUR_HHMM LAT LON HT RATE AREA HEAT\n"
+                "15 08 05 00 01 0003\n"
+                "15 08 05 00 00 0100  45.1234 -120.5000     10 113398.09 40468.73            0.00\n"
+                "15 08 05 00 00 0100  45.1234 -120.5000    600 170097.14 40468.73            0.00\n"
+                "15 08 05 00 00 0100  45.1234 -120.5000   1100 170097.14 40468.73            0.00\n"
+                # no emissions in the second hour
+                "15 08 05 01 01 0003\n"
+                "15 08 05 01 00 0100  45.1234 -120.5000     10    0.00    0.00            0.00\n"
+                "15 08 05 01 00 0100  45.1234 -120.5000      0    0.00    0.00            0.00\n"
+                "15 08 05 01 00 0100  45.1234 -120.5000      0    0.00    0.00            0.00\n"
+            )
+
+
+class TestRunParallel(object):
+
+    def set_up_disperser(self, monkeypatch, max_concurrent, fail_tranches):
+        Config().set(max_concurrent, 'dispersion', 'hysplit',
+            'max_concurrent_processes')
+        monkeypatch.setattr(hysplit.HYSPLITDispersion, '_set_met_info',
+            lambda self, met_info: None)
+        self.hysplitDisperser = hysplit.HYSPLITDispersion({})
+        self.hysplitDisperser.num_output_quantiles = 20
+        self.hysplitDisperser._num_processes = 3
+        self.hysplitDisperser._fire_sets = [
+            [Fire(latitude=45.0 + i, longitude=-120.0)] for i in range(3)]
+
+        self.calls = []
+        def _run_process(fires, working_dir, tranche_num=None):
+            self.calls.append(tranche_num)
+            if tranche_num in fail_tranches:
+                raise BlueSkySubprocessError("HYSPLIT failed", returncode=3)
+            return 0, None
+        monkeypatch.setattr(self.hysplitDisperser, '_run_process',
+            _run_process)
+        self.executed = []
+        monkeypatch.setattr(hysplit.io.SubprocessExecutor, 'execute',
+            lambda s, *args, **kwargs: self.executed.append(args[0]))
+        monkeypatch.setattr(self.hysplitDisperser, '_archive_file',
+            lambda *args, **kwargs: None)
+
+    def test_success(self, reset_config, monkeypatch, tmpdir):
+        self.set_up_disperser(monkeypatch, 2, [])
+        self.hysplitDisperser._run_parallel(str(tmpdir))
+
+        assert sorted(self.calls) == [0, 1, 2]
+        assert all(os.path.isdir(str(tmpdir.join(str(i)))) for i in range(3))
+        assert [t['status'] for t in self.hysplitDisperser._tranches_info] == [
+            'succeeded'] * 3
+        assert [t['exit_status'] for t in self.hysplitDisperser._tranches_info
+            ] == [0] * 3
+        assert all(t['wall_time'] >= 0
+            for t in self.hysplitDisperser._tranches_info)
+        assert self.executed == ['ncea', 'ncks']
+
+    def test_failure_cancels_queued_tranches(self, reset_config,
+            monkeypatch, tmpdir):
+        self.set_up_disperser(monkeypatch, 1, [0])
+        with raises(RuntimeError) as e_info:
+            self.hysplitDisperser._run_parallel(str(tmpdir))
+        assert e_info.value.args[0] == "HYSPLIT failed"
+
+        assert self.calls == [0]
+        assert [t['status'] for t in self.hysplitDisperser._tranches_info] == [
+            'failed', 'cancelled', 'cancelled']
+        assert self.hysplitDisperser._tranches_info[0]['exit_status'] == 3
+        assert 'exit_status' not in self.hysplitDisperser._tranches_info[1]
+        assert self.executed == []
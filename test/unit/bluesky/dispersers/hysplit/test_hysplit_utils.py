@@ -3,14 +3,19 @@
 
 import copy
 import datetime
+import os
+import shutil
 import time
 
+import pytest
 from py.test import raises
 from numpy.testing import assert_approx_equal
 
 from bluesky.config import Config
 from bluesky.dispersers.hysplit import hysplit_utils
 from bluesky.exceptions import BlueSkyConfigurationError
+from bluesky.models.fires import Fire
+from bluesky.models.hourly import HourlySeries
 
 class MockFireLocationData(object):
     def __init__(self, location_id):
@@ -109,6 +114,73 @@ class TestCreateFireTranches(object):
         fire_tranches = hysplit_utils.create_fire_tranches(fire_sets, 1)
         assert expected_tranches == fire_tranches
 
+    def _fire_sets(self, lat_lngs):
+        return [[Fire(id=str(i), latitude=lat, longitude=lng)]
+            for i, (lat, lng) in enumerate(lat_lngs)]
+
+    def test_balancing_cost(self, reset_config):
+        fire_sets = self._fire_sets([(45, -120)] * 5)
+        costs = [10, 1, 1, 6, 2]
+        fire_tranches = hysplit_utils.create_fire_tranches(fire_sets, 2,
+            costs=costs)
+        # tranches' fires are kept in their original order
+        assert fire_tranches == [
+            [fire_sets[0][0]],
+            [fire_sets[1][0], fire_sets[2][0], fire_sets[3][0], fire_sets[4][0]]
+        ]
+
+        fire_tranches = hysplit_utils.create_fire_tranches(fire_sets, 3,
+            costs=costs)
+        assert fire_tranches == [
+            [fire_sets[0][0]],
+            [fire_sets[3][0]],
+            [fire_sets[1][0], fire_sets[2][0], fire_sets[4][0]]
+        ]
+
+    def test_clustering(self, reset_config):
+        fire_sets = self._fire_sets([(45, -120), (30, -85), (45.1, -120.1),
+            (30.1, -85.1), (45.2, -120.2), (30.2, -85.2)])
+        fire_tranches = hysplit_utils.create_fire_tranches(fire_sets, 2,
+            cluster=True)
+        assert sorted(fire_tranches, key=lambda t: t[0].latitude) == [
+            [fire_sets[1][0], fire_sets[3][0], fire_sets[5][0]],
+            [fire_sets[0][0], fire_sets[2][0], fire_sets[4][0]]
+        ]
+
+        # balanced by cost, splitting along the wider (lng) extent
+        fire_tranches = hysplit_utils.create_fire_tranches(fire_sets, 2,
+            costs=[1, 10, 1, 1, 1, 1], cluster=True)
+        assert sorted(fire_tranches, key=lambda t: len(t)) == [
+            [fire_sets[1][0]],
+            [fire_sets[0][0], fire_sets[2][0], fire_sets[3][0],
+             fire_sets[4][0], fire_sets[5][0]]
+        ]
+
+        # each tranche gets at least one fire set
+        fire_tranches = hysplit_utils.create_fire_tranches(fire_sets, 6,
+            costs=[100, 1, 1, 1, 1, 1], cluster=True)
+        assert sorted(fire_tranches, key=lambda t: t[0].id) == fire_sets
+
+
+class TestEstimateFireSetCosts(object):
+
+    def test(self, reset_config):
+        start = datetime.datetime(2015, 8, 4, 17)
+        fire_sets = [
+            [
+                Fire(timeprofiled_emissions=HourlySeries(start, {
+                    'PM2.5': [0.0, 1.0, 2.0], 'CO': [1.0, 1.0, 1.0]})),
+                Fire(timeprofiled_emissions={
+                    '2015-08-04T17:00:00': {'PM2.5': 1.0},
+                    '2015-08-04T18:00:00': {'PM2.5': 0.0},
+                    '2015-08-04T19:00:00': {}
+                })
+            ],
+            [Fire()]
+        ]
+        assert hysplit_utils.estimate_fire_set_costs(fire_sets, 21) == [
+            (1 + 2 * 21) + (1 + 21), 1]
+
 
 class TestComputeNumProcesses(object):
 
@@ -624,3 +696,151 @@ class TestGetGridParams(object):
         with raises(BlueSkyConfigurationError) as e_info:
             hysplit_utils.get_grid_params()
         assert e_info.value.args[0] == 'Specify hysplit dispersion grid'
+
+
+##
+## Met Staging
+##
+
+class TestMetStager(object):
+
+    def _create_met_files(self, tmpdir):
+        met_files = []
+        for d, name in (('a', 'wrfout_d2.2015080400.f00-11_12hr01.arl'),
+                ('b', 'wrfout_d2.2015080412.f00-11_12hr01.arl')):
+            tmpdir.join('archive', d).ensure(dir=True)
+            met_file = tmpdir.join('archive', d, name)
+            met_file.write(name)
+            met_files.append(str(met_file))
+        return met_files
+
+    def test_sym_links(self, tmpdir):
+        met_files = self._create_met_files(tmpdir)
+        # the same file, via a different path, is only staged once
+        met_files.append(str(tmpdir.join('archive', 'a', '..', 'a',
+            os.path.basename(met_files[0]))))
+        stager = hysplit_utils.MetStager(met_files)
+        assert stager.filenames == sorted(
+            [os.path.basename(f) for f in met_files[:2]])
+
+        wdir = tmpdir.join('wdir')
+        met_dir = stager.stage(str(wdir))
+        assert met_dir == str(wdir.join('met'))
+        for f in met_files[:2]:
+            link = os.path.join(met_dir, os.path.basename(f))
+            assert os.path.islink(link)
+            assert os.path.realpath(link) == os.path.realpath(f)
+
+        # single process, run in the staging working dir
+        stager.link(str(wdir))
+        assert not os.path.islink(met_dir)
+        # tranches
+        stager.link(str(wdir.join('0').ensure(dir=True)))
+        assert os.path.realpath(str(wdir.join('0', 'met'))) == met_dir
+
+        stager.cleanup()
+        assert os.path.isdir(met_dir)
+
+    def test_scratch_dir(self, tmpdir):
+        met_files = self._create_met_files(tmpdir)
+        scratch_dir = tmpdir.join('scratch').ensure(dir=True)
+        stager = hysplit_utils.MetStager(met_files,
+            scratch_dir=str(scratch_dir))
+
+        met_dir = stager.stage(str(tmpdir.join('wdir')))
+        assert os.path.dirname(met_dir) == str(scratch_dir)
+        for f in met_files:
+            copy = os.path.join(met_dir, os.path.basename(f))
+            assert not os.path.islink(copy)
+            assert open(copy).read() == os.path.basename(f)
+
+        stager.link(str(tmpdir.join('wdir', '0').ensure(dir=True)))
+        link = str(tmpdir.join('wdir', '0', 'met'))
+        assert os.path.realpath(link) == met_dir
+
+        stager.cleanup()
+        assert not os.path.exists(met_dir)
+        # sym links to the removed directory are removed as well
+        assert not os.path.lexists(link)
+
+    def test_scratch_dir_staging_failure(self, tmpdir, monkeypatch):
+        met_files = self._create_met_files(tmpdir)
+        scratch_dir = tmpdir.join('scratch').ensure(dir=True)
+        stager = hysplit_utils.MetStager(met_files,
+            scratch_dir=str(scratch_dir))
+
+        copy = shutil.copy
+        def _copy(src, dest):
+            if os.listdir(os.path.dirname(dest)):
+                raise OSError(28, "No space left on device")
+            return copy(src, dest)
+        monkeypatch.setattr(shutil, 'copy', _copy)
+
+        with raises(OSError):
+            stager.stage(str(tmpdir.join('wdir')))
+        assert scratch_dir.listdir() == []
+
+    def test_files_with_same_name(self, tmpdir):
+        met_files = self._create_met_files(tmpdir)
+        other = tmpdir.join('archive', 'b', os.path.basename(met_files[0]))
+        other.write('other')
+        with raises(ValueError) as e_info:
+            hysplit_utils.MetStager(met_files + [str(other)])
+        assert e_info.value.args[0] == "Multiple met files named {}".format(
+            os.path.basename(met_files[0]))
+
+
+##
+## Merging Tranche Output
+##
+
+class TestMergeTrancheNetcdfs(object):
+
+    def _write_tranche_file(self, netCDF4, filename, pm25, tflag):
+        with netCDF4.Dataset(filename, 'w', format='NETCDF3_CLASSIC') as ds:
+            ds.setncatts({'FTYPE': 1, 'NCOLS': 3})
+            ds.createDimension('TSTEP', None)
+            ds.createDimension('DATE-TIME', 2)
+            ds.createDimension('VAR', 1)
+            ds.createDimension('ROW', 2)
+            ds.createDimension('COL', 3)
+            v = ds.createVariable('TFLAG', 'i4', ('TSTEP', 'VAR', 'DATE-TIME'))
+            v.units = '<YYYYDDD,HHMMSS>'
+            v[:] = tflag
+            v = ds.createVariable('PM25', 'f4', ('TSTEP', 'ROW', 'COL'))
+            v.units = 'ug/m^3'
+            v[:] = pm25
+            # not included in output
+            v = ds.createVariable('FOO', 'f4', ('TSTEP', 'ROW', 'COL'))
+            v[:] = pm25
+
+    def test(self, tmpdir):
+        netCDF4 = pytest.importorskip('netCDF4')
+        numpy = pytest.importorskip('numpy')
+
+        pm25s = [numpy.random.random((4, 2, 3)).astype('f4') for i in range(3)]
+        tflags = [numpy.array([[[2015216, h * 10000]] for h in range(4)],
+            dtype='i4') + i for i in range(3)]
+        input_files = []
+        for i in range(3):
+            input_files.append(str(tmpdir.join('{}.nc'.format(i))))
+            self._write_tranche_file(netCDF4, input_files[-1], pm25s[i],
+                tflags[i])
+
+        output_file = str(tmpdir.join('hysplit_conc.nc'))
+        hysplit_utils.merge_tranche_netcdfs(input_files, output_file)
+
+        with netCDF4.Dataset(output_file) as ds:
+            assert ds.data_model == 'NETCDF3_CLASSIC'
+            assert ds.FTYPE == 1 and ds.NCOLS == 3
+            assert ds.dimensions['TSTEP'].isunlimited()
+            assert len(ds.dimensions['TSTEP']) == 4
+            assert set(ds.variables) == set(['TFLAG', 'PM25'])
+            assert ds.variables['PM25'].units == 'ug/m^3'
+            assert ds.variables['PM25'].dtype == numpy.float32
+            # summed in order, in single precision
+            assert numpy.array_equal(ds.variables['PM25'][:],
+                pm25s[0] + pm25s[1] + pm25s[2])
+            # copied from the first file
+            assert numpy.array_equal(ds.variables['TFLAG'][:], tflags[0])
+        assert not tmpdir.join('hysplit_conc.nc.tmp').exists()
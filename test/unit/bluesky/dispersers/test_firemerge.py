@@ -7,6 +7,7 @@ import pytest
 from bluesky.dispersers import firemerge
 from bluesky.exceptions import BlueSkyConfigurationError
 from bluesky.models.fires import Fire
+from bluesky.models.hourly import HourlySeries
 
 
 ##
@@ -351,6 +352,33 @@ class TestFireMerger(object):
         assert self.FIRE_1 == original_fire_1
         assert self.FIRE_CONTIGUOUS_TIME_WINDOWS == original_fire_contiguous_time_windows
 
+    def _to_hourly_series(self, fire, start, num_hours):
+        fire = copy.deepcopy(fire)
+        for k, missing_hour in (('plumerise', EMPTY_PLUMERISE_HOUR),
+                ('timeprofiled_area', 0.0),
+                ('timeprofiled_emissions', {"CO": 0.0, "PM2.5": 0.0})):
+            fire[k] = HourlySeries.from_dict(fire[k], start, num_hours,
+                missing_hour)
+        return fire
+
+    def test_contiguous_time_windows_hourly_series(self, monkeypatch):
+        monkeypatch.setattr(uuid, 'uuid4', lambda: '1234abcd')
+
+        # fires' hourly data span the same dispersion window, as they
+        # do when created by DispersionBase
+        start = datetime.datetime(2015,8,4,17,0,0)
+        fires = [
+            self._to_hourly_series(self.FIRE_1, start, 4),
+            self._to_hourly_series(self.FIRE_CONTIGUOUS_TIME_WINDOWS, start, 4)
+        ]
+        merged_fires = firemerge.FireMerger().merge(fires)
+
+        assert len(merged_fires) == 1
+        for k in ('plumerise', 'timeprofiled_area', 'timeprofiled_emissions'):
+            assert isinstance(merged_fires[0][k], HourlySeries)
+        assert merged_fires == firemerge.FireMerger().merge(
+            [self.FIRE_1, self.FIRE_CONTIGUOUS_TIME_WINDOWS])
+
     def test_all(self, monkeypatch):
         monkeypatch.setattr(uuid, 'uuid4', lambda: '1234abcd')
 
@@ -36,6 +36,19 @@ class BaseLookupEcoregionTest(object):
         # on land but outside of shapefile area
         assert None == self.ecoregion_lookup.lookup(19, -100)
 
+    def test_lookup_many(self):
+        assert [] == self.ecoregion_lookup.lookup_many([], [])
+        assert ['western', 'southern', None, 'western', 'boreal', None] == (
+            self.ecoregion_lookup.lookup_many(
+                [45, 32, 28, 45, 66, 19], [-118, -88, -88, -118, -149, -100]))
+
+    def test_lookup_many_invalid(self):
+        with raises(BlueSkyGeographyValueError) as e_info:
+            self.ecoregion_lookup.lookup_many([45, 99], [-118, -122])
+
+        with raises(ValueError) as e_info:
+            self.ecoregion_lookup.lookup_many([45, 32], [-118])
+
 class TestLookupEcoregionShapely(BaseLookupEcoregionTest):
 
     def setup(self):
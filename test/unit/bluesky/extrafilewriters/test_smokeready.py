@@ -0,0 +1,61 @@
+"""Unit tests for bluesky.extrafilewriters.smokeready"""
+
+__author__ = "Joel Dubowy"
+
+from py.test import raises
+
+from bluesky.config import Config
+from bluesky.models.fires import Fire
+from bluesky.extrafilewriters import smokeready
+
+
+class FakeFipsResolver(object):
+
+    def __init__(self):
+        self.calls = []
+        self.num_saves = 0
+
+    def lookup_many(self, lats, lngs):
+        self.calls.append(list(zip(lats, lngs)))
+        return [{'county_fips': '06109', 'state_fips': '06'} if lat < 40 else None
+            for lat in lats]
+
+    def save(self):
+        self.num_saves += 1
+
+class TestSmokeReadyWriterFips(object):
+
+    def test_look_up_fips(self, reset_config, tmpdir):
+        for k, v in (('ptinv_filename', 'ptinv-2019010100.ida'),
+                ('ptday_filename', 'ptday-2019010100.ems95'),
+                ('pthour_filename', 'pthour-2019010100.ems95'),
+                ('separate_smolder', True), ('write_ptinv_totals', True),
+                ('write_ptday_file', True)):
+            Config().set(v, 'extrafiles', 'smokeready', k)
+        writer = smokeready.SmokeReadyWriter(str(tmpdir))
+        writer._fips_resolver = FakeFipsResolver()
+
+        loc = {'area': 10, 'emissions': {}, 'plumerise': {}}
+        fires = [
+            Fire({'activity': [{'active_areas': [{'specified_points': [
+                dict(loc, lat=38.0, lng=-120.0),
+                dict(loc, lat='38.0', lng=-120.0),
+                # not written, so not looked up
+                {'area': 10, 'lat': 38.5, 'lng': -120.0},
+                dict(loc, lat=45.0, lng=-120.0),
+                dict(loc, lat='sdf', lng=-120.0)
+            ]}]}]})
+        ]
+        writer._look_up_fips(fires)
+
+        # all locations are looked up in one batch, each lat/lng once
+        assert writer._fips_resolver.calls == [
+            [(38.0, -120.0), (45.0, -120.0)]
+        ]
+        assert writer._fips_resolver.num_saves == 1
+
+        assert writer._get_state_county_fips('38.0', -120.0) == ('109', '6')
+        with raises(ValueError) as e_info:
+            writer._get_state_county_fips(45.0, -120.0)
+        with raises(ValueError) as e_info:
+            writer._get_state_county_fips('sdf', -120.0)
@@ -2,8 +2,15 @@
 
 __author__ = "Joel Dubowy"
 
+import copy
+import datetime
+import gc
+import pickle
+import tracemalloc
+
 from py.test import raises
 
+from bluesky.config import Config
 from bluesky.models import activity
 
 
@@ -238,6 +245,103 @@ class TestActiveAreaLocations(object):
         assert aa['locations'] == expected
 
 
+class TestActiveAreaLocationsCaching(object):
+
+    def test_cached_until_modified(self):
+        aa = activity.ActiveArea({
+            'specified_points': [
+                {'area': '34', 'lat': 45.0, 'lng': -120.0}
+            ]
+        })
+        locations = aa.locations
+        assert locations == [{'area': 34.0, 'lat': 45.0, 'lng': -120.0}]
+        assert aa.locations is locations
+
+        # modifying non-location fields doesn't invalidate
+        aa['specified_points'][0]['fuelbeds'] = []
+        aa['start'] = "2014-05-25T17:00:00"
+        assert aa.locations is locations
+
+        # appending a point invalidates, and new point is validated
+        aa['specified_points'].append({'area': '12', 'lat': 44.0, 'lng': -119.0})
+        assert aa.locations == [
+            {'area': 34.0, 'lat': 45.0, 'lng': -120.0, 'fuelbeds': []},
+            {'area': 12.0, 'lat': 44.0, 'lng': -119.0}
+        ]
+
+        # making an existing point invalid invalidates
+        aa['specified_points'][0]['area'] = None
+        with raises(ValueError) as e_info:
+            aa.locations
+        assert e_info.value.args[0] == activity.INVALID_LOCATION_MSGS['specified_points']
+        aa['specified_points'][0]['area'] = 10
+
+        # removing specified points falls back on perimeter
+        aa['perimeter'] = {"polygon": [[-121.45, 47.43], [-121.39, 47.43],
+            [-121.39, 47.40], [-121.45, 47.43]]}
+        assert len(aa.locations) == 2
+        del aa['specified_points']
+        assert aa.locations == [aa['perimeter']]
+
+        aa.pop('perimeter')
+        with raises(ValueError) as e_info:
+            aa.locations
+        assert e_info.value.args[0] == activity.ActiveArea.MISSING_LOCATION_INFO_MSG
+
+    def test_copy_and_pickle(self):
+        aa = activity.ActiveArea({
+            'specified_points': [
+                {'area': 34, 'lat': 45.0, 'lng': -120.0}
+            ]
+        })
+        aa.locations
+
+        for aa_copy in (copy.deepcopy(aa), pickle.loads(pickle.dumps(aa))):
+            assert aa_copy == aa
+            assert isinstance(aa_copy['specified_points'], activity.TrackedList)
+            assert aa_copy.locations == aa.locations
+            aa_copy['specified_points'].pop()
+            with raises(ValueError) as e_info:
+                aa_copy.locations
+            assert len(aa.locations) == 1
+
+
+class TestActiveAreaParsedTimes(object):
+
+    def test_parsed_once_per_value(self, monkeypatch):
+        aa = activity.ActiveArea({
+            'start': "2014-05-25T17:00:00",
+            'end': "2014-05-26T17:00:00",
+            'utc_offset': "-06:30"
+        })
+        assert aa.parsed_start == datetime.datetime(2014, 5, 25, 17)
+        assert aa.parsed_end == datetime.datetime(2014, 5, 26, 17)
+        assert aa.parsed_utc_offset == -6.5
+
+        def _fail(*args):
+            raise AssertionError("shouldn't be called")
+        monkeypatch.setattr(activity.datetimeutils, 'parse_datetime', _fail)
+        monkeypatch.setattr(activity.datetimeutils, 'parse_utc_offset', _fail)
+        assert aa.parsed_start == datetime.datetime(2014, 5, 25, 17)
+        assert aa.parsed_utc_offset == -6.5
+        monkeypatch.undo()
+
+        # replacing values results in them being parsed again
+        aa['start'] = "2014-05-24T17:00:00"
+        aa['utc_offset'] = "+01:00"
+        assert aa.parsed_start == datetime.datetime(2014, 5, 24, 17)
+        assert aa.parsed_utc_offset == 1.0
+
+    def test_invalid_or_missing(self):
+        aa = activity.ActiveArea({'start': "sdf"})
+        with raises(Exception):
+            aa.parsed_start
+        with raises(Exception):
+            aa.parsed_end
+        aa['start'] = "2014-05-25T17:00:00"
+        assert aa.parsed_start == datetime.datetime(2014, 5, 25, 17)
+
+
 class TestActiveAreaTotalArea(object):
 
     def test_specified_points_no_area(self):
@@ -453,3 +557,116 @@ class TestActivityCollectionLocations(object):
         ]
 
         assert expected == ac.locations
+
+
+##
+## Tests for CompactSpecifiedPoints
+##
+
+class TestCompactSpecifiedPoints(object):
+
+    POINTS = [
+        {'area': 34.0, 'lat': 45.0, 'lng': -120.0, 'utc_offset': '-07:00'},
+        # int and string values, and extra fields, are stored as is
+        {'area': 12, 'lat': 44.0, 'lng': -119.0, 'foo': 'bar'},
+        {'area': '3.5', 'lat': 43.0, 'lng': -118.0, 'utc_offset': -6.0},
+    ]
+
+    def test_mapping_interface(self):
+        points = activity.CompactSpecifiedPoints(self.POINTS)
+        assert len(points) == 3
+        assert points == self.POINTS
+        assert self.POINTS == points
+        assert points.tolist() == self.POINTS
+        assert [type(p['area']) for p in points] == [float, int, str]
+        assert points[-1]['utc_offset'] == -6.0
+
+        loc = points[1]
+        assert loc is points[1]
+        assert dict(loc) == self.POINTS[1]
+        assert 'utc_offset' not in loc
+        assert loc.get('utc_offset') is None
+        with raises(KeyError) as e_info:
+            loc['utc_offset']
+
+        loc['utc_offset'] = '-07:00'
+        loc['lat'] = 44.5
+        loc['fuelbeds'] = [{'fccs_id': '52', 'pct': 100}]
+        del loc['foo']
+        assert loc == {'area': 12, 'lat': 44.5, 'lng': -119.0,
+            'utc_offset': '-07:00', 'fuelbeds': [{'fccs_id': '52', 'pct': 100}]}
+
+    def test_sequence_modifications(self):
+        points = activity.CompactSpecifiedPoints(self.POINTS)
+        second = points[1]
+        third = points[2]
+
+        points.insert(0, {'area': 1.0, 'lat': 1.0, 'lng': 1.0})
+        assert points[2] is second
+        assert second['lat'] == 44.0
+
+        # removed views keep their data
+        del points[2]
+        assert second == self.POINTS[1]
+        assert points[2] is third
+
+        points.append({'area': 2.0, 'lat': 2.0, 'lng': 2.0})
+        assert points.pop(0) == {'area': 1.0, 'lat': 1.0, 'lng': 1.0}
+        assert points == [self.POINTS[0], self.POINTS[2],
+            {'area': 2.0, 'lat': 2.0, 'lng': 2.0}]
+
+    def test_in_active_area(self, reset_config):
+        Config().set(2, 'compact_specified_points_threshold')
+        aa = activity.ActiveArea({
+            'utc_offset': '-07:00',
+            'fuelbeds': 'foo',
+            'specified_points': self.POINTS
+        })
+        assert isinstance(aa['specified_points'],
+            activity.CompactSpecifiedPoints)
+
+        # falls back on active area
+        assert aa['specified_points'][1]['utc_offset'] == '-07:00'
+        assert 'fuelbeds' not in aa['specified_points'][1]
+
+        # validation casts string area to float
+        assert aa.locations[2]['area'] == 3.5
+        assert aa.total_area == 49.5
+
+        aa['specified_points'][0]['lat'] = None
+        with raises(ValueError) as e_info:
+            aa.locations
+        assert e_info.value.args[0] == activity.INVALID_LOCATION_MSGS['specified_points']
+
+    def test_below_threshold(self, reset_config):
+        Config().set(4, 'compact_specified_points_threshold')
+        aa = activity.ActiveArea({'specified_points': self.POINTS})
+        assert isinstance(aa['specified_points'], list)
+
+    def _get_bytes_per_point(self, threshold, num_points):
+        Config().set(threshold, 'compact_specified_points_threshold')
+        points = [{
+            'area': 2.5 + (i % 7),
+            'lat': 30.0 + (i % 100) * 0.01,
+            'lng': -120.0 + (i // 100) * 0.01,
+            'utc_offset': '-0{}:00'.format(5 + i % 4)
+        } for i in range(num_points)]
+        gc.collect()
+
+        tracemalloc.start()
+        try:
+            aa = activity.ActiveArea({'specified_points': points})
+            del points
+            # access every point, as modules do
+            for loc in aa.locations:
+                loc['lat'], loc['lng'], loc['area'], loc['utc_offset']
+            gc.collect()
+            return tracemalloc.get_traced_memory()[0] / num_points
+        finally:
+            tracemalloc.stop()
+
+    def test_memory(self, reset_config):
+        list_size = self._get_bytes_per_point(None, 5000)
+        compact_size = self._get_bytes_per_point(1, 5000)
+        # The difference is much larger, but leave a wide margin
+        assert compact_size < list_size / 2
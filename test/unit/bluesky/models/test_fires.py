@@ -16,6 +16,7 @@ from numpy.testing import assert_approx_equal
 
 from bluesky import __version__
 from bluesky.config import Config, DEFAULTS
+from bluesky.exceptions import BlueSkyConfigurationError
 from bluesky.models import fires, activity
 
 
@@ -431,6 +432,68 @@ class TestFire(object):
         assert actual == expected
 
 
+    def test_active_areas_and_locations_cached_until_modified(self):
+        f = fires.Fire({
+            'activity': [
+                {
+                    'active_areas': [
+                        {
+                            'specified_points': [
+                                {'area': 34, 'lat': 45.0, 'lng': -120.0}
+                            ]
+                        }
+                    ]
+                }
+            ]
+        })
+        assert f.locations == [{'area': 34, 'lat': 45.0, 'lng': -120.0}]
+        # callers get copies, which they can safely modify
+        f.locations.append({})
+        f.active_areas.pop()
+        assert len(f.locations) == 1
+        assert len(f.active_areas) == 1
+
+        f['activity'][0]['active_areas'][0]['specified_points'].append(
+            {'area': 10, 'lat': 44.0, 'lng': -119.0})
+        assert len(f.locations) == 2
+
+        f['activity'].append(activity.ActivityCollection({
+            'active_areas': [
+                {'specified_points': [{'area': 1, 'lat': 43.0, 'lng': -118.0}]}
+            ]
+        }))
+        assert len(f.active_areas) == 2
+        assert len(f.locations) == 3
+
+        f['activity'][1]['active_areas'] = []
+        assert len(f.active_areas) == 1
+        assert len(f.locations) == 2
+
+        f['activity'] = []
+        assert f.active_areas == []
+        assert f.locations == []
+
+    def test_copied_fire_shares_activity(self):
+        f = fires.Fire({
+            'activity': [
+                {
+                    'active_areas': [
+                        {
+                            'specified_points': [
+                                {'area': 34, 'lat': 45.0, 'lng': -120.0}
+                            ]
+                        }
+                    ]
+                }
+            ]
+        })
+        f_copy = fires.Fire(f)
+        assert len(f_copy.locations) == 1
+        f['activity'][0]['active_areas'][0]['specified_points'].append(
+            {'area': 10, 'lat': 44.0, 'lng': -119.0})
+        assert len(f_copy.locations) == 2
+
+
 ##
 ## Tests for FiresManager
 ##
@@ -476,6 +539,61 @@ class TestFiresManager(object):
         }
         assert expected_meta == fires_manager._meta == fires_manager.meta
 
+    ## Fire Registry
+
+    def test_fires_with_shared_ids(self, reset_config):
+        fires_manager = fires.FiresManager()
+        fire_objects = [
+            fires.Fire({'id': '1', 'name': 'n1'}),
+            fires.Fire({'id': '2', 'name': 'n2'}),
+            fires.Fire({'id': '1', 'name': 'n3'})
+        ]
+        for f in fire_objects:
+            fires_manager.add_fire(f)
+
+        # ordered by id, and then by order added
+        assert fires_manager.fires == [
+            fire_objects[0], fire_objects[2], fire_objects[1]
+        ]
+        assert fires_manager.num_fires == 3
+        for f in fire_objects:
+            assert fires_manager._get_fire(f) is f
+        assert fires_manager._get_fire(fires.Fire({'id': '1'})) is None
+
+        fires_manager.remove_fire(fire_objects[0])
+        assert fires_manager.fires == [fire_objects[2], fire_objects[1]]
+        assert fires_manager.num_fires == 2
+        assert fires_manager._get_fire(fire_objects[0]) is None
+        assert fires_manager._get_fire(fire_objects[2]) is fire_objects[2]
+
+        # removing a fire that's already been removed is a no-op
+        fires_manager.remove_fire(fire_objects[0])
+        assert fires_manager.num_fires == 2
+
+    def test_fires_list_is_cached(self, reset_config):
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [
+            fires.Fire({'id': '1', 'name': 'n1'}),
+            fires.Fire({'id': '2', 'name': 'n2'})
+        ]
+        fires_list = fires_manager.fires
+        assert fires_manager.fires is fires_list
+
+        # adding or removing invalidates the cached list, but leaves the
+        # list previously returned as is
+        fire = fires.Fire({'id': '3', 'name': 'n3'})
+        fires_manager.add_fire(fire)
+        assert fires_manager.fires is not fires_list
+        assert len(fires_list) == 2
+        assert fires_manager.fires[-1] is fire
+
+        fires_list = fires_manager.fires
+        for f in fires_list:
+            fires_manager.remove_fire(f)
+        assert len(fires_list) == 3
+        assert fires_manager.fires == []
+        assert fires_manager.num_fires == 0
+
     ## Properties
 
     @freezegun.freeze_time("2016-04-20")
@@ -769,6 +887,125 @@ class TestFiresManager(object):
 
     # TODO: test instantiating with fires, dump, adding more with loads, dump, etc.
 
+    ## Streaming
+
+    @freezegun.freeze_time("2016-04-20")
+    def test_loads_ndjson_with_run_level_record(self, monkeypatch, reset_config):
+        monkeypatch.setattr(fires.FiresManager, '_stream', self._stream(
+            '{"fires": [], "foo": {"bar": "baz"}}\n'
+            '{"id": "a", "bar": 123}\n'
+            '\n'
+            '{"id": "b", "bar": 2}\n'))
+        fires_manager = fires.FiresManager()
+        fires_manager.loads_ndjson()
+        # fires aren't read until run_ndjson
+        assert fires_manager.num_fires == 0
+        assert fires_manager.meta == {"foo": {"bar": "baz"}}
+        assert [r['id'] for r in fires_manager._ndjson_records] == ['a', 'b']
+
+    @freezegun.freeze_time("2016-04-20")
+    def test_loads_ndjson_without_run_level_record(self, monkeypatch, reset_config):
+        monkeypatch.setattr(fires.FiresManager, '_stream', self._stream(
+            '{"id": "a", "bar": 123}\n'
+            '{"id": "b", "bar": 2}\n'))
+        fires_manager = fires.FiresManager()
+        fires_manager.loads_ndjson()
+        assert fires_manager.num_fires == 0
+        assert fires_manager.meta == {}
+        assert [r['id'] for r in fires_manager._ndjson_records] == ['a', 'b']
+
+    def test_run_ndjson_invalid_module(self, monkeypatch, reset_config):
+        monkeypatch.setattr(fires.FiresManager, '_stream', self._stream())
+        fires_manager = fires.FiresManager()
+        fires_manager._module_names = ['fuelbeds', 'dispersion']
+        fires_manager._modules = [None, None]
+        with raises(BlueSkyConfigurationError):
+            fires_manager.run_ndjson()
+
+    @freezegun.freeze_time("2016-04-20")
+    def test_run_ndjson(self, monkeypatch, reset_config):
+        monkeypatch.setattr(uuid, "uuid4", lambda: "abcd1234")
+        monkeypatch.setattr(fires.FiresManager, '_stream', self._stream(
+            '{"fires": [{"id": "a", "bar": 123}], "foo": {"bar": "baz"}}\n'
+            '{"id": "b", "bar": 2}\n'
+            '{"id": "c", "bar": 3}\n'))
+
+        num_fires_seen = []
+        class MockModule(object):
+            def run(self, fires_manager):
+                num_fires_seen.append(fires_manager.num_fires)
+                fires_manager.processed('fuelbeds', '0.1.0')
+                for fire in fires_manager.fires:
+                    with fires_manager.fire_failure_handler(fire):
+                        if fire.id == 'b':
+                            raise RuntimeError("oops")
+                        fire['baz'] = fire['bar'] * 2
+
+        Config().set({"skip_failed_fires": True})
+        fires_manager = fires.FiresManager()
+        fires_manager.loads_ndjson()
+        fires_manager._module_names = ['fuelbeds']
+        fires_manager._modules = [MockModule()]
+        fires_manager.run_ndjson()
+
+        lines = [json.loads(l) for l in
+            self._output.getvalue().strip().split('\n')]
+        assert num_fires_seen == [1, 1, 1]
+        assert len(lines) == 4
+        assert lines[0] == fires.Fire({'id': 'a', 'bar': 123, 'baz': 246})
+        assert lines[1]['id'] == 'b'
+        assert lines[1]['error']['message'] == 'oops'
+        assert lines[2] == fires.Fire({'id': 'c', 'bar': 3, 'baz': 6})
+        assert lines[3]['fires'] == []
+        assert lines[3]['foo'] == {"bar": "baz"}
+        assert lines[3]['counts'] == {
+            'fires': 2, 'locations': 0, 'failed_fires': 1
+        }
+        assert lines[3]['processing'] == [
+            {'module_name': 'fuelbeds', 'module': 'fuelbeds', 'version': '0.1.0'}
+        ]
+        assert 'failed_fires' not in lines[3]
+        assert fires_manager.num_fires == 0
+
+    def test_run_ndjson_module_state(self, monkeypatch, reset_config):
+        monkeypatch.setattr(fires.FiresManager, '_stream', self._stream(
+            '{"id": "a"}\n{"id": "b"}\n{"id": "c"}\n'))
+
+        created = []
+        finished = []
+        class MockModule(object):
+            def run(self, fires_manager):
+                with fires_manager.run_state('cache', lambda: created.append(
+                        {'hits': 0}) or created[-1], finished.append) as cache:
+                    cache['hits'] += 1
+                    fires_manager.processed('fuelbeds', '0.1.0',
+                        cache=dict(cache), fire_id=fires_manager.fires[0].id)
+
+        fires_manager = fires.FiresManager()
+        fires_manager.loads_ndjson()
+        fires_manager._module_names = ['fuelbeds']
+        fires_manager._modules = [MockModule()]
+        fires_manager.run_ndjson()
+
+        # state is created once, kept across fires, and finished once
+        assert created == [{'hits': 3}]
+        assert finished == created
+        lines = [json.loads(l) for l in
+            self._output.getvalue().strip().split('\n')]
+        assert lines[3]['processing'] == [{'module_name': 'fuelbeds',
+            'module': 'fuelbeds', 'version': '0.1.0', 'cache': {'hits': 3},
+            'fire_id': 'c'}]
+        assert [m['module_name'] for m in lines[3]['runtime']['modules']] == [
+            'fuelbeds']
+        assert 'total' in lines[3]['runtime']['modules'][0]
+
+        # outside of a run, state isn't kept
+        created[:] = finished[:] = []
+        fires_manager.fires = [fires.Fire({'id': 'd'})]
+        MockModule().run(fires_manager)
+        MockModule().run(fires_manager)
+        assert created == finished == [{'hits': 1}, {'hits': 1}]
+
     ## Failures
 
     def test_fire_failure_handler(self, reset_config):
@@ -824,6 +1061,64 @@ class TestFiresManager(object):
         assert fires_manager.fires[1]['error']['traceback']
         assert fires_manager.failed_fires is None
 
+    ## Per-fire processing
+
+    def _run_per_fire(self, executor_type, skip_failed_fires):
+        Config().set({
+            "skip_failed_fires": skip_failed_fires,
+            "executor": {"type": executor_type, "num_processes": 2}
+        })
+        fires_manager = fires.FiresManager()
+        fires_manager.fires = [
+            fires.Fire({'id': str(i), 'activity': [{'active_areas': [
+                {'specified_points': [{'area': 10, 'lat': 45, 'lng': -120}]}
+            ]}]}) for i in range(1, 6)
+        ]
+        original_fires = fires_manager.fires
+        if skip_failed_fires:
+            fires_manager.run_per_fire(_process_fire, 'bar')
+        else:
+            with raises(RuntimeError) as e_info:
+                fires_manager.run_per_fire(_process_fire, 'bar')
+            assert e_info.value.args[0] == 'oops'
+        return fires_manager, original_fires
+
+    def test_run_per_fire_invalid_executor(self, reset_config):
+        with raises(BlueSkyConfigurationError) as e_info:
+            self._run_per_fire('foo', True)
+
+    def test_run_per_fire(self, reset_config):
+        for executor_type in ('serial', 'process_pool'):
+            # Skip
+            fires_manager, original_fires = self._run_per_fire(
+                executor_type, True)
+            assert [f.id for f in fires_manager.fires] == ['1', '2', '4', '5']
+            # fires are modified in place
+            assert fires_manager.fires == [original_fires[i]
+                for i in (0, 1, 3, 4)]
+            for f in fires_manager.fires:
+                assert f.locations[0]['foo'] == 'bar'
+            assert len(fires_manager.failed_fires) == 1
+            assert fires_manager.failed_fires[0] is original_fires[2]
+            assert fires_manager.failed_fires[0]['error']['type'] == 'RuntimeError'
+            assert fires_manager.failed_fires[0]['error']['message'] == 'oops'
+            assert '_process_fire' in fires_manager.failed_fires[0]['error']['traceback']
+
+            # Don't Skip
+            fires_manager, original_fires = self._run_per_fire(
+                executor_type, False)
+            assert fires_manager.num_fires == 5
+            assert [f.locations[0].get('foo') for f in fires_manager.fires] == [
+                'bar', 'bar', None, None, None]
+            assert fires_manager.fires[2]['error']['message'] == 'oops'
+            assert '_process_fire' in fires_manager.fires[2]['error']['traceback']
+            assert fires_manager.failed_fires is None
+
+def _process_fire(fire, val):
+    if fire.id == '3':
+        raise RuntimeError("oops")
+    fire.locations[0]['foo'] = val
+
 
 
 class TestFiresManagerSettingToday(object):
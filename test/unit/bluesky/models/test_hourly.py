@@ -0,0 +1,183 @@
+"""Unit tests for bluesky.models.hourly"""
+
+__author__ = "Joel Dubowy"
+
+import copy
+import datetime
+import json
+import pickle
+
+from py.test import raises
+
+from bluesky.models.fires import FireEncoder
+from bluesky.models.hourly import HourlySeries, get_hour
+
+START = datetime.datetime(2015, 8, 4, 17)
+MISSING_HOUR = {'flaming': 0.0, 'area_fraction': 0.0}
+
+class TestHourlySeries(object):
+
+    def setup(self):
+        self.series = HourlySeries(START, {
+            'flaming': [0.2, 0.5, 0.3],
+            'area_fraction': [0.1, 0.6, 0.3]
+        })
+
+    def test_hour_access(self):
+        assert self.series.num_hours == 3
+        assert self.series.fields == ['flaming', 'area_fraction']
+        assert self.series.hour_index(START) == 0
+        assert self.series.hour_index(datetime.datetime(2015, 8, 4, 19)) == 2
+        assert self.series.hour_index(datetime.datetime(2015, 8, 4, 20)) is None
+        assert self.series.hour_index(datetime.datetime(2015, 8, 4, 16)) is None
+        assert self.series.hour_index(datetime.datetime(2015, 8, 4, 17, 30)) is None
+        assert self.series.hour(1) == {'flaming': 0.5, 'area_fraction': 0.6}
+        assert self.series.get_hour(datetime.datetime(2015, 8, 4, 18)) == {
+            'flaming': 0.5, 'area_fraction': 0.6}
+        assert self.series.get_hour(datetime.datetime(2015, 8, 4, 20)) is None
+
+    def test_mapping_interface(self):
+        expected = {
+            '2015-08-04T17:00:00': {'flaming': 0.2, 'area_fraction': 0.1},
+            '2015-08-04T18:00:00': {'flaming': 0.5, 'area_fraction': 0.6},
+            '2015-08-04T19:00:00': {'flaming': 0.3, 'area_fraction': 0.3}
+        }
+        assert self.series == expected
+        assert expected == self.series
+        assert list(self.series.keys()) == sorted(expected.keys())
+        assert '2015-08-04T18:00:00' in self.series
+        assert '2015-08-04T20:00:00' not in self.series
+        assert 'foo' not in self.series
+        with raises(KeyError):
+            self.series['2015-08-04T20:00:00']
+
+        assert json.loads(json.dumps({'tp': self.series}, cls=FireEncoder)) == {
+            'tp': expected}
+        for s in (copy.deepcopy(self.series),
+                pickle.loads(pickle.dumps(self.series))):
+            assert s == expected
+
+    def test_no_fields(self):
+        series = HourlySeries(START, [1.0, 2.0])
+        assert series.fields is None
+        assert series.hour(1) == 2.0
+        assert series == {
+            '2015-08-04T17:00:00': 1.0,
+            '2015-08-04T18:00:00': 2.0
+        }
+
+    def test_read_only(self):
+        flaming = [0.2, 0.5, 0.3]
+        series = HourlySeries(START, {'flaming': flaming})
+        flaming[0] = 1.0
+        assert series.hour(0) == {'flaming': 0.2}
+        with raises(ValueError):
+            series.array('flaming')[0] = 1.0
+
+    def test_fields_with_different_lengths(self):
+        with raises(ValueError):
+            HourlySeries(START, {'flaming': [0.2, 0.5], 'area_fraction': [1.0]})
+
+    def test_from_dict(self):
+        data = {
+            # before window
+            '2015-08-04T16:00:00': {'flaming': 0.4, 'area_fraction': 0.5},
+            '2015-08-04T17:00:00': {'flaming': 0.1, 'area_fraction': 0.2},
+            # empty hours are treated as missing
+            '2015-08-04T18:00:00': {},
+            # not on the hour
+            '2015-08-04T18:30:00': {'flaming': 0.1, 'area_fraction': 0.2},
+            '2015-08-04T19:00:00': {'flaming': 0.3, 'area_fraction': 0.2,
+                'residual': 0.4}
+        }
+        series = HourlySeries.from_dict(data, '2015-08-04T17:00:00', 4,
+            MISSING_HOUR)
+        assert series.start_hour == START
+        assert series == {
+            '2015-08-04T17:00:00': {'flaming': 0.1, 'area_fraction': 0.2},
+            '2015-08-04T18:00:00': {'flaming': 0.0, 'area_fraction': 0.0},
+            '2015-08-04T19:00:00': {'flaming': 0.3, 'area_fraction': 0.2},
+            '2015-08-04T20:00:00': {'flaming': 0.0, 'area_fraction': 0.0}
+        }
+
+    def test_from_dict_two_dimensional_fields(self):
+        missing = {'heights': [0.0] * 3, 'smolder_fraction': 0.0}
+        data = {
+            '2015-08-04T18:00:00': {'heights': [1, 2, 3], 'smolder_fraction': 0.5}
+        }
+        series = HourlySeries.from_dict(data, START, 2, missing)
+        assert series.array('heights').shape == (2, 3)
+        assert series == {
+            '2015-08-04T17:00:00': {'heights': [0.0, 0.0, 0.0], 'smolder_fraction': 0.0},
+            '2015-08-04T18:00:00': {'heights': [1.0, 2.0, 3.0], 'smolder_fraction': 0.5}
+        }
+
+        # varying number of heights can't be stored in dense arrays
+        data['2015-08-04T18:00:00']['heights'] = [1, 2]
+        with raises(ValueError):
+            HourlySeries.from_dict(data, START, 2, missing)
+
+    def test_window(self):
+        # overlapping
+        series = self.series.window(datetime.datetime(2015, 8, 4, 18), 3,
+            MISSING_HOUR)
+        assert series == {
+            '2015-08-04T18:00:00': {'flaming': 0.5, 'area_fraction': 0.6},
+            '2015-08-04T19:00:00': {'flaming': 0.3, 'area_fraction': 0.3},
+            '2015-08-04T20:00:00': {'flaming': 0.0, 'area_fraction': 0.0}
+        }
+
+        # not aligned
+        series = self.series.window(datetime.datetime(2015, 8, 4, 17, 30), 2,
+            MISSING_HOUR)
+        assert series == {
+            '2015-08-04T17:30:00': {'flaming': 0.0, 'area_fraction': 0.0},
+            '2015-08-04T18:30:00': {'flaming': 0.0, 'area_fraction': 0.0}
+        }
+
+        # missing fields
+        with raises(ValueError):
+            self.series.window(START, 2, dict(MISSING_HOUR, residual=0.0))
+
+    def test_constant(self):
+        assert HourlySeries.constant(START, 2, 0.5) == {
+            '2015-08-04T17:00:00': 0.5,
+            '2015-08-04T18:00:00': 0.5
+        }
+
+    def test_add_and_splice(self):
+        other = HourlySeries(START, {
+            'flaming': [1.0, 1.0, 1.0],
+            'area_fraction': [2.0, 2.0, 2.0]
+        })
+        assert self.series.is_aligned_with(other)
+        assert (self.series + other).hour(1) == {
+            'flaming': 1.5, 'area_fraction': 2.6}
+
+        spliced = self.series.splice(other, datetime.datetime(2015, 8, 4, 17, 30))
+        assert [h['flaming'] for h in spliced.values()] == [0.2, 1.0, 1.0]
+        spliced = self.series.splice(other, datetime.datetime(2015, 8, 4, 12))
+        assert spliced == other
+        spliced = self.series.splice(other, datetime.datetime(2015, 8, 5, 12))
+        assert spliced == self.series
+
+        not_aligned = HourlySeries(datetime.datetime(2015, 8, 4, 18), {
+            'flaming': [1.0, 1.0, 1.0],
+            'area_fraction': [2.0, 2.0, 2.0]
+        })
+        assert not self.series.is_aligned_with(not_aligned)
+        with raises(TypeError):
+            self.series + not_aligned
+        with raises(ValueError):
+            self.series.splice(not_aligned, START)
+
+
+class TestGetHour(object):
+
+    def test(self):
+        dt = datetime.datetime(2015, 8, 4, 18)
+        series = HourlySeries(START, [1.0, 2.0])
+        assert get_hour(series, dt) == 2.0
+        assert get_hour(dict(series), dt) == 2.0
+        assert get_hour(series, START - datetime.timedelta(hours=1)) is None
+        assert get_hour({}, dt) is None
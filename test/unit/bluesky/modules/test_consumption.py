@@ -3,14 +3,16 @@
 __author__ = "Joel Dubowy"
 
 import copy
+import sys
 from unittest import mock
 
 from numpy import array
 from numpy.testing import assert_approx_equal
 from py.test import raises
 
+from bluesky.config import Config
 from bluesky.consumeutils import FuelLoadingsManager
-from bluesky.models.fires import Fire
+from bluesky.models.fires import Fire, FiresManager
 from bluesky.modules import consumption
 
 
@@ -147,3 +149,198 @@ class TestConsumptionRunFire(object):
         }
 
         check_consumption(fb['consumption'], expected_consumption)
+
+
+class FakeFuelConsumption(object):
+    """Mimics consume.FuelConsumption, computing values from each
+    fuelbed's fccs id and the duff moisture setting
+    """
+
+    num_instances = 0
+
+    def __init__(self, fccs_file=None):
+        self.FCCS = None
+        self.output_units = 'tons_ac'
+        FakeFuelConsumption.num_instances += 1
+
+    def results(self):
+        if 'bad' in self.fuelbed_fccs_ids:
+            return {}
+        vals = array([float(i) * self.fuel_moisture_duff_pct for i in self.fuelbed_fccs_ids])
+        return {
+            'consumption': {
+                'debug': {},
+                'litter-lichen-moss': {
+                    'litter': {'flaming': vals, 'total': 2 * vals}
+                }
+            },
+            'heat release': {'total': 10 * vals}
+        }
+
+class FakeFuelLoadingsManager(object):
+
+    def generate_custom_csv(self, fccs_id):
+        return ""
+
+    def get_fuel_loadings(self, fccs_id, fccs=None):
+        return {'fccs_id': fccs_id}
+
+def _create_fires():
+    return [
+        Fire({
+            'id': 'a',
+            'type': 'rx',
+            'activity': [{'active_areas': [{
+                'start': '2018-06-27T00:00:00',
+                'end': '2018-06-28T00:00:00',
+                'ecoregion': 'western',
+                'moisture_duff': 5,
+                'specified_points': [
+                    {'area': 10, 'lat': 45.0, 'lng': -120.0,
+                        'fuelbeds': [{'fccs_id': '1', 'pct': 40},
+                            {'fccs_id': '2', 'pct': 60}]},
+                    {'area': 20, 'lat': 45.1, 'lng': -120.1,
+                        'fuelbeds': [{'fccs_id': '3', 'pct': 100}]}
+                ]
+            }]}]
+        }),
+        Fire({
+            'id': 'b',
+            'type': 'rx',
+            'activity': [{'active_areas': [{
+                'start': '2018-01-27T00:00:00',
+                'end': '2018-01-28T00:00:00',
+                'ecoregion': 'western',
+                'moisture_duff': 10,
+                'specified_points': [
+                    {'area': 30, 'lat': 46.0, 'lng': -121.0,
+                        'fuelbeds': [{'fccs_id': '4', 'pct': 100}]}
+                ]
+            }]}]
+        }),
+        Fire({
+            'id': 'c',
+            'type': 'rx',
+            'activity': [{'active_areas': [{
+                'start': '2018-06-27T00:00:00',
+                'end': '2018-06-28T00:00:00',
+                'ecoregion': 'western',
+                'moisture_duff': 5,
+                'specified_points': [
+                    {'area': 5, 'lat': 47.0, 'lng': -122.0,
+                        'fuelbeds': [{'fccs_id': '5', 'pct': 100}]}
+                ]
+            }]}]
+        })
+    ]
+
+class TestConsumptionBatched(object):
+
+    def _run(self, monkeypatch, fires, batch):
+        monkeypatch.setattr(consumption.consume, 'FuelConsumption',
+            FakeFuelConsumption)
+        FakeFuelConsumption.num_instances = 0
+        Config().set(batch, 'consumption', 'batch_fuelbeds')
+        fm = FiresManager()
+        fm.fires = fires
+        if batch:
+            consumption._run_batched(fm, FakeFuelLoadingsManager(), 2)
+        else:
+            fm.run_per_fire(consumption._run_fire, FakeFuelLoadingsManager(), 2)
+        return fm
+
+    def _fuelbeds(self, fm):
+        return [fb for f in fm.fires for loc in f.locations
+            for fb in loc['fuelbeds']]
+
+    def test_same_as_per_fuelbed(self, reset_config, monkeypatch):
+        expected = self._fuelbeds(self._run(monkeypatch, _create_fires(), False))
+        assert FakeFuelConsumption.num_instances == 5
+
+        fm = self._run(monkeypatch, _create_fires(), True)
+        # fires 'a' and 'c' share settings; 'b' has different duff moisture
+        assert FakeFuelConsumption.num_instances == 2
+        actual = self._fuelbeds(fm)
+        assert len(expected) == len(actual) == 5
+        for e, a in zip(expected, actual):
+            assert a['fuel_loadings'] == e['fuel_loadings']
+            assert set(a['consumption']) == set(e['consumption'])
+            assert (list(a['consumption']['litter-lichen-moss']['litter']['total'])
+                == list(e['consumption']['litter-lichen-moss']['litter']['total']))
+            assert list(a['heat']['total']) == list(e['heat']['total'])
+
+        # area 10 * 40% * fccs_id 1 * moisture 5 * 10
+        assert list(actual[0]['heat']['total']) == [200.0]
+        # area 30 * 100% * fccs_id 4 * moisture 10 * 10
+        assert list(actual[3]['heat']['total']) == [12000.0]
+
+    def test_failed_fuelbed(self, reset_config, monkeypatch):
+        Config().set(True, 'skip_failed_fires')
+        fires = _create_fires()
+        fires[2]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]['fccs_id'] = 'bad'
+        fm = self._run(monkeypatch, fires, True)
+        # one failed batch run, and then one run per fuelbed in that batch
+        assert FakeFuelConsumption.num_instances == 6
+        assert [f.id for f in fm.fires] == ['a', 'b']
+        assert [f.id for f in fm.failed_fires] == ['c']
+        assert [list(fb['heat']['total']) for fb in self._fuelbeds(fm)] == [
+            [200.0], [600.0], [3000.0], [12000.0]]
+
+
+class FakeEcoregionLookup(object):
+
+    calls = []
+
+    def __init__(self, implementation='ogr'):
+        pass
+
+    def lookup_many(self, lats, lngs):
+        self.calls.append(list(zip(lats, lngs)))
+        if any(abs(lat) > 90.0 for lat in lats):
+            raise consumption.exceptions.BlueSkyGeographyValueError("Invalid")
+        return [None if lat > 46.5 else 'southern' for lat in lats]
+
+class TestValidateInputEcoregions(object):
+
+    def _run(self, monkeypatch, fires):
+        fake_module = mock.Mock(EcoregionLookup=FakeEcoregionLookup)
+        monkeypatch.setitem(sys.modules, 'bluesky.ecoregion.lookup',
+            fake_module)
+        FakeEcoregionLookup.calls = []
+        for f in fires:
+            f['activity'][0]['active_areas'][0].pop('ecoregion')
+        fm = FiresManager()
+        fm.fires = fires
+        consumption._validate_input(fm)
+        return fm
+
+    def _ecoregions(self, fm):
+        return [loc['ecoregion'] for f in fm.fires for loc in f.locations]
+
+    def test_one_batch(self, reset_config, monkeypatch):
+        Config().set('boreal', 'consumption', 'default_ecoregion')
+        fm = self._run(monkeypatch, _create_fires())
+        assert FakeEcoregionLookup.calls == [
+            [(45.0, -120.0), (45.1, -120.1), (46.0, -121.0), (47.0, -122.0)]
+        ]
+        assert self._ecoregions(fm) == [
+            'southern', 'southern', 'southern', 'boreal']
+
+    def test_invalid_location(self, reset_config, monkeypatch):
+        Config().set(True, 'skip_failed_fires')
+        Config().set('boreal', 'consumption', 'default_ecoregion')
+        fires = _create_fires()
+        fires[1]['activity'][0]['active_areas'][0]['specified_points'][0]['lat'] = 95.0
+        fm = self._run(monkeypatch, fires)
+        # failed batch, followed by per-fire lookups
+        assert len(FakeEcoregionLookup.calls) == 4
+        assert [f.id for f in fm.fires] == ['a', 'c']
+        assert [f.id for f in fm.failed_fires] == ['b']
+        assert self._ecoregions(fm) == ['southern', 'southern', 'boreal']
+
+    def test_no_default_ecoregion(self, reset_config, monkeypatch):
+        Config().set(True, 'skip_failed_fires')
+        fm = self._run(monkeypatch, _create_fires())
+        assert [f.id for f in fm.fires] == ['a', 'b']
+        assert [f.id for f in fm.failed_fires] == ['c']
+        assert self._ecoregions(fm) == ['southern', 'southern', 'southern']
@@ -3,6 +3,7 @@
 __author__ = "Joel Dubowy"
 
 import copy
+import pickle
 #from unittest import mock
 
 from numpy import array
@@ -12,7 +13,8 @@ from py.test import raises
 import afconfig
 
 from bluesky.config import Config
-from bluesky.models.fires import Fire
+from bluesky.exceptions import BlueSkyConfigurationError
+from bluesky.models.fires import Fire, FiresManager
 from bluesky.modules import emissions
 
 FIRES = [
@@ -381,6 +383,25 @@ class TestPrichardOneillEmissions(BaseEmissionsTest):
         self._check_emissions(self.EXPECTED_FIRE1_EMISSIONS,
             self.fires[1]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]['emissions'])
 
+    def test_calculator_cache(self, reset_config):
+        Config().set("prichard-oneill", 'emissions', "model")
+        Config().set(self.SPECIES, 'emissions', "species")
+        fires = [self.fires[1], copy.deepcopy(self.fires[1])]
+        e = emissions.PrichardOneill(fire_failure_manager)
+        e.run(fires)
+
+        assert e.calculator_cache_info() == {
+            'hits': 1, 'misses': 1, 'size': 1, 'max_size': 1024}
+        for fire in fires:
+            assert 'error' not in fire
+            self._check_emissions(self.EXPECTED_FIRE1_EMISSIONS,
+                fire['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]['emissions'])
+
+        # unpickled copies, used in worker processes, get their own cache
+        e = pickle.loads(pickle.dumps(e))
+        assert e.calculator_cache_info() == {
+            'hits': 0, 'misses': 0, 'size': 0, 'max_size': 1024}
+
 class TestConsumeEmissions(BaseEmissionsTest):
 
     EXPECTED_FIRE1_EMISSIONS = {
@@ -491,3 +512,161 @@ class TestConsumeEmissions(BaseEmissionsTest):
         assert 'emissions_details' in self.fires[1]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]
         self._check_emissions(self.EXPECTED_FIRE1_EMISSIONS_PM_ONLY,
             self.fires[1]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]['emissions'])
+
+
+class FakeCalculator(object):
+    """Mimics emitcalc's EmissionsCalculator, with emission factors
+    that vary by fccs id, fuel category, phase, and species
+    """
+
+    SPECIES = ['CO', 'PM2.5']
+
+    def __init__(self, fccs_id, rounded=False):
+        self.fccs_id = float(fccs_id)
+        self.rounded = rounded
+
+    def calculate(self, consumption):
+        r = {'summary': {'total': {}}}
+        for c in consumption:
+            if c == 'summary':
+                continue
+            r['summary'][c] = {}
+            for sc in consumption[c]:
+                r.setdefault(c, {})[sc] = {}
+                for p in ('flaming', 'smoldering', 'residual'):
+                    for i, s in enumerate(self.SPECIES):
+                        v = (consumption[c][sc][p][0] * self.fccs_id
+                            * (i + 1) * len(p) * len(sc))
+                        if self.rounded:
+                            v = round(v)
+                        for d in (r[c][sc], r['summary'][c],
+                                r['summary']['total']):
+                            for phase in (p, 'total'):
+                                d.setdefault(phase, {}).setdefault(s, [0.0])
+                                d[phase][s][0] += v
+        return r
+
+class FakeCalculatorEmissions(emissions.EmissionsCalculatorBase):
+
+    RUN_MSG = "Running emissions module with fake calculators"
+    EMISSIONS_CONVERSION_FACTOR = 0.5
+
+    def __init__(self, fire_failure_handler, rounded=False):
+        super(FakeCalculatorEmissions, self).__init__(fire_failure_handler)
+        self.rounded = rounded
+        self.num_calculations = 0
+
+    def _get_calculator_key(self, fire, fb):
+        return fb['fccs_id']
+
+    def _get_calculator(self, key):
+        calculator = FakeCalculator(key, rounded=self.rounded)
+        calculate = calculator.calculate
+        def _calculate(consumption):
+            self.num_calculations += 1
+            return calculate(consumption)
+        calculator.calculate = _calculate
+        return calculator
+
+def _create_fake_calculator_fires():
+    def _fb(fccs_id, v):
+        return {
+            'fccs_id': fccs_id,
+            'pct': 50,
+            'consumption': {
+                'summary': {
+                    'total': {'flaming': [3 * v], 'smoldering': [v], 'residual': [0.0], 'total': [4 * v]},
+                },
+                'litter-lichen-moss': {
+                    'litter': {'flaming': [2 * v], 'smoldering': [v], 'residual': [0.0], 'total': [3 * v]},
+                    'moss': {'flaming': [v], 'smoldering': [0.0], 'residual': [0.0], 'total': [v]}
+                }
+            }
+        }
+    return [
+        Fire({'id': 'a', 'activity': [{'active_areas': [{'specified_points': [
+            {'lat': 45.0, 'lng': -120.0, 'area': 10,
+                'fuelbeds': [_fb('1', 1.5), _fb('2', 2.0)]},
+            {'lat': 45.1, 'lng': -120.1, 'area': 10,
+                'fuelbeds': [_fb('1', 3.0)]}
+        ]}]}]}),
+        Fire({'id': 'b', 'activity': [{'active_areas': [{'specified_points': [
+            {'lat': 46.0, 'lng': -121.0, 'area': 10,
+                'fuelbeds': [_fb('3', 0.25)]}
+        ]}]}]}),
+        Fire({'id': 'c', 'activity': [{'active_areas': [{'specified_points': [
+            {'lat': 47.0, 'lng': -122.0, 'area': 10}
+        ]}]}]})
+    ]
+
+class TestVectorizedEngine(object):
+
+    def _run(self, vectorized, include_emissions_details, rounded=False):
+        Config().set(True, 'skip_failed_fires')
+        Config().set(include_emissions_details, 'emissions',
+            'include_emissions_details')
+        fm = FiresManager()
+        fm.fires = _create_fake_calculator_fires()
+        e = FakeCalculatorEmissions(fm.fire_failure_handler, rounded=rounded)
+        if vectorized:
+            e.run_vectorized(fm)
+        else:
+            fm.run_per_fire(e._run_on_fire)
+        return fm, e
+
+    def _check(self, expected_fm, actual_fm, include_emissions_details):
+        assert [f.id for f in actual_fm.fires] == ['a', 'b']
+        assert [f.id for f in actual_fm.failed_fires] == ['c']
+        expected = [fb for f in expected_fm.fires for loc in f.locations
+            for fb in loc['fuelbeds']]
+        actual = [fb for f in actual_fm.fires for loc in f.locations
+            for fb in loc['fuelbeds']]
+        assert len(expected) == len(actual) == 4
+        for e, a in zip(expected, actual):
+            assert emissions._nested_allclose(e['emissions'], a['emissions'])
+            if include_emissions_details:
+                assert emissions._nested_allclose(e['emissions_details'],
+                    a['emissions_details'])
+            else:
+                assert 'emissions_details' not in a
+
+    def test_wo_details(self, reset_config):
+        expected_fm, expected_e = self._run(False, False)
+        assert expected_e.num_calculations == 4
+
+        fm, e = self._run(True, False)
+        # two calculations (unit and verification) for each fccs id
+        assert e.num_calculations == 6
+        self._check(expected_fm, fm, False)
+
+        fb = fm.fires[0]['activity'][0]['active_areas'][0]['specified_points'][0]['fuelbeds'][0]
+        # litter + moss; 1.5 * 0.5 * 2 species factor * len('flaming') * len(sc)
+        assert fb['emissions']['flaming']['PM2.5'][0] == (
+            2 * 1.5 * 0.5 * 2 * 7 * 6 + 1.5 * 0.5 * 2 * 7 * 4)
+
+    def test_with_details(self, reset_config):
+        expected_fm, expected_e = self._run(False, True)
+        fm, e = self._run(True, True)
+        self._check(expected_fm, fm, True)
+
+    def test_fallback(self, reset_config):
+        # Rounding breaks linearity, so emission factors can't be
+        # extracted, and each fuelbed is computed with its calculator
+        expected_fm, expected_e = self._run(False, True, rounded=True)
+        fm, e = self._run(True, True, rounded=True)
+        assert e.num_calculations == 6 + 4
+        self._check(expected_fm, fm, True)
+
+    def test_invalid_engine(self, reset_config):
+        Config().set('foo', 'emissions', 'engine')
+        with raises(BlueSkyConfigurationError) as e_info:
+            emissions.run(FiresManager())
+        assert e_info.value.args[0] == "Invalid emissions engine: 'foo'."
+
+    def test_unsupported_model(self, reset_config):
+        Config().set('numpy', 'emissions', 'engine')
+        Config().set('consume', 'emissions', 'model')
+        with raises(BlueSkyConfigurationError) as e_info:
+            emissions.run(FiresManager())
+        assert e_info.value.args[0] == (
+            "The numpy emissions engine isn't supported for model 'consume'")
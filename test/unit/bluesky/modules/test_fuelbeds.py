@@ -3,6 +3,7 @@
 __author__ = "Joel Dubowy"
 
 import copy
+import math
 from unittest import mock
 
 from py.test import raises
@@ -87,6 +88,55 @@ class TestSummarize(object):
         summary = fuelbeds.summarize(fires)
         assert summary == expected_summary
 
+    def test_two_fires_accumulated_in_totals(self):
+        # e.g. when fires are streamed through one at a time
+        fires = [
+            Fire({
+                'activity':[{
+                    "active_areas":[{
+                        "specified_points": [{
+                            "area": 10,
+                            "lat": 45,
+                            "lng": -118,
+                            "fuelbeds":[
+                                {"fccs_id": "1", "pct": 30},
+                                {"fccs_id": "2", "pct": 70}
+                            ]
+                        }]
+                    }]
+                }]
+            }),
+            Fire({
+                'activity':[{
+                    "active_areas":[{
+                        "specified_points": [{
+                            "area": 5,
+                            "lat": 44,
+                            "lng": -117,
+                            "fuelbeds":[
+                                {"fccs_id": "2", "pct": 10},
+                                {"fccs_id": "3", "pct": 90}
+                            ]
+                        }]
+                    }]
+                }]
+            })
+        ]
+        totals = {}
+        summary = fuelbeds.summarize(fires[:1], totals=totals)
+        assert summary == [
+            {"fccs_id": "1", "pct": 30},
+            {"fccs_id": "2", "pct": 70}
+        ]
+        summary = fuelbeds.summarize(fires[1:], totals=totals)
+        assert summary == [
+            {"fccs_id": "1", "pct": 20},
+            {"fccs_id": "2", "pct": 50},
+            {"fccs_id": "3", "pct": 30}
+        ]
+        assert totals['total_area'] == 15
+        assert fuelbeds.summarize([], totals=totals) == summary
+
     # TODO: def test_two_fires_two_activity_each(self):
 ##
 ## Tests for Estimator.estimate
@@ -566,3 +616,172 @@ class TestEstimatorPercentageAdjustment(object):
             {'fccs_id': 323, 'pct': 40.0}
         ]
         assert expected == actual
+
+
+##
+## Tests for point lookup caching
+##
+
+class FakeLookUp(object):
+
+    _filename = 'fccs.nc'
+
+    def __init__(self, fuelbed_info):
+        self.fuelbed_info = fuelbed_info
+        self.geo_data = []
+
+    def look_up(self, geo_data):
+        self.geo_data.append(geo_data)
+        return self.fuelbed_info
+
+def _point(lat, lng):
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+class FakeFccsGrid(object):
+    """0.01 degree cells"""
+
+    def __init__(self, raster_file):
+        self.raster_file = raster_file
+
+    def get_cell(self, lat, lng):
+        return int(math.floor(lat * 100)), int(math.floor(lng * 100))
+
+def monkeypatch_grid(monkeypatch):
+    monkeypatch.setattr(fuelbeds, 'FccsGrid', FakeFccsGrid)
+
+class TestPointLookupCache(object):
+
+    def test_raster_cells(self, reset_config, monkeypatch):
+        monkeypatch_grid(monkeypatch)
+        cache = fuelbeds.PointLookupCache()
+        lookup = FakeLookUp(FUELBED_INFO_60_40)
+        assert cache.look_up(lookup, _point(46.0, -120.341)) == FUELBED_INFO_60_40
+        # same cell
+        assert cache.look_up(lookup, _point(46.001, -120.349)) == FUELBED_INFO_60_40
+        # adjacent cell
+        assert cache.look_up(lookup, _point(46.0, -120.351)) == FUELBED_INFO_60_40
+        assert cache.look_up(lookup, _point(46.0, -120.341),
+            is_alaska=True) == FUELBED_INFO_60_40
+        assert lookup.geo_data == [_point(46.0, -120.341),
+            _point(46.0, -120.351), _point(46.0, -120.341)]
+        assert cache.info() == {'hits': 1, 'misses': 3, 'hit_rate': 0.25,
+            'size': 3}
+
+    def test_configured_raster_file(self, reset_config, monkeypatch):
+        monkeypatch_grid(monkeypatch)
+        cache = fuelbeds.PointLookupCache()
+        cache.look_up(FakeLookUp(FUELBED_INFO_60_40), _point(46.0, -120.34))
+        assert cache._grids[False].raster_file == 'fccs.nc'
+
+        Config().set('foo.nc', 'fuelbeds', 'fccs_fuelload_file')
+        cache = fuelbeds.PointLookupCache()
+        cache.look_up(FakeLookUp(FUELBED_INFO_60_40), _point(46.0, -120.34))
+        assert cache._grids[False].raster_file == 'foo.nc'
+
+    def test_unreadable_raster(self, reset_config, monkeypatch):
+        def _grid(raster_file):
+            raise RuntimeError("No such file")
+        monkeypatch.setattr(fuelbeds, 'FccsGrid', _grid)
+        cache = fuelbeds.PointLookupCache()
+        lookup = FakeLookUp(FUELBED_INFO_60_40)
+        assert cache.look_up(lookup, _point(46.0, -120.34)) == FUELBED_INFO_60_40
+        assert cache.look_up(lookup, _point(46.0, -120.34)) == FUELBED_INFO_60_40
+        assert len(lookup.geo_data) == 2
+        assert cache.info() == {'hits': 0, 'misses': 0, 'hit_rate': None,
+            'size': 0}
+
+    def test_failures_not_cached(self, reset_config, monkeypatch):
+        monkeypatch_grid(monkeypatch)
+        cache = fuelbeds.PointLookupCache()
+        lookup = FakeLookUp({})
+        assert cache.look_up(lookup, _point(46.0, -120.34)) == {}
+        assert cache.look_up(lookup, _point(46.0, -120.34)) == {}
+        assert len(lookup.geo_data) == 2
+        assert cache.info()['size'] == 0
+
+    def test_cache_file(self, reset_config, monkeypatch, tmpdir):
+        monkeypatch_grid(monkeypatch)
+        cache_file = str(tmpdir.join('fuelbeds-cache.json'))
+        cache = fuelbeds.PointLookupCache(cache_file=cache_file)
+        lookup = FakeLookUp(FUELBED_INFO_60_40)
+        cache.look_up(lookup, _point(46.0, -120.34))
+        cache.save()
+
+        cache = fuelbeds.PointLookupCache(cache_file=cache_file)
+        assert cache.look_up(lookup, _point(46.0, -120.34)) == FUELBED_INFO_60_40
+        assert len(lookup.geo_data) == 1
+        assert cache.info()['hits'] == 1
+
+        # ignored if written with different lookup config
+        Config().set(['0'], 'fuelbeds', 'ignored_fuelbeds')
+        cache = fuelbeds.PointLookupCache(cache_file=cache_file)
+        cache.look_up(lookup, _point(46.0, -120.34))
+        assert len(lookup.geo_data) == 2
+
+        # but not if only truncation settings differ
+        Config().set(['0', '900'], 'fuelbeds', 'ignored_fuelbeds')
+        Config().set(3, 'fuelbeds', 'truncation_count_threshold')
+        cache = fuelbeds.PointLookupCache(cache_file=cache_file)
+        cache.look_up(lookup, _point(46.0, -120.34))
+        assert len(lookup.geo_data) == 2
+
+    def test_refused_in_process_pool(self, reset_config):
+        assert fuelbeds._create_lookup_cache() is None
+        Config().set(True, 'fuelbeds', 'lookup_cache')
+        assert isinstance(fuelbeds._create_lookup_cache(),
+            fuelbeds.PointLookupCache)
+
+        # lookups would be made with copies of the cache in worker processes
+        Config().set('process_pool', 'executor', 'type')
+        assert fuelbeds._create_lookup_cache() is None
+
+class FakeInverseTransform(object):
+    """Inverse of a transform of 30m cells with upper left corner at the
+    origin
+    """
+
+    def __mul__(self, xy):
+        return xy[0] / 30.0, -xy[1] / 30.0
+
+class TestFccsGrid(object):
+
+    def test_get_cell(self):
+        grid = fuelbeds.FccsGrid.__new__(fuelbeds.FccsGrid)
+        grid._crs = 'EPSG:5070'
+        grid._inverse_transform = FakeInverseTransform()
+        # (x, y) are (lng, lat) scaled to meters, for testing
+        grid._transform = lambda src_crs, dst_crs, xs, ys: (
+            [x * 1000 for x in xs], [y * 1000 for y in ys])
+
+        assert grid.get_cell(-0.001, 0.001) == (0, 0)
+        assert grid.get_cell(-0.029, 0.029) == (0, 0)
+        assert grid.get_cell(-0.031, 0.061) == (1, 2)
+        assert grid.get_cell(0.001, -0.001) == (-1, -1)
+
+class TestEstimatorWithCachedLookUp(object):
+
+    def test_truncated_per_location(self, reset_config, monkeypatch):
+        monkeypatch_grid(monkeypatch)
+        cache = fuelbeds.PointLookupCache()
+        lookup = FakeLookUp(FUELBED_INFO_24_12_48_12_4)
+        estimator = fuelbeds.Estimator(
+            fuelbeds.CachedFccsLookUp(lookup, cache, False))
+        locs = [{"lat": 46.0, 'lng': -120.34}, {"lat": 46.0, 'lng': -120.34}]
+        for loc in locs:
+            estimator.estimate(loc)
+        expected_fuelbeds = [
+            {'fccs_id': "48", 'pct': 50.0},
+            {'fccs_id': "46", 'pct': 25.0},
+            {'fccs_id': "47", 'pct': 12.5},
+            {'fccs_id': "49", 'pct': 12.5}
+        ]
+        assert locs[0]['fuelbeds'] == locs[1]['fuelbeds'] == expected_fuelbeds
+        assert locs[0]['fuelbeds'] is not locs[1]['fuelbeds']
+        assert len(lookup.geo_data) == 1
+
+        # polygons aren't cached
+        perimeter = {"polygon": [[-84.8194, 30.5222], [-84.8197, 30.5209],
+            [-84.8193, 30.5235], [-84.8194, 30.5222]]}
+        estimator.estimate(perimeter)
+        estimator.estimate(perimeter)
+        assert len(lookup.geo_data) == 3
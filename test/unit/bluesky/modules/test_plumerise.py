@@ -2,7 +2,10 @@
 
 __author__ = "Joel Dubowy"
 
+import copy
 import datetime
+import os
+import time
 
 from py.test import raises
 from plumerise import sev, feps
@@ -302,6 +305,93 @@ class TestPlumeRiseRunFeps(object):
         ]
         # TOOD: assert plumerise return value
 
+    def test_worker_pool(self, reset_config, monkeypatch):
+        monkeypatch_plumerise_class(monkeypatch)
+        Config().set(2, 'plumerise', 'num_workers')
+        Config().set(True, 'skip_failed_fires')
+
+        fm = FiresManager()
+        fm.load({"fires": [copy.deepcopy(FIRE_MISSING_CONSUMPTION),
+            copy.deepcopy(FIRE)]})
+        plumerise.run(fm)
+
+        assert len(fm.fires) == 1
+        assert len(fm.failed_fires) == 1
+        locs = fm.fires[0].locations
+        assert [l['plumerise'] for l in locs] == ["compute return value"] * 2
+
+        # calls are made in the worker processes
+        assert _PR_COMPUTE_CALL_ARGS == []
+
+        worker_pool_info = fm.processing[-1]['worker_pool']
+        assert worker_pool_info['num_workers'] == 2
+        assert worker_pool_info['num_calls'] == 2
+
+    def test_worker_pool_with_working_dir(self, reset_config, monkeypatch,
+            tmpdir):
+        monkeypatch_plumerise_class(monkeypatch)
+        Config().set(2, 'plumerise', 'num_workers')
+        Config().set(str(tmpdir), 'plumerise', 'feps', 'working_dir')
+
+        fm = FiresManager()
+        fm.load({"fires": [copy.deepcopy(FIRE)]})
+        plumerise.run(fm)
+
+        worker_dirs = [os.path.join(str(tmpdir), 'feps-plumerise-worker-0'),
+            os.path.join(str(tmpdir), 'feps-plumerise-worker-1')]
+        assert all([os.path.isdir(d) for d in worker_dirs])
+        assert [l['plumerise'] for l in fm.fires[0].locations] == [
+            "compute return value"] * 2
+
+
+class ChdirPlumeRise(object):
+    """Changes into the working dir, as FEPSPlumeRise.compute does"""
+
+    def compute(self, *args, working_dir=None):
+        if args[0] == 'fail':
+            raise ValueError("failed")
+        os.chdir(working_dir)
+        time.sleep(0.05)
+        return {"hours": (args[0], os.getpid(), os.getcwd())}
+
+class TestFepsWorkerPool(object):
+
+    def test_compute(self, tmpdir):
+        cwd = os.getcwd()
+        pool = plumerise.FepsWorkerPool(ChdirPlumeRise(), 2,
+            working_dir=str(tmpdir))
+        results = pool.compute([(i,) for i in range(6)] + [('fail',)])
+
+        assert os.getcwd() == cwd
+        assert [r[0]['hours'][0] for r in results[:-1]] == list(range(6))
+        assert results[-1][0] is None
+        assert isinstance(results[-1][1], ValueError)
+
+        # each worker process uses its own working dir
+        worker_dirs = {}
+        for data, exc in results[:-1]:
+            _, pid, working_dir = data['hours']
+            assert worker_dirs.setdefault(pid, working_dir) == working_dir
+        assert len(set(worker_dirs.values())) == len(worker_dirs)
+        assert set(worker_dirs.values()).issubset([
+            os.path.join(str(tmpdir), 'feps-plumerise-worker-0'),
+            os.path.join(str(tmpdir), 'feps-plumerise-worker-1')])
+
+        info = pool.info()
+        assert info['num_workers'] == 2
+        assert info['num_calls'] == 7
+
+    def test_compute_temp_dirs(self):
+        cwd = os.getcwd()
+        pool = plumerise.FepsWorkerPool(ChdirPlumeRise(), 2)
+        results = pool.compute([(i,) for i in range(4)])
+
+        assert os.getcwd() == cwd
+        assert all([exc is None for data, exc in results])
+        # temp working dirs are deleted
+        for data, exc in results:
+            assert not os.path.exists(data['hours'][2])
+
 class TestPlumeRiseRunSev(object):
 
     def setup(self):
@@ -414,3 +504,47 @@ class TestPlumeRiseRunSev(object):
             {'frp': None}
         ]
         # TOOD: assert plumerise return value
+
+
+class MockSun(object):
+
+    def __init__(self, lat, lng):
+        _SUN_CALLS.append((lat, lng))
+        self.lng = lng
+
+    def sunrise_hr(self, d, utc_offset):
+        return 6 + int(self.lng)
+
+    def sunset_hr(self, d, utc_offset):
+        return 18 + int(self.lng)
+
+class TestSunriseSunsetCache(object):
+
+    def setup(self):
+        global _SUN_CALLS
+        _SUN_CALLS = []
+
+    def test_with_precision(self, monkeypatch):
+        monkeypatch.setattr(plumerise.sun, 'Sun', MockSun)
+        d = datetime.date(2015, 8, 4)
+        cache = plumerise.SunriseSunsetCache(precision=2)
+        assert cache.get(45.0, -1.0, d, -7.0) == (5, 17)
+        assert cache.get(45.001, -1.001, d, -7.0) == (5, 17)
+        # different cell, date, or utc offset
+        assert cache.get(45.01, -1.0, d, -7.0) == (5, 17)
+        assert cache.get(45.0, -1.0, datetime.date(2015, 8, 5), -7.0) == (5, 17)
+        assert cache.get(45.0, -1.0, d, -6.0) == (5, 17)
+        assert _SUN_CALLS == [(45.0, -1.0), (45.01, -1.0), (45.0, -1.0),
+            (45.0, -1.0)]
+        assert cache.info() == {
+            "hits": 1, "misses": 4, "hit_rate": 0.2, "size": 4}
+
+    def test_without_precision(self, monkeypatch):
+        monkeypatch.setattr(plumerise.sun, 'Sun', MockSun)
+        d = datetime.date(2015, 8, 4)
+        cache = plumerise.SunriseSunsetCache()
+        cache.get(45.0, -1.0, d, 0.0)
+        cache.get(45.001, -1.0, d, 0.0)
+        cache.get(45.0, -1.0, d, 0.0)
+        assert _SUN_CALLS == [(45.0, -1.0), (45.001, -1.0)]
+        assert cache.info()['hits'] == 1
@@ -153,4 +153,47 @@ class TestTimeprofilingRunFire(object):
         }
         timeprofile._run_fire(None, fire)
         actual = fire['activity'][0]['active_areas'][0]['timeprofile']
-        assert actual == expected
\ No newline at end of file
+        assert actual == expected
+    def test_shared_timeprofiles(self, reset_config, monkeypatch):
+        profiler_args = []
+        static_time_profiler = timeprofile.StaticTimeProfiler
+        def _profiler(*args, **kwargs):
+            profiler_args.append(args)
+            return static_time_profiler(*args, **kwargs)
+        monkeypatch.setattr(timeprofile, 'StaticTimeProfiler', _profiler)
+
+        def _fire(*windows):
+            return fires.Fire({
+                "activity": [
+                    {
+                        "active_areas": [
+                            {"start": s, "end": e} for s, e in windows
+                        ]
+                    }
+                ]
+            })
+        fire_1 = _fire(
+            ("2015-01-20T00:00:00", "2015-01-20T02:00:00"),
+            ("2015-01-20T00:00:00", "2015-01-20T02:00:00"),
+            ("2015-01-21T00:00:00", "2015-01-21T02:00:00")
+        )
+        fire_2 = _fire(
+            ("2015-01-20T00:00:00", "2015-01-20T02:00:00")
+        )
+
+        timeprofiles = {}
+        timeprofile._run_fire(None, fire_1, timeprofiles)
+        timeprofile._run_fire(None, fire_2, timeprofiles)
+        assert len(profiler_args) == 2
+        assert len(timeprofiles) == 2
+
+        active_areas = fire_1.active_areas + fire_2.active_areas
+        assert active_areas[0]['timeprofile'] is active_areas[1]['timeprofile']
+        assert active_areas[0]['timeprofile'] is active_areas[3]['timeprofile']
+        assert active_areas[2]['timeprofile'] is not active_areas[0]['timeprofile']
+        assert list(active_areas[2]['timeprofile'].keys()) == [
+            "2015-01-21T00:00:00", "2015-01-21T01:00:00"]
+
+        # without a dict of timeprofiles, they're shared only within the fire
+        timeprofile._run_fire(None, fire_1)
+        assert len(profiler_args) == 4
@@ -30,7 +30,7 @@ class MockFiresManager(object):
         return klass
 
     def summarize(self, **summary):
-        self.summary = summary
+        self.summary = dict(getattr(self, 'summary', {}), **summary)
 
 
 class TestSummarizeAllLevels(object):
@@ -454,5 +454,142 @@ class TestSummarizeAllLevels(object):
         }
         assert fm.summary == expected_summary
 
+    def test_multiple_keys_and_children(self):
+        def _loc(fuelbeds):
+            return {'area': 34, 'lat': 45.0, 'lng': -120.0, "fuelbeds": fuelbeds}
+        fm = MockFiresManager([
+            {
+                "id": "SF11C14225236095807750",
+                "activity": [{
+                    "active_areas": [
+                        {
+                            'specified_points': [
+                                _loc([{
+                                    "emissions": {"flaming": {"PM2.5": [10]}},
+                                    "heat": {"flaming": [100], "total": [100]}
+                                }]),
+                                _loc([{
+                                    "emissions": {"smoldering": {"PM2.5": [7], "CO": [3]}},
+                                    "heat": {"smoldering": [50], "total": [50]}
+                                }])
+                            ]
+                        },
+                        {
+                            'specified_points': [_loc([])]
+                        }
+                    ]
+                }]
+            }
+        ])
+        datautils.summarize_all_levels(fm, 'emissions', 'heat')
+
+        aas = fm.fires[0]['activity'][0]['active_areas']
+        assert aas[0]['specified_points'][0]['emissions'] == {'summary': {'PM2.5': 10.0, 'total': 10.0}}
+        assert aas[0]['specified_points'][0]['heat'] == {'summary': {'flaming': 100.0, 'total': 100.0}}
+        assert aas[0]['specified_points'][1]['emissions'] == {'summary': {'PM2.5': 7.0, 'CO': 3.0, 'total': 10.0}}
+        assert aas[1]['specified_points'][0]['emissions'] == {'summary': {'total': 0.0}}
+        assert aas[1]['emissions'] == {'summary': {'total': 0.0}}
+        assert aas[1]['heat'] == {'summary': {'total': 0.0}}
+        for obj in (aas[0], fm.fires[0]['activity'][0], fm.fires[0]):
+            assert obj['emissions'] == {'summary': {'PM2.5': 17.0, 'CO': 3.0, 'total': 20.0}}
+            assert obj['heat'] == {'summary': {'flaming': 100.0, 'smoldering': 50.0, 'total': 150.0}}
+
+        assert fm.summary['emissions'] == {
+            "flaming": {"PM2.5": [10.0]},
+            "smoldering": {"PM2.5": [7.0], "CO": [3.0]},
+            'summary': {'PM2.5': 17.0, 'CO': 3.0, 'total': 20.0}
+        }
+        assert fm.summary['heat'] == {
+            "flaming": [100.0],
+            "smoldering": [50.0],
+            'summary': {'flaming': 100.0, 'smoldering': 50.0, 'total': 150.0}
+        }
+
+    def test_only_locations_summarized(self, monkeypatch):
+        calls = []
+        summarize = datautils.summarize
+        def _summarize(locations, key, include_details=True):
+            calls.append(len(locations))
+            return summarize(locations, key, include_details=include_details)
+        monkeypatch.setattr(datautils, 'summarize', _summarize)
+
+        def _fire(pm25):
+            return {"activity": [{"active_areas": [{'specified_points': [
+                {'area': 34, 'lat': 45.0, 'lng': -120.0, "fuelbeds": [
+                    {"emissions": {"flaming": {"PM2.5": [pm25]}}}]}
+            ] * 2}]}]}
+
+        fm = MockFiresManager([_fire(10), _fire(5)])
+        datautils.summarize_all_levels(fm, 'emissions')
+        assert calls == [1] * 4
+        assert fm.fires[0]['emissions'] == {'summary': {'PM2.5': 20.0, 'total': 20.0}}
+        assert fm.summary['emissions'] == {
+            "flaming": {"PM2.5": [30.0]},
+            'summary': {'PM2.5': 30.0, 'total': 30.0}
+        }
+
+    def test_same_as_summarizing_each_level(self):
+        def _fires():
+            return [
+                {
+                    "id": str(n),
+                    "activity": [
+                        {"active_areas": [
+                            {'specified_points': [
+                                _loc(i + j + k) for k in range(3)]}
+                            for j in range(2)
+                        ]}
+                        for i in range(2)
+                    ] + [{"active_areas": [{'specified_points': [_loc(None)]}]}]
+                } for n in range(4)
+            ] + [{"id": "4", "activity": [
+                {"active_areas": [{'specified_points': [_loc(9)]}]}]}]
+
+        def _loc(n):
+            if n is None:
+                fuelbeds = []
+            else:
+                fuelbeds = [
+                    {
+                        "emissions": {
+                            "flaming": {"PM2.5": [0.25 * n], "CO": [1.5]},
+                            "residual": {"PM2.5": [0.125 * n]}
+                        },
+                        "heat": {"flaming": [n + 0.5], "total": [n + 0.5]}
+                    },
+                    {
+                        "emissions": {"smoldering": {"CO": [0.75 * n]}},
+                        "heat": {"smoldering": [2.0 * n], "total": [2.0 * n]}
+                    }
+                ]
+            return {'area': 34, 'lat': 45.0, 'lng': -120.0, "fuelbeds": fuelbeds}
+
+        def _summarize(obj, key):
+            locations = [loc for loc in obj.locations if loc.get('fuelbeds')]
+            obj[key] = datautils.summarize(locations, key, include_details=False)
+
+        # how summaries were computed before summarize_all_levels reused
+        # children's summaries
+        expected = MockFiresManager(_fires())
+        for key in ('emissions', 'heat'):
+            for fire in expected.fires:
+                for ac in fire['activity']:
+                    for aa in ac.active_areas:
+                        for loc in aa.locations:
+                            loc[key] = datautils.summarize(
+                                [loc] if loc.get('fuelbeds') else [], key,
+                                include_details=False)
+                        _summarize(aa, key)
+                    _summarize(ac, key)
+                _summarize(fire, key)
+            expected.summarize(**{key: datautils.summarize(
+                [loc for f in expected.fires for loc in f.locations
+                    if loc.get('fuelbeds')], key)})
+
+        fm = MockFiresManager(_fires())
+        datautils.summarize_all_levels(fm, 'emissions', 'heat')
+        assert fm.fires == expected.fires
+        assert fm.summary == expected.summary
+
     def test_multi(self):
         pass
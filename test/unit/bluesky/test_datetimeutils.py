@@ -374,6 +374,29 @@ class TestToDatetime(object):
         assert dt == datetime.datetime(2015, 12, 14, 2, 1, 23)
 
 
+class TestHourlyKeys(object):
+
+    def test_format(self):
+        for dt in (datetime.datetime(2015, 1, 2, 3, 0, 0),
+                datetime.datetime(2016, 12, 31, 23, 59, 59)):
+            assert datetimeutils.format_hourly_key(dt) == dt.strftime(
+                datetimeutils.HOURLY_KEY_FORMAT)
+        assert datetimeutils.format_hourly_key(
+            datetime.datetime(2015, 1, 2, 3, 0, 0)) == '2015-01-02T03:00:00'
+
+    def test_parse(self):
+        dt = datetime.datetime(2015, 1, 2, 3, 0, 0)
+        assert datetimeutils.parse_hourly_key('2015-01-02T03:00:00') == dt
+        assert datetimeutils.parse_hourly_key(dt) is dt
+        # other formats fall back on the general parser
+        assert datetimeutils.parse_hourly_key('2015-01-02T03:00:00Z') == dt
+
+    def test_parse_invalid(self):
+        with raises(Exception):
+            datetimeutils.parse_hourly_key('2015-13-02T03:00:00')
+        with raises(Exception):
+            datetimeutils.parse_hourly_key('foo')
+
 
 class TestSeasonFromDate(object):
 
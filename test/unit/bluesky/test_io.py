@@ -3,6 +3,7 @@
 __author__ = "Joel Dubowy"
 
 import logging
+import os
 import sys
 import time
 from collections import defaultdict
@@ -365,6 +366,30 @@ class TestSubprocessExecutor(object):
             ((10, '%s: %s', 'echo', 'hello'), {})
         ]
 
+    def test_rusage_realtime_logging(self, monkeypatch):
+        self.monkeypatch_logging(monkeypatch)
+
+        executor = io.SubprocessExecutor()
+        assert executor.rusage is None
+        executor.execute(['echo', 'hello'], realtime_logging=True)
+        if hasattr(os, 'wait4'):
+            assert executor.rusage.ru_maxrss > 0
+
+    def test_returncode(self, monkeypatch):
+        self.monkeypatch_logging(monkeypatch)
+
+        for realtime_logging in (True, False):
+            executor = io.SubprocessExecutor()
+            assert executor.returncode is None
+            executor.execute(['true'], realtime_logging=realtime_logging)
+            assert executor.returncode == 0
+
+            with raises(BlueSkySubprocessError) as e_info:
+                executor.execute(['sh', '-c', 'exit 3'],
+                    realtime_logging=realtime_logging)
+            assert e_info.value.returncode == 3
+            assert executor.returncode == 3
+
     ## Post-execution output logging
 
     def test_invalid_executable_post_logging(self, monkeypatch):
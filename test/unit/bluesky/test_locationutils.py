@@ -2,9 +2,14 @@
 
 __author__ = "Joel Dubowy"
 
+import json
+import os
+
 from py.test import raises
+from shapely.geometry import Point, box
 
 from bluesky import  locationutils
+from bluesky.models.activity import ActiveArea
 
 
 class TestLatLng(object):
@@ -202,3 +207,194 @@ class TestLatLngPerimeter(object):
         })
         assert latlng.latitude == 33
         assert latlng.longitude == -100.25
+
+
+class TestLatLngCaching(object):
+
+    def _patch(self, monkeypatch):
+        self.num_centroids = 0
+        def get_centroid(geo_data):
+            self.num_centroids += 1
+            coords = (geo_data['coordinates'][0]
+                if geo_data['type'] == 'Polygon' else geo_data['coordinates'])
+            return [sum(c[0] for c in coords) / len(coords),
+                sum(c[1] for c in coords) / len(coords)]
+        monkeypatch.setattr(locationutils, 'get_centroid', get_centroid)
+
+    def test_specified_points(self, monkeypatch):
+        self._patch(monkeypatch)
+        aa = ActiveArea({'specified_points': [
+            {'area': 1, 'lat': 45.0, 'lng': -120.0},
+            {'area': 1, 'lat': 47.0, 'lng': -122.0}
+        ]})
+        for i in range(3):
+            latlng = locationutils.LatLng(aa)
+            assert (latlng.latitude, latlng.longitude) == (46.0, -121.0)
+        assert self.num_centroids == 1
+
+        # non-geometry changes don't invalidate
+        aa['start'] = "2014-05-25T17:00:00"
+        aa['specified_points'][0]['fuelbeds'] = []
+        locationutils.LatLng(aa)
+        assert self.num_centroids == 1
+
+        aa['specified_points'][1]['lat'] = 49.0
+        latlng = locationutils.LatLng(aa)
+        assert (latlng.latitude, latlng.longitude) == (47.0, -121.0)
+        assert self.num_centroids == 2
+
+        aa['specified_points'].pop()
+        latlng = locationutils.LatLng(aa)
+        assert (latlng.latitude, latlng.longitude) == (45.0, -120.0)
+        assert self.num_centroids == 2
+
+    def test_perimeter(self, monkeypatch):
+        self._patch(monkeypatch)
+        aa = ActiveArea({'perimeter': {'polygon': [
+            [-121.0, 47.0], [-120.0, 47.0], [-120.0, 46.0], [-121.0, 47.0]
+        ]}})
+        perimeter = aa['perimeter']
+        for loc in (aa, perimeter, aa, perimeter):
+            latlng = locationutils.LatLng(loc)
+            assert (latlng.latitude, latlng.longitude) == (46.75, -120.5)
+        assert self.num_centroids == 2
+
+        perimeter['polygon'].insert(3, [-121.0, 46.0])
+        latlng = locationutils.LatLng(perimeter)
+        assert (latlng.latitude, latlng.longitude) == (46.6, -120.6)
+        assert self.num_centroids == 3
+
+        # failures aren't cached
+        perimeter['polygon'] = None
+        with raises(ValueError) as e_info:
+            locationutils.LatLng(perimeter)
+        with raises(ValueError) as e_info:
+            locationutils.LatLng(perimeter)
+
+
+class TestPolygonIndex(object):
+
+    def test_containing(self):
+        index = locationutils.PolygonIndex([box(0, 0, 10, 10), box(5, 5, 6, 6),
+            box(20, 20, 21, 21), box(4, 4, 7, 7)])
+        assert index.containing(Point(5.5, 5.5)) == [0, 1, 3]
+        assert index.containing(Point(1, 1)) == [0]
+        assert index.containing(Point(15, 15)) == []
+
+
+def _fips_data(county_fips):
+    return {
+        'county_name': 'County ' + county_fips,
+        'county_fips': county_fips,
+        'state_name': None,
+        'state_fips': county_fips[:2],
+        'state_code': None
+    }
+
+COUNTY_INDEX = locationutils._CountyIndex(
+    [box(-122, 45, -121, 46), box(-121, 45, -120, 46), box(-119, 45, -118, 47),
+        box(-118.5, 46, -117, 47)],
+    [_fips_data('41001'), _fips_data('41003'), _fips_data('41005'),
+        _fips_data('41007')])
+
+class TestCountyIndex(object):
+
+    def test_lookup(self):
+        assert COUNTY_INDEX.lookup(45.5, -121.5) == _fips_data('41001')
+        assert COUNTY_INDEX.lookup(45.5, -120.5) == _fips_data('41003')
+        # outside of all counties
+        assert COUNTY_INDEX.lookup(45.5, -119.5) is None
+        # on the border of two counties
+        assert COUNTY_INDEX.lookup(45.5, -121) is None
+        # in two overlapping counties
+        assert COUNTY_INDEX.lookup(46.5, -118.25) is None
+
+class TestFipsResolver(object):
+
+    def _patch(self, monkeypatch):
+        self.county_lookups = []
+        self.api_queries = []
+
+        class FakeCountyIndex(object):
+            def lookup(fake_self, lat, lng):
+                self.county_lookups.append((lat, lng))
+                return COUNTY_INDEX.lookup(lat, lng)
+
+        def _query_fips_api(lat, lng):
+            self.api_queries.append((lat, lng))
+            if lng < -130:
+                raise RuntimeError("No network")
+            return _fips_data('99999')
+
+        monkeypatch.setattr(locationutils, '_county_index', FakeCountyIndex())
+        monkeypatch.setattr(locationutils, '_query_fips_api', _query_fips_api)
+
+    def test_invalid(self, monkeypatch):
+        self._patch(monkeypatch)
+        resolver = locationutils.FipsResolver()
+        with raises(ValueError) as e_info:
+            resolver.lookup_many([45.5, 'sdf'], [-121.5, -120.5])
+        assert e_info.value.args[0] == locationutils.INVALID_LAT_LNG_DATA
+
+        with raises(ValueError) as e_info:
+            resolver.lookup_many([45.5, 45.5], [-121.5])
+
+        with raises(ValueError) as e_info:
+            locationutils.FipsResolver(cache_file='foo.json')
+
+    def test_lookup_many_no_cache(self, monkeypatch):
+        self._patch(monkeypatch)
+        resolver = locationutils.FipsResolver()
+        assert resolver.lookup_many([45.5, '45.5', 45.5, 45.51],
+                [-121.5, -121.5, -119.5, -121.51]) == [
+            _fips_data('41001'), _fips_data('41001'), None, _fips_data('41001')
+        ]
+        # duplicate points are looked up once
+        assert self.county_lookups == [
+            (45.5, -121.5), (45.5, -119.5), (45.51, -121.51)]
+        assert self.api_queries == []
+
+        assert resolver.lookup(45.5, -121.5) == _fips_data('41001')
+        assert len(self.county_lookups) == 4
+
+    def test_api_fallback(self, monkeypatch):
+        self._patch(monkeypatch)
+        resolver = locationutils.FipsResolver(api_fallback=True)
+        assert resolver.lookup_many([45.5, 45.5, 45.5], [-121.5, -119.5, -140]) == [
+            _fips_data('41001'), _fips_data('99999'), None
+        ]
+        assert self.api_queries == [(45.5, -119.5), (45.5, -140)]
+
+    def test_cache(self, monkeypatch, tmpdir):
+        self._patch(monkeypatch)
+        cache_file = os.path.join(str(tmpdir), 'fips-cache.json')
+        resolver = locationutils.FipsResolver(cache_precision=1,
+            cache_file=cache_file)
+        assert resolver.lookup_many([45.5, 45.51, 45.5], [-121.5, -121.51, -119.5]) == [
+            _fips_data('41001'), _fips_data('41001'), None
+        ]
+        # 45.51,-121.51 rounds to the same lat/lng as 45.5,-121.5
+        assert self.county_lookups == [(45.5, -121.5), (45.5, -119.5)]
+
+        assert not os.path.exists(cache_file)
+        resolver.save()
+        with open(cache_file) as f:
+            assert json.loads(f.read()) == {
+                'precision': 1,
+                'fips': {'45.5,-121.5': _fips_data('41001')}
+            }
+
+        # new resolver loads cache from file; unresolved points aren't cached
+        resolver = locationutils.FipsResolver(cache_precision=1,
+            cache_file=cache_file)
+        assert resolver.lookup_many([45.52, 45.5], [-121.48, -119.5]) == [
+            _fips_data('41001'), None
+        ]
+        assert self.county_lookups == [
+            (45.5, -121.5), (45.5, -119.5), (45.5, -119.5)]
+
+        # cache file is ignored if precision differs
+        resolver = locationutils.FipsResolver(cache_precision=2,
+            cache_file=cache_file)
+        resolver.lookup(45.5, -121.5)
+        assert len(self.county_lookups) == 4